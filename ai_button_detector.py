@@ -6,19 +6,92 @@ Usa múltiples métodos de IA y análisis para encontrar botones cuando fallan l
 
 import cv2
 import numpy as np
-from PIL import Image, ImageGrab
-import pytesseract
-import win32gui
-import win32con
-import win32api
+from PIL import Image
+# Solo disponibles en Windows; el análisis de imágenes offline funciona sin ellos
+try:
+    import win32gui
+    import win32con
+    import win32api
+except ImportError:
+    win32gui = win32con = win32api = None
 import ctypes
 from ctypes import wintypes
 import time
 import re
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from frame_cache import FrameCache
+from box_fusion import merge_boxes
+from detection_set import DetectionSet
+from template_matcher import build_pyramid, match_template_pyramid
+from ocr_mosaic import build_mosaic, map_words_to_tiles
+from detection_cache import DetectionCache
+from instrumentation import span, count, traced
+from frame_source import resolve_frame_source
+from debug_writer import default_debug_writer
+from ocr_engine import resolve_ocr_pool
+
+
+# Palabras típicas de botones
+BUTTON_KEYWORDS = [
+    'next', 'siguiente', 'continue', 'continuar',
+    'install', 'instalar', 'setup', 'configurar',
+    'accept', 'aceptar', 'agree', 'acepto',
+    'ok', 'cancel', 'cancelar', 'finish', 'finalizar',
+    'close', 'cerrar', 'yes', 'si', 'no'
+]
+
+
+def _run_detection_method(detector, method_name, image):
+    """Ejecutar un método de detección (punto de entrada para el pool de procesos)"""
+    return detector._run_method(FrameCache.wrap(image), method_name)
+
+
+def draw_detections(screenshot, buttons):
+    """Dibujar las detecciones sobre una imagen BGR (se modifica y se devuelve)"""
+    colors = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255)]
+    
+    for i, button in enumerate(buttons):
+        x, y, w, h = button['bbox']
+        color = colors[i % len(colors)]
+        
+        # Dibujar rectángulo
+        cv2.rectangle(screenshot, (x, y), (x+w, y+h), color, 2)
+        
+        # Dibujar información
+        info = f"AI{i+1}: {button['method'][:10]} ({button['confidence']:.2f})"
+        cv2.putText(screenshot, info, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+        
+        # Dibujar centro
+        cx, cy = button['center']
+        cv2.circle(screenshot, (cx, cy), 3, color, -1)
+        
+        # Agregar texto del botón si existe
+        if 'text' in button and button['text']:
+            text_info = f"Text: {button['text'][:15]}"
+            cv2.putText(screenshot, text_info, (x, y+h+15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
+    
+    return screenshot
+
+
+class CancelToken:
+    """Señal para detener una detección en streaming desde otro punto del código"""
+    
+    def __init__(self):
+        self._event = threading.Event()
+    
+    def cancel(self):
+        self._event.set()
+    
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
 
 class AIButtonDetector:
-    def __init__(self, debug=True):
+    def __init__(self, debug=True, parallel=False, max_workers=None, executor='thread',
+                 cache_size=32, cache_ttl=30.0, frame_source=None, debug_writer=None, ocr=None):
         self.debug = debug
         self.detection_methods = [
             'edge_detection',
@@ -29,70 +102,291 @@ class AIButtonDetector:
             'gradient_analysis'
         ]
         
-    def capture_window_smart(self, hwnd=None):
-        """Captura inteligente de ventana que funciona mejor en Windows 11"""
+        # Ejecución paralela de métodos (OpenCV y Tesseract liberan el GIL)
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Executor no soportado: {executor}")
+        self.parallel = parallel
+        self.max_workers = max_workers or len(self.detection_methods)
+        self.executor_type = executor
+        self._executor = None
+        
+        # Matching de templates de grueso a fino (niveles de pirámide)
+        self.template_pyramid_levels = 1
+        self._template_cache = None
+        
+        # OCR: 'full' (pantalla completa, 3 psm) o 'cascade' (solo en candidatos geométricos)
+        self.text_mode = 'full'
+        self.cascade_proposal_methods = ['edge_detection', 'contour_analysis', 'gradient_analysis']
+        
+        # Se activa una sola vez antes de la primera captura
+        self._dpi_aware = None
+        
+        # Caché de resultados por hash de píxeles (cache_size=0 la desactiva)
+        self.result_cache = DetectionCache(cache_size, cache_ttl) if cache_size else None
+        
+        # De dónde salen las capturas (pantalla, directorio, video, generador)
+        self.frame_source = resolve_frame_source(frame_source)
+        
+        # Última captura completa (BGR), para grabación y debug sin recapturar
+        self.last_capture = None
+        
+        # Imágenes de debug en segundo plano (None = writer compartido por defecto)
+        self.debug_writer = debug_writer
+        
+        # Motores de OCR de larga vida (None = pool compartido por defecto)
+        self.ocr = ocr
+    
+    def __getstate__(self):
+        # El pool, la caché (con su lock) y algunas fuentes de frames no se pueden
+        # serializar al enviar el detector a otro proceso; los procesos solo detectan
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['result_cache'] = None
+        state['frame_source'] = None
+        state['debug_writer'] = None
+        state['ocr'] = None
+        return state
+    
+    def _get_executor(self):
+        """Crear el pool de ejecución bajo demanda"""
+        if self._executor is None:
+            if self.executor_type == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='ai_detector')
+        return self._executor
+    
+    def close(self):
+        """Liberar el pool de ejecución paralela"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        
+    def _ensure_dpi_awareness(self):
+        """Activar DPI awareness una sola vez (afecta a todo el proceso)"""
+        if self._dpi_aware is None:
+            try:
+                ctypes.windll.shcore.SetProcessDpiAwareness(2)
+                self._dpi_aware = True
+            except:
+                self._dpi_aware = False
+        return self._dpi_aware
+    
+    def capture_window_smart(self, hwnd=None, screenshot=None):
+        """
+        Captura inteligente de ventana que funciona mejor en Windows 11
+        (screenshot = captura RGB ya tomada, opcional)
+        """
         methods = []
         
-        # Método 1: Screenshot tradicional
+        # Una sola captura: con DPI awareness activo la captura 'traditional' y la
+        # 'dpi_aware' son idénticas, así que no tiene sentido tomar dos
+        dpi_aware = self._ensure_dpi_awareness()
         try:
-            screenshot = np.array(ImageGrab.grab())
+            if screenshot is None:
+                screenshot = self.frame_source.grab()
+            if screenshot is None:
+                return methods
             screenshot = cv2.cvtColor(screenshot, cv2.COLOR_RGB2BGR)
-            methods.append(('traditional', screenshot))
         except:
-            pass
-            
-        # Método 2: Captura de ventana específica
+            return methods
+        self.last_capture = screenshot
+        methods.append(('dpi_aware' if dpi_aware else 'traditional', screenshot))
+        
+        # La ventana es una vista (sin copia) de la misma captura
         if hwnd:
             try:
-                # Obtener dimensiones de ventana
-                rect = win32gui.GetWindowRect(hwnd)
-                x, y, x2, y2 = rect
-                width, height = x2 - x, y2 - y
+                x, y, x2, y2 = win32gui.GetWindowRect(hwnd)
+                height, width = screenshot.shape[:2]
+                x, y = max(x, 0), max(y, 0)
+                x2, y2 = min(x2, width), min(y2, height)
                 
-                # Capturar solo esa región
-                window_screenshot = np.array(ImageGrab.grab(bbox=(x, y, x2, y2)))
-                window_screenshot = cv2.cvtColor(window_screenshot, cv2.COLOR_RGB2BGR)
-                methods.append(('window_specific', window_screenshot, (x, y)))
+                window_view = screenshot[y:y2, x:x2]
+                if window_view.size > 0 and window_view.shape != screenshot.shape:
+                    methods.append(('window_specific', window_view, (x, y)))
             except:
                 pass
-        
-        # Método 3: Captura con DPI awareness
-        try:
-            # Configurar DPI awareness temporalmente
-            ctypes.windll.shcore.SetProcessDpiAwareness(2)
-            dpi_screenshot = np.array(ImageGrab.grab())
-            dpi_screenshot = cv2.cvtColor(dpi_screenshot, cv2.COLOR_RGB2BGR)
-            methods.append(('dpi_aware', dpi_screenshot))
-        except:
-            pass
             
         return methods
     
-    def detect_buttons_ai(self, image, method='all'):
+    @traced('detect.buttons_ai')
+    def detect_buttons_ai(self, image, method='all', parallel=None):
         """Detectar botones usando múltiples métodos de IA"""
+        # Un solo FrameCache por captura: los planos derivados se calculan una vez
+        image = FrameCache.wrap(image)
+        
+        # Pantalla idéntica con la misma configuración: devolver lo ya detectado
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = (image.digest(), method, self._config_key())
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                count('detection_cache_hits')
+                return cached
+        
+        count('pixels_processed', image.shape[0] * image.shape[1])
+        
         if method == 'all':
+            buttons = self.merge_candidates(self.detect_candidates(image, parallel))
+        else:
+            buttons = getattr(self, f'_detect_{method}')(image)
+        
+        if cache_key is not None:
+            self.result_cache.put(cache_key, buttons)
+        return buttons
+    
+    def detect_candidates(self, image, parallel=None):
+        """
+        Detecciones sin fusionar de cada método ({método: botones}). Las listas
+        están memorizadas en el frame: no modificarlas
+        """
+        image = FrameCache.wrap(image)
+        if parallel is None:
+            parallel = self.parallel
+        
+        if parallel:
+            return self._run_methods_parallel(image)
+        
+        results = {}
+        for detection_method in self.detection_methods:
+            try:
+                results[detection_method] = self._run_method(image, detection_method)
+            except Exception as e:
+                if self.debug:
+                    print(f"⚠️ Método {detection_method} falló: {e}")
+        return results
+    
+    def merge_candidates(self, results):
+        """Fusionar las detecciones de detect_candidates (como detect_buttons_ai)"""
+        # Orden determinista: siempre en el orden de self.detection_methods
+        all_buttons = []
+        for detection_method in self.detection_methods:
+            all_buttons.extend(results.get(detection_method, []))
+        
+        # Fusionar detecciones superpuestas
+        buttons = self._merge_overlapping_detections(all_buttons)
+        count('candidates_before_merge', len(all_buttons))
+        count('candidates_after_merge', len(buttons))
+        return buttons
+    
+    def _config_key(self):
+        """Parámetros que influyen en el resultado de la detección"""
+        return (tuple(self.detection_methods), self.text_mode,
+                tuple(self.cascade_proposal_methods), self.template_pyramid_levels)
+    
+    def _run_method(self, frame, detection_method):
+        """
+        Ejecutar un método una sola vez por frame y configuración (el modo cascada
+        reutiliza sus resultados; otro detector o configuración no los comparte)
+        """
+        def run():
+            with span(f'detect.{detection_method}'):
+                return getattr(self, f'_detect_{detection_method}')(frame)
+        
+        return frame.memo(('detections', detection_method, self._config_key()), run)
+    
+    def _run_methods_parallel(self, frame):
+        """Lanzar todos los métodos en el pool y recoger resultados según terminan"""
+        executor = self._get_executor()
+        
+        # Los hilos comparten el FrameCache; los procesos reciben el array crudo
+        payload = frame.image if self.executor_type == 'process' else frame
+        
+        futures = {
+            executor.submit(_run_detection_method, self, detection_method, payload): detection_method
+            for detection_method in self.detection_methods
+        }
+        
+        results = {}
+        for future in as_completed(futures):
+            detection_method = futures[future]
+            try:
+                results[detection_method] = future.result()
+            except Exception as e:
+                if self.debug:
+                    print(f"⚠️ Método {detection_method} falló: {e}")
+        
+        return results
+    
+    def iter_detections(self, image, cancel=None, methods=None, parallel=None):
+        """
+        Detectar en streaming: tras terminar cada método produce (método, botones),
+        con los botones fusionados de todos los métodos terminados hasta ese momento.
+        methods fija el orden en modo secuencial (por defecto self.detection_methods).
+        Se detiene al cancelar el token o al cerrar el generador; el último
+        resultado, si se completan todos los métodos, es igual a detect_buttons_ai
+        """
+        image = FrameCache.wrap(image)
+        cancel = cancel or CancelToken()
+        if parallel is None:
+            parallel = self.parallel
+        
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = (image.digest(), 'all', self._config_key())
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                count('detection_cache_hits')
+                yield 'cache', cached
+                return
+        
+        order = [m for m in (methods or self.detection_methods) if m in self.detection_methods]
+        results = {}
+        
+        def merged():
+            # Mismo orden que detect_buttons_ai para que el resultado final coincida
             all_buttons = []
             for detection_method in self.detection_methods:
+                all_buttons.extend(results.get(detection_method, []))
+            return self._merge_overlapping_detections(all_buttons)
+        
+        if parallel:
+            executor = self._get_executor()
+            payload = image.image if self.executor_type == 'process' else image
+            futures = {
+                executor.submit(_run_detection_method, self, detection_method, payload): detection_method
+                for detection_method in order
+            }
+            try:
+                for future in as_completed(futures):
+                    if cancel.cancelled:
+                        return
+                    detection_method = futures[future]
+                    try:
+                        results[detection_method] = future.result()
+                    except Exception as e:
+                        results[detection_method] = []
+                        if self.debug:
+                            print(f"⚠️ Método {detection_method} falló: {e}")
+                    yield detection_method, merged()
+            finally:
+                # Los métodos que aún no empezaron no se ejecutan
+                for future in futures:
+                    future.cancel()
+        else:
+            for detection_method in order:
+                if cancel.cancelled:
+                    return
                 try:
-                    buttons = getattr(self, f'_detect_{detection_method}')(image)
-                    all_buttons.extend(buttons)
+                    results[detection_method] = self._run_method(image, detection_method)
                 except Exception as e:
+                    results[detection_method] = []
                     if self.debug:
                         print(f"⚠️ Método {detection_method} falló: {e}")
-            
-            # Fusionar detecciones superpuestas
-            return self._merge_overlapping_detections(all_buttons)
-        else:
-            return getattr(self, f'_detect_{method}')(image)
+                yield detection_method, merged()
+        
+        if cache_key is not None and len(results) == len(self.detection_methods):
+            self.result_cache.put(cache_key, merged())
     
     def _detect_edge_detection(self, image):
         """Detectar botones por bordes"""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        frame = FrameCache.wrap(image)
         
         # Detectar bordes con múltiples parámetros
-        edges1 = cv2.Canny(gray, 50, 150)
-        edges2 = cv2.Canny(gray, 30, 100)
-        edges3 = cv2.Canny(gray, 100, 200)
+        edges1 = frame.canny(50, 150)
+        edges2 = frame.canny(30, 100)
+        edges3 = frame.canny(100, 200)
         
         buttons = []
         for i, edges in enumerate([edges1, edges2, edges3]):
@@ -123,25 +417,28 @@ class AIButtonDetector:
         """Detectar botones por matching con templates comunes"""
         buttons = []
         
-        # Templates comunes de botones (simplificados)
-        templates = self._generate_button_templates()
+        # Templates comunes de botones (generados una sola vez, con su pirámide)
+        templates = self._get_button_templates()
         
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        frame = FrameCache.wrap(image)
+        levels = self.template_pyramid_levels
+        gray_pyramid = [frame.pyramid(level) for level in range(levels + 1)]
         
-        for template_name, template in templates:
+        for template_name, template_pyramid in templates:
             try:
-                result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
-                locations = np.where(result >= 0.6)
+                # Un resultado por máximo local, buscando de grueso a fino
+                peaks = match_template_pyramid(gray_pyramid, template_pyramid,
+                                               threshold=0.6, levels=levels)
                 
-                for pt in zip(*locations[::-1]):
-                    x, y = pt
-                    w, h = template.shape[:2]
+                h, w = template_pyramid[0].shape[:2]
+                for x, y, score in peaks:
                     buttons.append({
                         'method': 'template_matching',
                         'bbox': (x, y, w, h),
                         'confidence': 0.6,
                         'center': (x + w//2, y + h//2),
-                        'template': template_name
+                        'template': template_name,
+                        'score': score
                     })
             except:
                 continue
@@ -151,9 +448,7 @@ class AIButtonDetector:
     def _detect_color_clustering(self, image):
         """Detectar botones por clustering de colores"""
         buttons = []
-        
-        # Convertir a espacio de color más adecuado
-        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+        bgr = FrameCache.wrap(image).bgr()
         
         # Buscar regiones con colores típicos de botones
         button_colors = [
@@ -166,7 +461,7 @@ class AIButtonDetector:
             lower = np.array(lower)
             upper = np.array(upper)
             
-            mask = cv2.inRange(image, lower, upper)
+            mask = cv2.inRange(bgr, lower, upper)
             contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             
             for contour in contours:
@@ -188,20 +483,17 @@ class AIButtonDetector:
     
     def _detect_text_based_detection(self, image):
         """Detectar botones buscando texto típico de botones"""
-        buttons = []
+        frame = FrameCache.wrap(image)
         
-        # Palabras típicas de botones
-        button_keywords = [
-            'next', 'siguiente', 'continue', 'continuar',
-            'install', 'instalar', 'setup', 'configurar',
-            'accept', 'aceptar', 'agree', 'acepto',
-            'ok', 'cancel', 'cancelar', 'finish', 'finalizar',
-            'close', 'cerrar', 'yes', 'si', 'no'
-        ]
+        # Modo cascada: OCR solo dentro de los candidatos geométricos
+        if self.text_mode == 'cascade':
+            return self._detect_text_in_candidates(frame)
+        
+        buttons = []
         
         try:
             # OCR para encontrar texto
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            gray = frame.gray()
             
             # Múltiples configuraciones de OCR
             configs = [
@@ -210,24 +502,21 @@ class AIButtonDetector:
                 '--psm 13', # Raw line
             ]
             
-            for config in configs:
+            # Las tres pasadas en paralelo sobre motores del pool
+            ocr = resolve_ocr_pool(self.ocr)
+            count('ocr_invocations', len(configs))
+            futures = [(config, ocr.submit('image_to_data', gray, config=config)) for config in configs]
+            
+            for config, future in futures:
                 try:
-                    data = pytesseract.image_to_data(gray, config=config, output_type=pytesseract.Output.DICT)
+                    with span('ocr.image_to_data', config=config):
+                        data = future.result()
                     
                     for i in range(len(data['text'])):
-                        text = data['text'][i].lower().strip()
-                        if text and any(keyword in text for keyword in button_keywords):
-                            x, y, w, h = data['left'][i], data['top'][i], data['width'][i], data['height'][i]
-                            confidence = data['conf'][i] / 100.0
-                            
-                            if confidence > 0.3 and w > 20 and h > 10:
-                                buttons.append({
-                                    'method': 'text_based',
-                                    'bbox': (x-10, y-5, w+20, h+10),  # Expandir área
-                                    'confidence': confidence,
-                                    'center': (x + w//2, y + h//2),
-                                    'text': text
-                                })
+                        button = self._text_button(data['text'][i], data['left'][i], data['top'][i],
+                                                   data['width'][i], data['height'][i], data['conf'][i])
+                        if button:
+                            buttons.append(button)
                 except:
                     continue
                     
@@ -237,17 +526,78 @@ class AIButtonDetector:
         
         return buttons
     
+    def _detect_text_in_candidates(self, frame):
+        """OCR en un solo mosaico con los recortes propuestos por los detectores geométricos"""
+        buttons = []
+        
+        try:
+            # Propuestas baratas (memorizadas en el frame, se reutilizan en el modo 'all')
+            proposals = []
+            for detection_method in self.cascade_proposal_methods:
+                try:
+                    proposals.extend(self._run_method(frame, detection_method))
+                except Exception as e:
+                    if self.debug:
+                        print(f"⚠️ Propuestas de {detection_method} fallaron: {e}")
+            
+            if not proposals:
+                return buttons
+            
+            # Quitar propuestas duplicadas antes de recortar
+            boxes, _, _, _ = merge_boxes([b['bbox'] for b in proposals],
+                                         [b['confidence'] for b in proposals])
+            margin = 4
+            crops = [(x - margin, y - margin, w + 2 * margin, h + 2 * margin)
+                     for x, y, w, h in boxes.tolist() if w <= 600 and h <= 150]
+            
+            mosaic, tiles = build_mosaic(frame.gray(), crops)
+            if mosaic is None:
+                return buttons
+            
+            # Una sola invocación de Tesseract para todos los recortes
+            count('ocr_invocations')
+            with span('ocr.image_to_data', config='--psm 11', crops=len(tiles)):
+                data = resolve_ocr_pool(self.ocr).image_to_data(mosaic, config='--psm 11')
+            
+            for word in map_words_to_tiles(data, tiles):
+                button = self._text_button(word['text'], word['left'], word['top'],
+                                           word['width'], word['height'], word['conf'])
+                if button:
+                    buttons.append(button)
+                    
+        except Exception as e:
+            if self.debug:
+                print(f"⚠️ OCR en cascada falló: {e}")
+        
+        return buttons
+    
+    def _text_button(self, text, x, y, w, h, conf):
+        """Crear detección si la palabra OCR parece texto de botón"""
+        text = str(text).lower().strip()
+        if not text or not any(keyword in text for keyword in BUTTON_KEYWORDS):
+            return None
+        
+        confidence = float(conf) / 100.0
+        if confidence > 0.3 and w > 20 and h > 10:
+            return {
+                'method': 'text_based',
+                'bbox': (x-10, y-5, w+20, h+10),  # Expandir área
+                'confidence': confidence,
+                'center': (x + w//2, y + h//2),
+                'text': text
+            }
+        return None
+    
     def _detect_contour_analysis(self, image):
         """Detectar botones por análisis de contornos"""
         buttons = []
-        
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        frame = FrameCache.wrap(image)
         
         # Múltiples técnicas de procesamiento
         processed_images = [
-            cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)[1],
-            cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2),
-            cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+            frame.threshold(127),
+            frame.adaptive_threshold(11, 2),
+            frame.otsu()
         ]
         
         for proc_img in processed_images:
@@ -283,15 +633,8 @@ class AIButtonDetector:
         """Detectar botones por análisis de gradientes"""
         buttons = []
         
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Calcular gradientes
-        grad_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        grad_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        magnitude = np.sqrt(grad_x**2 + grad_y**2)
-        
-        # Normalizar
-        magnitude = np.uint8(255 * magnitude / np.max(magnitude))
+        # Calcular gradientes (magnitud normalizada, compartida por frame)
+        magnitude = FrameCache.wrap(image).gradient_magnitude(ksize=3)
         
         # Encontrar regiones con gradientes fuertes (bordes de botón)
         _, thresh = cv2.threshold(magnitude, 50, 255, cv2.THRESH_BINARY)
@@ -332,167 +675,116 @@ class AIButtonDetector:
         
         return templates
     
+    def _get_button_templates(self):
+        """Templates de botones con su pirámide, cacheados por instancia"""
+        if self._template_cache is None:
+            self._template_cache = [
+                (name, build_pyramid(template, self.template_pyramid_levels))
+                for name, template in self._generate_button_templates()
+            ]
+        return self._template_cache
+    
+    @traced('detect.merge')
     def _merge_overlapping_detections(self, buttons):
         """Fusionar detecciones superpuestas"""
         if not buttons:
             return []
         
-        # Agrupar por posición similar
-        merged = []
-        used = set()
-        
-        for i, button1 in enumerate(buttons):
-            if i in used:
-                continue
-                
-            group = [button1]
-            x1, y1, w1, h1 = button1['bbox']
-            
-            for j, button2 in enumerate(buttons[i+1:], i+1):
-                if j in used:
-                    continue
-                    
-                x2, y2, w2, h2 = button2['bbox']
-                
-                # Calcular overlap
-                overlap_x = max(0, min(x1+w1, x2+w2) - max(x1, x2))
-                overlap_y = max(0, min(y1+h1, y2+h2) - max(y1, y2))
-                overlap_area = overlap_x * overlap_y
-                
-                area1 = w1 * h1
-                area2 = w2 * h2
-                min_area = min(area1, area2)
-                
-                # Si hay overlap significativo, agrupar
-                if overlap_area / min_area > 0.3:
-                    group.append(button2)
-                    used.add(j)
-            
-            # Crear detección fusionada
-            if group:
-                # Promediar posiciones y tomar la mejor confianza
-                avg_x = int(np.mean([b['bbox'][0] for b in group]))
-                avg_y = int(np.mean([b['bbox'][1] for b in group]))
-                avg_w = int(np.mean([b['bbox'][2] for b in group]))
-                avg_h = int(np.mean([b['bbox'][3] for b in group]))
-                
-                max_confidence = max([b['confidence'] for b in group])
-                methods = [b['method'] for b in group]
-                
-                merged.append({
-                    'method': '+'.join(set(methods)),
-                    'bbox': (avg_x, avg_y, avg_w, avg_h),
-                    'confidence': max_confidence,
-                    'center': (avg_x + avg_w//2, avg_y + avg_h//2),
-                    'detection_count': len(group)
-                })
-            
-            used.add(i)
-        
-        # Ordenar por confianza
-        return sorted(merged, key=lambda x: x['confidence'], reverse=True)
+        # Agrupar por overlap / área mínima > 0.3 en formato columnar (ya ordenado por confianza)
+        return DetectionSet.from_dicts(buttons).merge(0.3).to_dicts()
+    
+    def _detect_capture(self, capture_name, frame):
+        """Detectar botones en una captura (punto de extensión para detectores incrementales)"""
+        return self.detect_buttons_ai(frame)
     
-    def find_best_buttons(self, hwnd=None, min_confidence=0.3):
-        """Encontrar los mejores candidatos a botones"""
+    @traced('detect.find_best_buttons')
+    def find_best_buttons(self, hwnd=None, min_confidence=0.3, screenshot=None):
+        """Encontrar los mejores candidatos a botones (screenshot RGB opcional)"""
         print("🔍 === ANÁLISIS INTELIGENTE DE BOTONES ===")
         
         # Capturar con múltiples métodos
-        capture_methods = self.capture_window_smart(hwnd)
+        capture_methods = self.capture_window_smart(hwnd, screenshot=screenshot)
         
         all_detections = []
+        analyzed = set()
         
         for method_name, image, *offset in capture_methods:
             print(f"📸 Analizando captura: {method_name}")
             
             if image is not None and image.size > 0:
-                buttons = self.detect_buttons_ai(image)
+                # Detectar una sola vez por región de píxeles única
+                frame = FrameCache.wrap(image)
+                region_key = (frame.digest(), offset[0] if offset else (0, 0))
+                if region_key in analyzed:
+                    print("   ♻️ Captura idéntica a una ya analizada, se omite")
+                    continue
+                analyzed.add(region_key)
+                
+                detections = DetectionSet.from_dicts(self._detect_capture(method_name, frame))
                 
                 # Ajustar coordenadas si hay offset
                 if offset:
-                    offset_x, offset_y = offset[0]
-                    for button in buttons:
-                        x, y, w, h = button['bbox']
-                        button['bbox'] = (x + offset_x, y + offset_y, w, h)
-                        button['center'] = (x + offset_x + w//2, y + offset_y + h//2)
+                    detections = detections.translate(*offset[0])
                 
-                print(f"   🎯 Encontrados {len(buttons)} candidatos")
-                all_detections.extend(buttons)
-        
-        # Fusionar todas las detecciones
-        final_buttons = self._merge_overlapping_detections(all_detections)
+                print(f"   🎯 Encontrados {len(detections)} candidatos")
+                all_detections.append(detections)
         
-        # Filtrar por confianza mínima
-        good_buttons = [b for b in final_buttons if b['confidence'] >= min_confidence]
+        # Fusionar todas las detecciones y filtrar por confianza mínima
+        final_buttons = DetectionSet.concat(all_detections).merge(0.3)
+        good_buttons = final_buttons.with_min_confidence(min_confidence).to_dicts()
         
         print(f"✅ Total de botones finales: {len(good_buttons)}")
         
         return good_buttons
     
-    def detect_buttons(self, save_screenshot=True, filename="button_detection.png"):
+    def detect_buttons(self, save_screenshot=True, filename="button_detection.png", screenshot=None):
         """
-        Método principal para detectar botones y opcionalmente guardar screenshot marcado
+        Método principal para detectar botones y opcionalmente guardar screenshot marcado.
+        Con screenshot (RGB) se analiza esa captura en lugar de tomar una nueva
         """
         print("🔍 Detectando botones en pantalla...")
         
         # Detectar botones usando todos los métodos disponibles
-        buttons = self.find_best_buttons()
+        buttons = self.find_best_buttons(screenshot=screenshot)
         
         if save_screenshot and buttons:
-            self.save_detection_debug(buttons, filename)
-            print(f"📸 Screenshot guardado: {filename}")
-        
-        # Convertir formato para compatibilidad con ui_clicker
-        formatted_buttons = []
-        for i, button in enumerate(buttons):
-            x, y, w, h = button['bbox']
-            formatted_button = {
-                'x': x,
-                'y': y,
-                'width': w,
-                'height': h,
-                'confidence': button['confidence'],
-                'method': button['method'],
-                'text': button.get('text', f'Button_{i+1}'),
-                'center_x': button['center'][0],
-                'center_y': button['center'][1]
-            }
-            formatted_buttons.append(formatted_button)
+            path = self.save_detection_debug(buttons, filename)
+            if path:
+                print(f"📸 Screenshot encolado: {path}")
         
+        formatted_buttons = self.format_buttons(buttons)
         print(f"✅ Detectados {len(formatted_buttons)} botones")
         return formatted_buttons
+    
+    def format_buttons(self, buttons):
+        """Convertir formato para compatibilidad con ui_clicker (x/y/width/height/text)"""
+        formatted_buttons = DetectionSet.from_dicts(buttons).to_dicts(style='xywh')
+        for i, formatted_button in enumerate(formatted_buttons):
+            formatted_button.setdefault('text', f'Button_{i+1}')
+        return formatted_buttons
 
-    def save_detection_debug(self, buttons, filename="ai_detection_debug.png"):
-        """Guardar imagen con detecciones para debug"""
+    @traced('debug.save_detection')
+    def save_detection_debug(self, buttons, filename="ai_detection_debug.png", image=None):
+        """
+        Guardar imagen con detecciones para debug, dibujando sobre el frame analizado
+        (image BGR o, si no se indica, la última captura). Se escribe en segundo plano
+        """
         try:
-            screenshot = np.array(ImageGrab.grab())
-            screenshot = cv2.cvtColor(screenshot, cv2.COLOR_RGB2BGR)
-            
-            colors = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255)]
-            
-            for i, button in enumerate(buttons):
-                x, y, w, h = button['bbox']
-                color = colors[i % len(colors)]
-                
-                # Dibujar rectángulo
-                cv2.rectangle(screenshot, (x, y), (x+w, y+h), color, 2)
-                
-                # Dibujar información
-                info = f"AI{i+1}: {button['method'][:10]} ({button['confidence']:.2f})"
-                cv2.putText(screenshot, info, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
-                
-                # Dibujar centro
-                cx, cy = button['center']
-                cv2.circle(screenshot, (cx, cy), 3, color, -1)
-                
-                # Agregar texto del botón si existe
-                if 'text' in button and button['text']:
-                    text_info = f"Text: {button['text'][:15]}"
-                    cv2.putText(screenshot, text_info, (x, y+h+15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
+            screenshot = image if image is not None else self.last_capture
+            if screenshot is None:
+                # Sin frame analizado (p. ej. detecciones externas): capturar uno
+                screenshot = self.frame_source.grab()
+                if screenshot is None:
+                    return None
+                screenshot = cv2.cvtColor(screenshot, cv2.COLOR_RGB2BGR)
             
-            cv2.imwrite(filename, screenshot)
-            print(f"🖼️ Debug guardado en: {filename}")
-            return filename
+            buttons = [dict(button) for button in buttons]
+            writer = self.debug_writer or default_debug_writer()
+            path = writer.submit(screenshot, lambda canvas: draw_detections(canvas, buttons), filename)
+            if path is None:
+                print("⚠️ Cola de debug llena, imagen descartada")
+            return path
             
         except Exception as e:
             print(f"❌ Error guardando debug: {e}")
-            return None
\ No newline at end of file
+            return None
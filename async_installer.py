@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Orquestador asyncio para la instalación automática
+Misma máquina de estados que UIClicker.auto_install ('installing', 'finished',
+'error', 'ready_to_install', 'waiting'), pero la captura, la detección de botones,
+la barra de progreso y el OCR corren como tareas concurrentes sobre una sola
+captura, y las esperas fijas se sustituyen por esperas con timeout hasta que la
+pantalla cambia. Mientras la interfaz reacciona a un click, los frames nuevos se
+analizan en especulativo (uno a la vez); si resulta ser el frame estable, su
+análisis se reutiliza. Cancelar un análisis especulativo solo detiene la
+detección de botones: la barra de progreso y el OCR de ese frame (una pasada
+cada uno) terminan igualmente y su resultado se descarta
+"""
+
+import asyncio
+import time
+
+from ai_button_detector import CancelToken
+from frame_cache import FrameCache, frame_hash
+from instrumentation import span, count
+
+
+class AsyncInstaller:
+    """Máquina de estados asíncrona sobre los componentes de un UIClicker"""
+
+    def __init__(self, clicker, poll_interval=0.25, stable_polls=2, settle_timeout=5.0,
+                 progress_interval=1.0, progress_timeout=300.0, stuck_timeout=20.0,
+                 min_confidence=0.3):
+        self.clicker = clicker
+        self.poll_interval = poll_interval
+        self.stable_polls = stable_polls
+        self.settle_timeout = settle_timeout
+        self.progress_interval = progress_interval
+        self.progress_timeout = progress_timeout
+        self.stuck_timeout = stuck_timeout
+        self.min_confidence = min_confidence
+
+    async def grab(self):
+        """Captura RGB y su hash (en un hilo, sin bloquear el bucle)"""
+        screenshot = await asyncio.to_thread(self.clicker.frame_source.grab)
+        if screenshot is None:
+            return None, None
+        return screenshot, await asyncio.to_thread(frame_hash, screenshot)
+
+    def _detect_buttons(self, frame, cancel):
+        """
+        Botones del frame y la captura BGR de la que salen. La captura se devuelve
+        con el resultado (no en detector.last_capture) porque varios análisis
+        corren a la vez; el token detiene la detección entre métodos
+        """
+        detector = self.clicker.ai_detector
+        bgr = frame.bgr()
+        buttons = []
+        stream = detector.iter_detections(bgr, cancel=cancel)
+        try:
+            for _, buttons in stream:
+                pass
+        finally:
+            stream.close()
+        buttons = [b for b in buttons if b['confidence'] >= self.min_confidence]
+        return detector.format_buttons(buttons), bgr
+
+    async def snapshot(self, screenshot=None, digest=None, cancel=None):
+        """
+        Analizar una captura: botones, barra de progreso y texto en paralelo.
+        Devuelve un dict con digest, screenshot, capture (BGR), buttons, progress,
+        screen_text y state
+        """
+        if screenshot is None:
+            screenshot, digest = await self.grab()
+            if screenshot is None:
+                return None
+
+        frame = FrameCache(screenshot, 'RGB')
+        tasks = [
+            asyncio.to_thread(self._detect_buttons, frame, cancel or CancelToken()),
+            asyncio.to_thread(self.clicker.detect_progress_bar, screenshot),
+            asyncio.to_thread(self.clicker._analyze_screen_text, screenshot)
+        ]
+        if digest is None:
+            tasks.append(asyncio.to_thread(frame.digest))
+        with span('install.async_snapshot'):
+            results = await asyncio.gather(*tasks)
+        (buttons, capture), progress, screen_text = results[:3]
+        if digest is None:
+            digest = results[3]
+
+        button_analysis = self.clicker._analyze_available_buttons(buttons)
+        state = self.clicker._determine_state_from_analysis(button_analysis, progress, screen_text)
+
+        return {
+            'digest': digest,
+            'screenshot': screenshot,
+            'capture': capture,
+            'buttons': buttons,
+            'progress': progress,
+            'screen_text': screen_text,
+            'state': state,
+            'time': time.time()
+        }
+
+    def _speculate(self, screenshot, digest):
+        """Lanzar el análisis especulativo de un frame: (digest, tarea, token)"""
+        cancel = CancelToken()
+        count('speculative_snapshots')
+        return digest, asyncio.create_task(self.snapshot(screenshot, digest, cancel)), cancel
+
+    @staticmethod
+    async def _discard(speculative):
+        """
+        Abandonar un análisis especulativo obsoleto: el token detiene la detección
+        de botones entre métodos (la barra de progreso y el OCR no se interrumpen)
+        y se espera a que todos sus hilos terminen antes de lanzar otro, así nunca
+        hay más de un análisis especulativo en el pool de hilos
+        """
+        speculative[2].cancel()
+        await asyncio.wait([speculative[1]])
+        count('speculative_discarded')
+
+    async def wait_for_change(self, digest, timeout):
+        """
+        Esperar a que la pantalla deje de ser `digest` y se mantenga estable
+        stable_polls capturas. Mientras tanto se analiza en especulativo el frame
+        nuevo más reciente, con un solo análisis en curso: si el frame cambia antes
+        de que termine, se cancela su detección de botones y el siguiente empieza
+        cuando el anterior (incluidos su progreso y su OCR) acaba.
+        Devuelve el análisis del frame estable (o del último frame nuevo si vence
+        el timeout) o None si la pantalla no cambió
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        speculative = None
+        last, latest, stable = None, None, 0
+        try:
+            while loop.time() < deadline:
+                screenshot, current = await self.grab()
+                if screenshot is None:
+                    break
+
+                if current != digest:
+                    stable = stable + 1 if current == last else 0
+                    latest = (screenshot, current)
+
+                    if speculative is not None and speculative[0] != current:
+                        # Frame obsoleto: pedir que pare y no lanzar otro hasta que acabe
+                        speculative[2].cancel()
+                        if speculative[1].done():
+                            count('speculative_discarded')
+                            speculative = None
+                    if speculative is None:
+                        speculative = self._speculate(screenshot, current)
+
+                    if stable + 1 >= self.stable_polls:
+                        if speculative[0] != current:
+                            await self._discard(speculative)
+                            speculative = self._speculate(screenshot, current)
+                        task = speculative[1]
+                        speculative = None
+                        return await task
+
+                last = current
+                await asyncio.sleep(self.poll_interval)
+
+            if latest is None:
+                return None
+            if speculative is not None and speculative[0] != latest[1]:
+                await self._discard(speculative)
+                speculative = None
+            if speculative is None:
+                return await self.snapshot(*latest)
+            task = speculative[1]
+            speculative = None
+            return await task
+        finally:
+            if speculative is not None:
+                speculative[2].cancel()
+                speculative[1].cancel()
+
+    async def after_click(self, snap):
+        """Análisis de la pantalla siguiente a un click (o de la misma si no cambió)"""
+        changed = await self.wait_for_change(snap['digest'], self.settle_timeout)
+        if changed is None:
+            print("⚠️ La pantalla no cambió tras el click")
+            return await self.snapshot()
+        return changed
+
+    def find_target(self, snap, action):
+        """Primer botón (por confianza) cuyo texto coincide con la acción"""
+        texts = self.clicker.button_variations(action)
+        for button in snap['buttons']:
+            button_text = str(button.get('text', '')).lower()
+            if any(text in button_text for text in texts):
+                return button
+        return None
+
+    async def click(self, button):
+        return await asyncio.to_thread(self.clicker.click_at_coordinates,
+                                       button['center_x'], button['center_y'], pause=0)
+
+    async def click_win32(self, action):
+        """Fallback para aplicaciones legacy: botón por texto con Win32"""
+        button_hwnd = await asyncio.to_thread(self.clicker.find_button_by_text, action)
+        if not button_hwnd:
+            return False
+        if await asyncio.to_thread(self.clicker.send_button_message, button_hwnd):
+            return True
+        return await asyncio.to_thread(self.clicker.click_control_by_handle, button_hwnd)
+
+    async def monitor_progress(self):
+        """Seguir la barra de progreso hasta terminar, atascarse o agotar el tiempo"""
+        print("⏳ Esperando finalización del progreso...")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.progress_timeout
+        last_progress, last_change = 0, loop.time()
+
+        while loop.time() < deadline:
+            screenshot, digest = await self.grab()
+            if screenshot is None:
+                return None
+            progress_info = await asyncio.to_thread(self.clicker.detect_progress_bar, screenshot)
+
+            if progress_info['found']:
+                current_progress = progress_info['progress']
+                print(f"📊 Progreso: {current_progress:.1f}%")
+
+                if current_progress >= 99:
+                    snap = await self.snapshot(screenshot, digest)
+                    if snap['state'] in ['finished', 'waiting']:
+                        print("✅ Progreso completado")
+                        return snap
+
+                if abs(current_progress - last_progress) >= 1:
+                    last_progress, last_change = current_progress, loop.time()
+                elif loop.time() - last_change > self.stuck_timeout:
+                    print("⚠️ Progreso parece atascado, continuando...")
+                    return None
+            else:
+                # No hay barra de progreso visible, verificar estado
+                snap = await self.snapshot(screenshot, digest)
+                if snap['state'] in ['finished', 'waiting', 'ready_to_install']:
+                    print("✅ Proceso completado (sin barra visible)")
+                    return snap
+
+            await asyncio.sleep(self.progress_interval)
+
+        print("⚠️ Timeout esperando progreso")
+        return None
+
+    async def run(self, max_steps=20):
+        """Instalación automática (versión asyncio de UIClicker.auto_install)"""
+        print("🚀 Iniciando instalación automática (asyncio)...")
+        snap = await self.snapshot()
+
+        for step in range(max_steps):
+            if snap is None:
+                print("❌ No hay capturas disponibles")
+                break
+            recorder = self.clicker.recorder
+            if recorder is not None:
+                # Solo se graba el análisis usado en cada paso (no los especulativos descartados)
+                recorder.set_step(step + 1)
+                recorder.record_frame(snap['screenshot'])
+                recorder.record_detections(snap['buttons'])
+                recorder.record_event('analysis', {'progress': snap['progress'],
+                                                   'screen_text': snap['screen_text']})
+                recorder.record_state(snap['state'])
+
+            state = snap['state']
+            print(f"\n--- Paso {step + 1}/{max_steps} ---")
+            print(f"🔍 Estado detectado: {state}")
+
+            with span('install.step', step=step + 1, state=state):
+                if state == 'installing':
+                    print("⏳ Instalación en progreso, esperando con monitoreo...")
+                    snap = await self.monitor_progress() or await self.snapshot()
+                    continue
+
+                if state == 'finished':
+                    print("🎉 Instalación completada")
+                    target = self.find_target(snap, 'finish')
+                    if target and await self.click(target):
+                        print("✅ Instalación finalizada exitosamente")
+                        return True
+                    if await self.click_win32('finish'):
+                        return True
+                    break
+
+                if state == 'error':
+                    print("❌ Error detectado en la instalación")
+                    await asyncio.to_thread(self.clicker.generate_button_diagnostic,
+                                            f"error_step_{step+1}_diagnostic.png")
+                    break
+
+                # Intentar avanzar según prioridades, con los botones ya detectados
+                actions = ['accept', 'next', 'install', 'continue']
+                if state == 'ready_to_install':
+                    actions.insert(0, 'install')
+
+                target = None
+                for action in actions:
+                    target = self.find_target(snap, action)
+                    if target:
+                        print(f"▶️ Acción: {action} ('{target['text']}')")
+                        break
+                if target is None and snap['buttons']:
+                    # Como en el análisis visual síncrono: sin texto, el primer botón
+                    target = snap['buttons'][0]
+                    print(f"▶️ Sin coincidencia de texto, usando {target['text']}")
+
+                clicked = target is not None and await self.click(target)
+                if not clicked:
+                    for action in actions:
+                        if await self.click_win32(action):
+                            clicked = True
+                            break
+
+                if clicked:
+                    snap = await self.after_click(snap)
+                    continue
+
+                # Si no se pudo hacer nada, generar diagnóstico y esperar un cambio
+                print("⚠️ No se encontraron acciones válidas")
+                await asyncio.to_thread(self.clicker.generate_button_diagnostic,
+                                        f"install_step_{step+1}_diagnostic.png")
+
+                print(f"⏳ Esperando hasta {self.settle_timeout:.0f} segundos por si hay cambios...")
+                changed = await self.wait_for_change(snap['digest'], self.settle_timeout)
+                if changed is not None and changed['state'] != state:
+                    print(f"🔄 Estado cambió de {state} a {changed['state']}, continuando...")
+                    snap = changed
+                    continue
+                print("❌ Sin cambios detectados, finalizando...")
+                break
+
+        print("🏁 Instalación automática finalizada")
+        return False
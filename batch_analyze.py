@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Análisis por lotes de capturas de instaladores
+Recorre un directorio o un archivo (.zip/.tar) de imágenes con un pool de
+procesos (con trabajo en vuelo acotado) y ejecuta detect_buttons_ai,
+detect_ui_elements y classify_buttons_by_position sobre cada imagen. Escribe una
+fila por detección en JSON Lines (o Parquet si pyarrow está instalado) y reporta
+imágenes/s y tiempo por método
+
+Uso:
+    python batch_analyze.py capturas/ --output detecciones.jsonl
+    python batch_analyze.py capturas.zip --output detecciones.parquet --workers 8
+"""
+
+import argparse
+import fnmatch
+import itertools
+import json
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+
+from ai_button_detector import AIButtonDetector
+from ocr_engine import OCRPool, cache_from_env
+from screenshot_analyzer import ScreenshotAnalyzer
+from text_extractor_simple import SimpleTextExtractor
+
+
+IMAGE_PATTERNS = ('*.png', '*.jpg', '*.jpeg', '*.bmp', '*.webp')
+METHODS = ('detect_buttons_ai', 'detect_ui_elements', 'classify_buttons_by_position')
+
+# Columnas de salida (esquema fijo para Parquet)
+COLUMNS = ['image', 'method', 'index', 'x', 'y', 'width', 'height', 'confidence',
+           'detector', 'label', 'text']
+
+
+def _is_image(name):
+    name = name.lower()
+    return any(fnmatch.fnmatch(name, pattern) for pattern in IMAGE_PATTERNS)
+
+
+def iter_images(path):
+    """Recorrer (nombre, bytes codificados) de un directorio, .zip o .tar, en orden"""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if _is_image(name):
+                    full_path = os.path.join(root, name)
+                    with open(full_path, 'rb') as f:
+                        yield os.path.relpath(full_path, path), f.read()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in sorted(archive.infolist(), key=lambda i: i.filename):
+                if not info.is_dir() and _is_image(info.filename):
+                    yield info.filename, archive.read(info)
+    elif tarfile.is_tarfile(path):
+        # Lectura en streaming: los tar grandes no se cargan enteros
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and _is_image(member.name):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise ValueError(f"Entrada no soportada (directorio, .zip o .tar): {path}")
+
+
+# Componentes por proceso (se crean una vez en cada worker)
+_worker = {}
+
+
+def _init_worker(methods, text_mode):
+    # Cada proceso ya es un worker: sin paralelismo ni caché internos, y un solo
+    # motor de OCR (con un pool por núcleo habría núcleos x workers hilos de Tesseract)
+    cv2.setNumThreads(1)
+    ocr = OCRPool(size=1, cache=cache_from_env())
+    detector = AIButtonDetector(debug=False, cache_size=0, ocr=ocr)
+    detector.text_mode = text_mode
+    _worker.update({
+        'methods': methods,
+        'detector': detector,
+        'analyzer': ScreenshotAnalyzer(),
+        'extractor': SimpleTextExtractor()
+    })
+
+
+def _rows_from_ai(buttons):
+    for button in buttons:
+        x, y, w, h = button['bbox']
+        yield {'x': x, 'y': y, 'width': w, 'height': h,
+               'confidence': button['confidence'], 'detector': button['method'],
+               'label': None, 'text': button.get('text')}
+
+
+def _rows_from_ui(elements):
+    for element in elements:
+        yield {'x': element['x'], 'y': element['y'], 'width': element['width'],
+               'height': element['height'], 'confidence': None, 'detector': element['color'],
+               'label': element.get('type'), 'text': None}
+
+
+def _rows_from_position(buttons):
+    for button in buttons:
+        yield {'x': button['x'], 'y': button['y'], 'width': button['width'],
+               'height': button['height'], 'confidence': None, 'detector': 'edges',
+               'label': button['predicted_type'], 'text': None}
+
+
+def analyze_image(name, data):
+    """
+    Analizar una imagen codificada en el worker; devuelve filas, tiempos (reloj
+    de pared por método) y errores (uno por método que falla)
+    """
+    result = {'image': name, 'rows': [], 'timings': {}, 'errors': []}
+    bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        result['errors'].append("No se pudo decodificar la imagen")
+        return result
+
+    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    height, width = bgr.shape[:2]
+    result['width'], result['height'] = width, height
+
+    methods = _worker['methods']
+    for method in methods:
+        start = time.perf_counter()
+        try:
+            if method == 'detect_buttons_ai':
+                rows = _rows_from_ai(_worker['detector'].detect_buttons_ai(bgr))
+            elif method == 'detect_ui_elements':
+                rows = _rows_from_ui(_worker['analyzer'].detect_ui_elements(screenshot=rgb))
+            else:
+                extractor = _worker['extractor']
+                regions = extractor.detect_button_regions(screenshot=rgb)
+                rows = _rows_from_position(
+                    extractor.classify_buttons_by_position(regions, screen_size=(width, height)))
+
+            for index, row in enumerate(rows):
+                row.update(image=name, method=method, index=index)
+                result['rows'].append(row)
+        except Exception as e:
+            result['errors'].append(f"{method}: {e}")
+        result['timings'][method] = time.perf_counter() - start
+
+    return result
+
+
+def _json_default(value):
+    try:
+        return value.item()
+    except AttributeError:
+        return str(value)
+
+
+class JsonLinesWriter:
+    def __init__(self, path):
+        self._file = open(path, 'w', encoding='utf-8') if path != '-' else sys.stdout
+
+    def write(self, rows):
+        for row in rows:
+            self._file.write(json.dumps({column: row.get(column) for column in COLUMNS},
+                                        default=_json_default) + '\n')
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class ParquetWriter:
+    """Escritura en Parquet por lotes de filas (necesita pyarrow)"""
+
+    def __init__(self, path, batch_rows=50000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("La salida Parquet necesita pyarrow (pip install pyarrow)")
+
+        self._pa = pa
+        self._schema = pa.schema([
+            ('image', pa.string()), ('method', pa.string()), ('index', pa.int32()),
+            ('x', pa.int32()), ('y', pa.int32()), ('width', pa.int32()), ('height', pa.int32()),
+            ('confidence', pa.float64()), ('detector', pa.string()), ('label', pa.string()),
+            ('text', pa.string())
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._batch_rows = batch_rows
+        self._pending = []
+
+    def write(self, rows):
+        self._pending.extend(rows)
+        if len(self._pending) >= self._batch_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        columns = {column: [row.get(column) for row in self._pending] for column in COLUMNS}
+        columns['confidence'] = [None if v is None else float(v) for v in columns['confidence']]
+        for column in ('index', 'x', 'y', 'width', 'height'):
+            columns[column] = [int(v) for v in columns[column]]
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+        self._pending = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def open_writer(path):
+    if path.lower().endswith('.parquet'):
+        return ParquetWriter(path)
+    return JsonLinesWriter(path)
+
+
+def run_batch(source, writer, methods=METHODS, workers=None, max_in_flight=None,
+              text_mode='full', limit=None, progress_every=100):
+    """Procesar todas las imágenes con a lo sumo max_in_flight tareas pendientes"""
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+
+    stats = {'images': 0, 'errors': 0, 'detections': 0,
+             'method_seconds': {method: 0.0 for method in methods}}
+    start = time.perf_counter()
+
+    def collect(future):
+        result = future.result()
+        stats['images'] += 1
+        for error in result['errors']:
+            stats['errors'] += 1
+            print(f"⚠️ {result['image']}: {error}", file=sys.stderr)
+        for method, seconds in result['timings'].items():
+            stats['method_seconds'][method] += seconds
+        stats['detections'] += len(result['rows'])
+        writer.write(result['rows'])
+
+        if progress_every and stats['images'] % progress_every == 0:
+            elapsed = time.perf_counter() - start
+            print(f"📦 {stats['images']} imágenes ({stats['images'] / elapsed:.1f} img/s)",
+                  file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(tuple(methods), text_mode)) as executor:
+        pending = set()
+        # islice corta antes de leer la imagen siguiente a la última del límite
+        for name, data in itertools.islice(source, limit):
+            # Acotar el trabajo en vuelo: la lectura no se adelanta al pool
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            pending.add(executor.submit(analyze_image, name, data))
+
+        for future in wait(pending).done:
+            collect(future)
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['images_per_second'] = stats['images'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def print_report(stats):
+    print(f"✅ {stats['images']} imágenes en {stats['seconds']:.1f} s "
+          f"({stats['images_per_second']:.2f} img/s), {stats['detections']} detecciones, "
+          f"{stats['errors']} errores", file=sys.stderr)
+    for method, seconds in stats['method_seconds'].items():
+        per_image = seconds / stats['images'] * 1000 if stats['images'] else 0.0
+        print(f"   ⏱️ {method}: {seconds:.1f} s sumando todos los workers ({per_image:.1f} ms/imagen)",
+              file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Análisis por lotes de capturas de instaladores")
+    parser.add_argument('input', help="Directorio, .zip o .tar con imágenes")
+    parser.add_argument('--output', default='-', help="Salida .jsonl o .parquet (por defecto stdout)")
+    parser.add_argument('--methods', nargs='+', default=list(METHODS), choices=list(METHODS))
+    parser.add_argument('--workers', type=int, default=None, help="Procesos (por defecto, núcleos)")
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help="Imágenes pendientes como máximo (por defecto 2 x workers)")
+    parser.add_argument('--text-mode', default='full', choices=['full', 'cascade'],
+                        help="Modo OCR de detect_buttons_ai")
+    parser.add_argument('--limit', type=int, default=None, help="Procesar solo las primeras N imágenes")
+    parser.add_argument('--stats', default=None, help="Guardar throughput y tiempos en un JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        writer = open_writer(args.output)
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        stats = run_batch(iter_images(args.input), writer, methods=args.methods,
+                          workers=args.workers, max_in_flight=args.max_in_flight,
+                          text_mode=args.text_mode, limit=args.limit)
+    finally:
+        writer.close()
+
+    print_report(stats)
+    if args.stats:
+        with open(args.stats, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks del pipeline de detección sobre pantallas de instalador sintéticas
+No necesita escritorio ni instalador real: genera asistentes de instalación con
+OpenCV (varias resoluciones, escalas DPI, temas claro/oscuro y distribuciones de
+botones) y mide cada etapa, reportando percentiles, memoria pico y candidatos en JSON
+
+Uso:
+    python benchmark_detection.py --output bench.json
+    python benchmark_detection.py --quick
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytesseract
+
+from ai_button_detector import AIButtonDetector
+from frame_cache import FrameCache
+from incremental_detector import IncrementalButtonDetector
+from ocr_engine import OCRPool
+from screenshot_analyzer import ScreenshotAnalyzer
+from text_extractor import TextExtractor
+
+
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4k': (3840, 2160),
+}
+
+THEMES = {
+    # Colores BGR: fondo, ventana, texto, botón, borde de botón, botón principal
+    'light': {
+        'desktop': (160, 120, 60), 'window': (240, 240, 240), 'text': (20, 20, 20),
+        'button': (225, 225, 225), 'border': (173, 173, 173), 'primary': (215, 120, 0),
+    },
+    'dark': {
+        'desktop': (40, 30, 20), 'window': (43, 43, 43), 'text': (235, 235, 235),
+        'button': (70, 70, 70), 'border': (110, 110, 110), 'primary': (210, 150, 60),
+    },
+}
+
+LAYOUTS = {
+    # Botones de la barra inferior (de izquierda a derecha) y botón principal
+    'wizard': (['< Back', 'Next >', 'Cancel'], 'Next >'),
+    'license': (['I Agree', 'Cancel'], 'I Agree'),
+    'install': (['< Back', 'Install', 'Cancel'], 'Install'),
+    'finish': (['Finish'], 'Finish'),
+}
+
+# Secuencia de páginas (layout, progreso) para comparar la detección incremental
+INCREMENTAL_SEQUENCE = [
+    ('wizard', None), ('license', None), ('install', None),
+    ('install', 0), ('install', 35), ('install', 70), ('install', 100), ('finish', None),
+]
+
+PAGE_TEXT = [
+    'Welcome to the Setup Wizard',
+    'This will install the application on your computer.',
+    'It is recommended that you close all other applications',
+    'before continuing. Click Next to continue, or Cancel to exit.',
+]
+
+
+def render_installer_frame(width, height, scale=1.0, theme='light', layout='wizard',
+                           progress=None, noise=0, seed=0):
+    """Dibujar un asistente de instalación sintético (BGR) sobre un escritorio"""
+    colors = THEMES[theme]
+    labels, primary = LAYOUTS[layout]
+    rng = np.random.default_rng(seed)
+
+    # Fondo de escritorio con degradado vertical (y ruido opcional tipo fotografía)
+    shade = np.linspace(0.7, 1.1, height, dtype=np.float32)[:, None, None]
+    desktop = np.array(colors['desktop'], dtype=np.float32)[None, None, :]
+    frame = np.clip(np.broadcast_to(shade * desktop, (height, width, 3)), 0, 255).astype(np.int16)
+    if noise:
+        frame += rng.integers(-noise, noise + 1, size=(height, width, 1), dtype=np.int16)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+
+    def s(value):
+        return int(round(value * scale))
+
+    # Ventana del instalador centrada (con un pequeño desplazamiento aleatorio)
+    win_w, win_h = min(s(500), width - 20), min(s(390), height - 20)
+    x0 = (width - win_w) // 2 + int(rng.integers(-s(40), s(40) + 1))
+    y0 = (height - win_h) // 2 + int(rng.integers(-s(30), s(30) + 1))
+    x0 = int(np.clip(x0, 10, width - win_w - 10))
+    y0 = int(np.clip(y0, 10, height - win_h - 10))
+    cv2.rectangle(frame, (x0, y0), (x0 + win_w, y0 + win_h), colors['window'], -1)
+    cv2.rectangle(frame, (x0, y0), (x0 + win_w, y0 + s(30)), colors['border'], -1)
+    cv2.putText(frame, 'Setup - Example App', (x0 + s(10), y0 + s(20)),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5 * scale, colors['text'], max(1, s(1)))
+
+    # Texto de la página
+    font_scale = 0.45 * scale
+    for i, line in enumerate(PAGE_TEXT):
+        cv2.putText(frame, line, (x0 + s(20), y0 + s(70) + i * s(24)),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, colors['text'], max(1, s(1)))
+
+    # Barra de progreso opcional
+    if progress is not None:
+        bar_x, bar_y, bar_w, bar_h = x0 + s(20), y0 + s(190), win_w - s(40), s(18)
+        cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_w, bar_y + bar_h), colors['button'], -1)
+        cv2.rectangle(frame, (bar_x, bar_y), (bar_x + int(bar_w * progress / 100), bar_y + bar_h),
+                      (60, 180, 60), -1)
+        cv2.putText(frame, f'{int(progress)}%', (bar_x, bar_y + s(40)),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, colors['text'], max(1, s(1)))
+
+    # Barra de botones inferior, alineada a la derecha
+    btn_w, btn_h, gap = s(88), s(26), s(10)
+    bx = x0 + win_w - s(15) - len(labels) * btn_w - (len(labels) - 1) * gap
+    by = y0 + win_h - s(15) - btn_h
+    for label in labels:
+        fill = colors['primary'] if label == primary else colors['button']
+        cv2.rectangle(frame, (bx, by), (bx + btn_w, by + btn_h), fill, -1)
+        cv2.rectangle(frame, (bx, by), (bx + btn_w, by + btn_h), colors['border'], 1)
+        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, max(1, s(1)))
+        cv2.putText(frame, label, (bx + (btn_w - tw) // 2, by + (btn_h + th) // 2),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, colors['text'], max(1, s(1)))
+        bx += btn_w + gap
+
+    return frame
+
+
+def measure(fn, repeat):
+    """
+    Ejecutar fn repeat veces; devolver (tiempos en ms, memoria pico en bytes, último resultado).
+    La latencia se mide sin tracemalloc (encarece las etapas con mucho Python) y
+    la memoria en una pasada aparte. tracemalloc solo ve las asignaciones de
+    Python y NumPy, no los buffers internos de OpenCV
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000.0)
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return times, peak, result
+
+
+def summarize(times, peak, candidates=None):
+    """Percentiles de latencia, memoria pico y número de candidatos"""
+    times = np.asarray(times)
+    summary = {
+        'runs': len(times),
+        'mean_ms': round(float(times.mean()), 3),
+        'min_ms': round(float(times.min()), 3),
+        'p50_ms': round(float(np.percentile(times, 50)), 3),
+        'p90_ms': round(float(np.percentile(times, 90)), 3),
+        'p99_ms': round(float(np.percentile(times, 99)), 3),
+        'max_ms': round(float(times.max()), 3),
+        'peak_memory_bytes': int(peak),
+    }
+    if candidates is not None:
+        summary['candidates'] = candidates
+    return summary
+
+
+def bench_stage(fn, repeat, count=len):
+    """Medir una etapa; si falla (p. ej. Tesseract no instalado) se marca como omitida"""
+    try:
+        times, peak, result = measure(fn, repeat)
+    except Exception as e:
+        return {'skipped': f"{type(e).__name__}: {e}"}
+    return summarize(times, peak, count(result) if count else None)
+
+
+def tesseract_available():
+    """Comprobar que el binario de Tesseract está instalado"""
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def bench_scenario(image, repeat, include_ocr=True):
+    """Medir todas las etapas sobre un frame BGR"""
+    # Pool propio sin caché: cada repetición tiene que pasar por Tesseract
+    ocr = OCRPool(cache=None)
+    detector = AIButtonDetector(debug=False, cache_size=0, ocr=ocr)
+    analyzer = ScreenshotAnalyzer()
+    extractor = TextExtractor(ocr=ocr)
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    results = {}
+
+    # Cada repetición usa un FrameCache nuevo para contar también el preprocesamiento
+    raw_candidates = []
+    for method in detector.detection_methods:
+        if method == 'text_based_detection' and not include_ocr:
+            continue
+        detect = getattr(detector, f'_detect_{method}')
+        results[f'detect.{method}'] = bench_stage(
+            lambda detect=detect: detect(FrameCache(image)), repeat)
+        try:
+            raw_candidates.extend(detect(FrameCache(image)))
+        except Exception:
+            pass
+
+    results['merge_overlapping_detections'] = bench_stage(
+        lambda: detector._merge_overlapping_detections(raw_candidates), repeat)
+    results['merge_overlapping_detections']['input_candidates'] = len(raw_candidates)
+
+    if not include_ocr:
+        detector.detection_methods = [m for m in detector.detection_methods
+                                      if m != 'text_based_detection']
+    results['detect_buttons_ai'] = bench_stage(
+        lambda: detector.detect_buttons_ai(FrameCache(image)), repeat)
+
+    results['screenshot_analyzer.detect_ui_elements'] = bench_stage(
+        lambda: analyzer.detect_ui_elements(screenshot=rgb), repeat)
+
+    if include_ocr:
+        height, width = rgb.shape[:2]
+        crop = rgb[height // 3:2 * height // 3, width // 4:3 * width // 4]
+        results['text_extractor.extract_text_from_image'] = bench_stage(
+            lambda: extractor.extract_text_from_image(crop), repeat, count=None)
+        results['text_extractor.find_text_regions'] = bench_stage(
+            lambda: extractor.find_text_regions(rgb), repeat)
+
+    detector.close()
+    ocr.close()
+    return results
+
+
+def compare_detections(expected, actual, min_iou=0.9):
+    """Detecciones idénticas (caja y métodos) y emparejadas por IoU entre dos resultados"""
+    def key(button):
+        return tuple(int(v) for v in button['bbox']), button['method']
+
+    remaining = [key(button) for button in actual]
+    exact = 0
+    for button in expected:
+        if key(button) in remaining:
+            remaining.remove(key(button))
+            exact += 1
+
+    def iou(a, b):
+        ax, ay, aw, ah = a
+        bx, by, bw, bh = b
+        overlap = max(0, min(ax + aw, bx + bw) - max(ax, bx)) * max(0, min(ay + ah, by + bh) - max(ay, by))
+        union = aw * ah + bw * bh - overlap
+        return overlap / union if union else 0.0
+
+    unmatched = [button['bbox'] for button in actual]
+    matched = 0
+    for button in expected:
+        best = max(range(len(unmatched)), key=lambda i: iou(button['bbox'], unmatched[i]), default=None)
+        if best is not None and iou(button['bbox'], unmatched[best]) >= min_iou:
+            unmatched.pop(best)
+            matched += 1
+
+    return {'expected': len(expected), 'actual': len(actual), 'exact': exact, 'matched': matched}
+
+
+def check_incremental(width, height, scale=1.0, theme='light', include_ocr=True):
+    """
+    Comparar IncrementalButtonDetector con detect_buttons_ai completo sobre la
+    misma secuencia de páginas de instalador (INCREMENTAL_SEQUENCE)
+    """
+    ocr = OCRPool(cache=None)
+    full = AIButtonDetector(debug=False, cache_size=0, ocr=ocr)
+    incremental = IncrementalButtonDetector(debug=False, cache_size=0, ocr=ocr)
+    if not include_ocr:
+        for detector in (full, incremental):
+            detector.detection_methods = [m for m in detector.detection_methods
+                                          if m != 'text_based_detection']
+
+    frames = []
+    for layout, progress in INCREMENTAL_SEQUENCE:
+        image = render_installer_frame(width, height, scale, theme, layout, progress=progress)
+
+        start = time.perf_counter()
+        expected = full.detect_buttons_ai(FrameCache(image))
+        full_ms = (time.perf_counter() - start) * 1000.0
+
+        start = time.perf_counter()
+        actual = incremental._detect_capture('traditional', FrameCache(image))
+        incremental_ms = (time.perf_counter() - start) * 1000.0
+
+        comparison = compare_detections(expected, actual)
+        comparison.update(layout=layout, progress=progress, full_ms=round(full_ms, 3),
+                          incremental_ms=round(incremental_ms, 3))
+        frames.append(comparison)
+
+    full.close()
+    incremental.close()
+    ocr.close()
+    return {
+        'width': width,
+        'height': height,
+        'dpi_scale': scale,
+        'theme': theme,
+        'identical': all(f['exact'] == f['expected'] == f['actual'] for f in frames),
+        'frames': frames,
+    }
+
+
+def environment_info():
+    """Versiones y commit, para poder comparar resultados entre commits"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run_benchmarks(resolutions, scales, themes, layouts, repeat, include_ocr=True, noise=0,
+                   progress=None, incremental_check=True):
+    """Recorrer todas las combinaciones de escenarios"""
+    report = {'environment': environment_info(), 'scenarios': []}
+    if include_ocr and not tesseract_available():
+        report['environment']['ocr_skipped'] = "Tesseract no está instalado"
+        include_ocr = False
+
+    if incremental_check:
+        report['incremental_check'] = [
+            check_incremental(*RESOLUTIONS[resolution], scales[0], themes[0], include_ocr)
+            for resolution in resolutions
+        ]
+
+    for resolution in resolutions:
+        width, height = RESOLUTIONS[resolution]
+        for scale in scales:
+            for theme in themes:
+                for layout in layouts:
+                    image = render_installer_frame(width, height, scale, theme, layout, noise=noise)
+                    scenario = {
+                        'resolution': resolution,
+                        'width': width,
+                        'height': height,
+                        'dpi_scale': scale,
+                        'theme': theme,
+                        'layout': layout,
+                        'noise': noise,
+                        'stages': bench_scenario(image, repeat, include_ocr),
+                    }
+                    report['scenarios'].append(scenario)
+                    if progress:
+                        progress(scenario)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de detección de botones")
+    parser.add_argument('--resolutions', nargs='+', default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument('--scales', nargs='+', type=float, default=[1.0, 1.25, 1.5])
+    parser.add_argument('--themes', nargs='+', default=list(THEMES), choices=list(THEMES))
+    parser.add_argument('--layouts', nargs='+', default=['wizard', 'install'], choices=list(LAYOUTS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-ocr', action='store_true', help="Omitir las etapas con Tesseract")
+    parser.add_argument('--noise', type=int, default=0, help="Amplitud de ruido del fondo de escritorio")
+    parser.add_argument('--quick', action='store_true', help="Solo 1080p, escala 1.0, tema claro")
+    parser.add_argument('--no-incremental-check', action='store_true',
+                        help="Omitir la comparación del detector incremental con el completo")
+    parser.add_argument('--output', default=None, help="Archivo JSON de salida (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.resolutions, args.scales, args.themes, args.layouts = ['1080p'], [1.0], ['light'], ['wizard']
+        args.repeat = min(args.repeat, 3)
+
+    def progress(scenario):
+        total = scenario['stages'].get('detect_buttons_ai', {}).get('p50_ms')
+        print(f"⏱️ {scenario['resolution']} x{scenario['dpi_scale']} {scenario['theme']} "
+              f"{scenario['layout']}: detect_buttons_ai p50 = {total} ms", file=sys.stderr)
+
+    report = run_benchmarks(args.resolutions, args.scales, args.themes, args.layouts,
+                            args.repeat, include_ocr=not args.no_ocr, noise=args.noise,
+                            progress=progress, incremental_check=not args.no_incremental_check)
+
+    for check in report.get('incremental_check', []):
+        status = "✅ idéntico" if check['identical'] else "⚠️ difiere"
+        print(f"🧩 Incremental vs completo {check['width']}x{check['height']}: {status}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"📊 Resultados guardados en: {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Fusión vectorizada de detecciones superpuestas
+Reemplaza el doble bucle O(n²) de _merge_overlapping_detections por consultas
+sobre una rejilla uniforme con NumPy, manteniendo exactamente la misma semántica
+"""
+
+import numpy as np
+
+
+def group_overlapping(boxes, threshold=0.3):
+    """
+    Agrupar cajas (x, y, w, h) igual que el algoritmo voraz original:
+    cada caja no usada, en orden de entrada, abre un grupo con todas las cajas
+    posteriores no usadas cuyo solapamiento / área mínima supere el umbral.
+    Devuelve la etiqueta de grupo de cada caja (grupos numerados en orden de apertura).
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    n = len(boxes)
+    labels = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return labels
+
+    x, y, w, h = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    right = x + w
+    bottom = y + h
+    area = w * h
+
+    # Rejilla uniforme con celdas del tamaño de la caja más grande: una caja solo
+    # puede solaparse con cajas cuyo origen cae en las celdas vecinas
+    cell_w = max(int(w.max()), 1)
+    cell_h = max(int(h.max()), 1)
+    origin_x = int(x.min())
+    origin_y = int(y.min())
+    cell_x = (x - origin_x) // cell_w
+    cell_y = (y - origin_y) // cell_h
+    grid_w = int(cell_x.max()) + 1
+    grid_h = int(cell_y.max()) + 1
+
+    # Índice CSR: cajas ordenadas por celda y posición de inicio de cada celda
+    cell_id = cell_y * grid_w + cell_x
+    order = np.argsort(cell_id, kind='stable')
+    starts = np.searchsorted(cell_id[order], np.arange(grid_w * grid_h + 1)).tolist()
+
+    # Escalares como listas de Python: el acceso por índice es mucho más barato
+    x_list, y_list = x.tolist(), y.tolist()
+    right_list, bottom_list = right.tolist(), bottom.tolist()
+
+    used = np.zeros(n, dtype=bool)
+    group = 0
+    block = 4096
+    for block_start in range(0, n, block):
+        # Solo recorrer las semillas que siguen libres al empezar el bloque
+        for i in (np.flatnonzero(~used[block_start:block_start + block]) + block_start).tolist():
+            if used[i]:
+                continue
+
+            x0 = max((x_list[i] - cell_w - origin_x) // cell_w, 0)
+            x1 = min((right_list[i] - 1 - origin_x) // cell_w, grid_w - 1)
+            y0 = max((y_list[i] - cell_h - origin_y) // cell_h, 0)
+            y1 = min((bottom_list[i] - 1 - origin_y) // cell_h, grid_h - 1)
+
+            # Cada fila de celdas es un tramo contiguo del índice
+            if x1 >= x0 and y1 >= y0:
+                candidates = np.concatenate([
+                    order[starts[row * grid_w + x0]:starts[row * grid_w + x1 + 1]]
+                    for row in range(y0, y1 + 1)
+                ])
+            else:
+                candidates = order[:0]
+            candidates = candidates[(candidates > i) & ~used[candidates]]
+
+            if len(candidates):
+                overlap_x = np.minimum(right[i], right[candidates]) - np.maximum(x[i], x[candidates])
+                overlap_y = np.minimum(bottom[i], bottom[candidates]) - np.maximum(y[i], y[candidates])
+                overlap_area = np.maximum(overlap_x, 0) * np.maximum(overlap_y, 0)
+                min_area = np.minimum(area[i], area[candidates])
+
+                # Cajas degeneradas (área 0) nunca se agrupan
+                ratio = np.divide(overlap_area, min_area, out=np.zeros(len(candidates)),
+                                  where=min_area > 0)
+                members = candidates[ratio > threshold]
+                used[members] = True
+                labels[members] = group
+
+            used[i] = True
+            labels[i] = group
+            group += 1
+
+    return labels
+
+
+def aggregate_groups(labels, boxes, confidences, method_masks):
+    """
+    Reducir cada grupo a una sola caja, en orden de etiqueta.
+    Devuelve (boxes, confidences, method_masks, counts): caja promedio truncada a
+    entero, confianza máxima, unión de métodos (OR de bits) y número de detecciones.
+    """
+    n_groups = int(labels.max()) + 1
+
+    counts = np.bincount(labels, minlength=n_groups)
+    merged = np.empty((n_groups, 4), dtype=np.int64)
+    for column in range(4):
+        sums = np.bincount(labels, weights=boxes[:, column], minlength=n_groups)
+        merged[:, column] = np.trunc(sums / counts)
+
+    merged_conf = np.full(n_groups, -np.inf)
+    np.maximum.at(merged_conf, labels, confidences)
+
+    merged_masks = np.zeros(n_groups, dtype=np.uint64)
+    np.bitwise_or.at(merged_masks, labels, method_masks)
+
+    return merged, merged_conf, merged_masks, counts
+
+
+def merge_boxes(boxes, confidences, method_masks=None, threshold=0.3):
+    """
+    Fusionar cajas en formato columnar.
+    Devuelve (boxes, confidences, method_masks, counts) de los grupos (ver
+    aggregate_groups), ordenado por confianza descendente.
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    confidences = np.asarray(confidences, dtype=np.float64)
+    if method_masks is None:
+        method_masks = np.zeros(len(boxes), dtype=np.uint64)
+    method_masks = np.asarray(method_masks, dtype=np.uint64)
+
+    if len(boxes) == 0:
+        return (np.zeros((0, 4), dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.uint64),
+                np.zeros(0, dtype=np.int64))
+
+    labels = group_overlapping(boxes, threshold)
+    merged, merged_conf, merged_masks, counts = aggregate_groups(labels, boxes, confidences, method_masks)
+
+    # Orden estable por confianza (igual que sorted(..., reverse=True))
+    order = np.argsort(-merged_conf, kind='stable')
+    return merged[order], merged_conf[order], merged_masks[order], counts[order]
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Escritura asíncrona de imágenes de debug
+Dibuja y codifica en un hilo de fondo, sobre el mismo frame que se analizó (sin
+volver a capturar la pantalla). Admite miniaturas JPEG/WebP reducidas y rota los
+archivos escritos para no pasar de un presupuesto de disco
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from instrumentation import span, count
+
+
+FORMATS = {
+    '.png': ('.png', lambda quality: [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+    '.jpg': ('.jpg', lambda quality: [cv2.IMWRITE_JPEG_QUALITY, quality]),
+    '.jpeg': ('.jpg', lambda quality: [cv2.IMWRITE_JPEG_QUALITY, quality]),
+    '.webp': ('.webp', lambda quality: [cv2.IMWRITE_WEBP_QUALITY, quality]),
+}
+
+
+class DebugArtifactWriter:
+    """
+    Cola acotada de imágenes de debug.
+    format: '.png', '.jpg' o '.webp' para forzar el formato (None = el del nombre)
+    max_width: reducir la imagen anotada a este ancho como máximo (miniaturas)
+    max_bytes / max_files: borrar los archivos más antiguos escritos por este
+    writer cuando se supera el presupuesto
+    timestamped: añadir marca de tiempo al nombre para no sobrescribir
+    """
+
+    def __init__(self, directory=None, format=None, quality=80, max_width=None,
+                 max_bytes=None, max_files=None, timestamped=False, max_queue=8):
+        if format is not None and format not in FORMATS:
+            raise ValueError(f"Formato no soportado: {format}")
+        self.directory = directory
+        self.format = format
+        self.quality = quality
+        self.max_width = max_width
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.timestamped = timestamped
+
+        self.dropped = 0
+        self.written = 0
+        self._files = deque()
+        self._total_bytes = 0
+        self._sequence = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker_loop, name='debug_writer',
+                                        daemon=True)
+        self._thread.start()
+        # Que no se pierdan imágenes pendientes al terminar el programa
+        atexit.register(self.close)
+
+    def output_path(self, filename):
+        """Ruta final del archivo (directorio, formato y marca de tiempo aplicados)"""
+        root, extension = os.path.splitext(filename)
+        extension = self.format or extension.lower() or '.png'
+        extension = FORMATS.get(extension, FORMATS['.png'])[0]
+
+        if self.timestamped:
+            self._sequence += 1
+            root = f"{root}_{time.strftime('%Y%m%d-%H%M%S')}_{self._sequence:04d}"
+        path = root + extension
+        if self.directory and not os.path.isabs(path):
+            path = os.path.join(self.directory, path)
+        return path
+
+    def submit(self, image, draw, filename, color_order='BGR'):
+        """
+        Encolar un frame para anotar con draw(copia) -> imagen y guardar.
+        El frame no se copia hasta que lo procesa el worker: no modificarlo después.
+        Devuelve la ruta de destino, o None si la cola está llena (se descarta)
+        """
+        if image is None or self._closed:
+            return None
+        path = self.output_path(filename)
+        try:
+            self._queue.put_nowait((image, draw, path, color_order))
+        except queue.Full:
+            self.dropped += 1
+            count('debug_artifacts_dropped')
+            return None
+        return path
+
+    def flush(self):
+        """Esperar a que se escriban todas las imágenes encoladas"""
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _worker_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                self._write(*item)
+            except Exception as e:
+                print(f"❌ Error guardando debug: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, image, draw, path, color_order):
+        with span('debug.write_artifact'):
+            annotated = draw(np.array(image, copy=True))
+
+            # Reducir después de dibujar: las cajas están en coordenadas del frame
+            if self.max_width and annotated.shape[1] > self.max_width:
+                scale = self.max_width / annotated.shape[1]
+                size = (self.max_width, max(1, round(annotated.shape[0] * scale)))
+                annotated = cv2.resize(annotated, size, interpolation=cv2.INTER_AREA)
+
+            if color_order == 'RGB' and annotated.ndim == 3:
+                annotated = cv2.cvtColor(annotated, cv2.COLOR_RGB2BGR)
+
+            extension = os.path.splitext(path)[1]
+            ok, encoded = cv2.imencode(extension, annotated, FORMATS[extension][1](self.quality))
+            if not ok:
+                raise IOError(f"No se pudo codificar {path}")
+
+            temp_path = f"{path}.tmp{extension}"
+            with open(temp_path, 'wb') as f:
+                f.write(encoded.tobytes())
+            os.replace(temp_path, path)
+
+        self.written += 1
+        count('debug_artifacts_written')
+        print(f"🖼️ Debug guardado en: {path}")
+        self._track(path, len(encoded))
+
+    def _track(self, path, size):
+        """Registrar el archivo y rotar los más antiguos si se supera el presupuesto"""
+        # Un archivo sobrescrito reemplaza su entrada anterior
+        for i, (old_path, old_size) in enumerate(self._files):
+            if old_path == path:
+                del self._files[i]
+                self._total_bytes -= old_size
+                break
+        self._files.append((path, size))
+        self._total_bytes += size
+
+        while len(self._files) > 1 and (
+                (self.max_bytes is not None and self._total_bytes > self.max_bytes) or
+                (self.max_files is not None and len(self._files) > self.max_files)):
+            old_path, old_size = self._files.popleft()
+            self._total_bytes -= old_size
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+
+_default_writer = None
+_default_lock = threading.Lock()
+
+
+def default_debug_writer():
+    """Writer compartido por defecto (PNG, mismos nombres de archivo que antes)"""
+    global _default_writer
+    with _default_lock:
+        if _default_writer is None:
+            _default_writer = DebugArtifactWriter()
+        return _default_writer
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Caché LRU de resultados de detección
+Indexada por el hash de los píxeles capturados y la configuración del detector,
+para no repetir todo el pipeline sobre una pantalla que no cambió
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class DetectionCache:
+    """Caché acotada por número de entradas y antigüedad (TTL en segundos)"""
+
+    def __init__(self, max_entries=32, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _copy(buttons):
+        # Los llamadores modifican bbox/center de los dicts devueltos
+        return [dict(button) for button in buttons]
+
+    def get(self, key):
+        """Devolver una copia de las detecciones guardadas o None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, buttons = entry
+                if self.ttl is None or time.monotonic() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._copy(buttons)
+
+                # Entrada caducada
+                del self._entries[key]
+                self.evictions += 1
+
+            self.misses += 1
+            return None
+
+    def put(self, key, buttons):
+        """Guardar las detecciones, expulsando la entrada menos usada si hace falta"""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), self._copy(buttons))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Vaciar la caché (los contadores se conservan)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Contadores de uso de la caché"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0
+            }
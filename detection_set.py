@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Conjunto de detecciones en formato columnar
+Un array estructurado de NumPy con coordenadas, confianza, métodos como máscara
+de bits y texto como columna de objetos (viaja con cada conjunto, sin una tabla
+global que crezca con cada texto reconocido). Permite filtrar, ordenar,
+trasladar y fusionar sin reconstruir listas de dicts, y ofrece una vista en
+dicts para compatibilidad con el resto del código
+"""
+
+import threading
+
+import numpy as np
+
+from box_fusion import aggregate_groups, group_overlapping
+
+
+DETECTION_DTYPE = np.dtype([
+    ('x', np.int32),
+    ('y', np.int32),
+    ('width', np.int32),
+    ('height', np.int32),
+    ('confidence', np.float64),
+    ('methods', np.uint64),     # Máscara de bits sobre METHOD_TABLE
+    ('text', object),           # Texto reconocido (None = sin texto)
+    ('count', np.int32),        # Detecciones fusionadas en esta
+])
+
+
+class StringTable:
+    """Tabla de cadenas compartida (cadena <-> índice)"""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self._strings = []
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def intern(self, value):
+        """Índice de la cadena, añadiéndola si no existe"""
+        try:
+            return self._index[value]
+        except KeyError:
+            pass
+        with self._lock:
+            if value not in self._index:
+                if self.max_size is not None and len(self._strings) >= self.max_size:
+                    raise ValueError(f"Tabla de cadenas llena ({self.max_size})")
+                self._index[value] = len(self._strings)
+                self._strings.append(value)
+            return self._index[value]
+
+    def __getitem__(self, index):
+        return self._strings[index]
+
+    def __len__(self):
+        return len(self._strings)
+
+
+# Los métodos se guardan como bits de un uint64: como máximo 64 nombres distintos
+METHOD_TABLE = StringTable(max_size=64)
+
+
+def method_mask(method):
+    """Máscara de bits para un nombre de método ('a' o 'a+b')"""
+    mask = 0
+    for name in method.split('+'):
+        mask |= 1 << METHOD_TABLE.intern(name)
+    return mask
+
+
+def method_names(mask):
+    """Nombre combinado ('a+b') de una máscara de bits"""
+    mask = int(mask)
+    return '+'.join(METHOD_TABLE[bit] for bit in range(len(METHOD_TABLE)) if mask >> bit & 1)
+
+
+class DetectionSet:
+    """Detecciones como array estructurado (ver DETECTION_DTYPE)"""
+
+    def __init__(self, records=None):
+        if records is None:
+            records = np.zeros(0, dtype=DETECTION_DTYPE)
+        self.records = records
+
+    @classmethod
+    def from_arrays(cls, boxes, confidences, methods=0, texts=None, counts=1):
+        """Crear a partir de columnas (boxes con forma (n, 4))"""
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        records = np.zeros(len(boxes), dtype=DETECTION_DTYPE)
+        records['x'], records['y'] = boxes[:, 0], boxes[:, 1]
+        records['width'], records['height'] = boxes[:, 2], boxes[:, 3]
+        records['confidence'] = confidences
+        records['methods'] = methods
+        records['text'] = texts
+        records['count'] = counts
+        return cls(records)
+
+    @classmethod
+    def from_dicts(cls, buttons):
+        """Crear a partir de dicts con 'bbox' o con 'x'/'y'/'width'/'height'"""
+        records = np.zeros(len(buttons), dtype=DETECTION_DTYPE)
+        for i, button in enumerate(buttons):
+            if 'bbox' in button:
+                x, y, w, h = button['bbox']
+            else:
+                x, y, w, h = button['x'], button['y'], button['width'], button['height']
+            text = button.get('text')
+            records[i] = (x, y, w, h,
+                          button.get('confidence', 0.0),
+                          method_mask(button.get('method', '')) if button.get('method') else 0,
+                          text if text else None,
+                          button.get('detection_count', 1))
+        return cls(records)
+
+    @classmethod
+    def concat(cls, sets):
+        """Unir varios conjuntos en uno"""
+        sets = list(sets)
+        if not sets:
+            return cls()
+        return cls(np.concatenate([s.records for s in sets]))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._record_dict(self.records[key])
+        return DetectionSet(self.records[key])
+
+    def __iter__(self):
+        return iter(self.to_dicts())
+
+    @property
+    def boxes(self):
+        """Cajas (n, 4) como int64"""
+        r = self.records
+        return np.stack([r['x'], r['y'], r['width'], r['height']], axis=1).astype(np.int64)
+
+    @property
+    def centers(self):
+        """Centros (n, 2) con división entera, igual que los dicts"""
+        r = self.records
+        return np.stack([r['x'] + r['width'] // 2, r['y'] + r['height'] // 2], axis=1)
+
+    def filter(self, mask):
+        """Subconjunto según una máscara booleana"""
+        return DetectionSet(self.records[mask])
+
+    def with_min_confidence(self, min_confidence):
+        """Subconjunto con confianza >= min_confidence"""
+        return self.filter(self.records['confidence'] >= min_confidence)
+
+    def sort_by(self, field='confidence', descending=True):
+        """Ordenar (estable) por un campo"""
+        values = self.records[field]
+        order = np.argsort(-values if descending else values, kind='stable')
+        return DetectionSet(self.records[order])
+
+    def translate(self, dx, dy):
+        """Desplazar todas las cajas (p. ej. de coordenadas de ventana a pantalla)"""
+        records = self.records.copy()
+        records['x'] += dx
+        records['y'] += dy
+        return DetectionSet(records)
+
+    def merge(self, threshold=0.3):
+        """
+        Fusionar detecciones superpuestas (overlap / área mínima > threshold).
+        El texto de cada grupo es el del miembro con texto de mayor confianza.
+        """
+        if len(self.records) == 0:
+            return DetectionSet()
+
+        boxes = self.boxes
+        confidences = self.records['confidence']
+        labels = group_overlapping(boxes, threshold)
+        merged, merged_conf, merged_masks, counts = aggregate_groups(
+            labels, boxes, confidences, self.records['methods'])
+
+        texts = np.full(len(counts), None, dtype=object)
+        with_text = np.flatnonzero(np.not_equal(self.records['text'], None))
+        if len(with_text):
+            # Por grupo, el primer miembro con texto tras ordenar por confianza descendente
+            order = with_text[np.lexsort((-confidences[with_text], labels[with_text]))]
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = labels[order][1:] != labels[order][:-1]
+            texts[labels[order][first]] = self.records['text'][order][first]
+
+        result = DetectionSet.from_arrays(merged, merged_conf, merged_masks, texts, counts)
+        return result.sort_by('confidence')
+
+    def _record_dict(self, record):
+        x, y, w, h = int(record['x']), int(record['y']), int(record['width']), int(record['height'])
+        button = {
+            'method': method_names(record['methods']),
+            'bbox': (x, y, w, h),
+            'confidence': float(record['confidence']),
+            'center': (x + w//2, y + h//2),
+            'detection_count': int(record['count'])
+        }
+        if record['text'] is not None:
+            button['text'] = record['text']
+        return button
+
+    def to_dicts(self, style='bbox'):
+        """
+        Vista en dicts para compatibilidad.
+        style='bbox': formato de AIButtonDetector (bbox/center)
+        style='xywh': formato de ui_clicker (x/y/width/height/center_x/center_y)
+        """
+        buttons = [self._record_dict(record) for record in self.records]
+        if style == 'bbox':
+            return buttons
+
+        formatted = []
+        for button in buttons:
+            x, y, w, h = button['bbox']
+            entry = {
+                'x': x,
+                'y': y,
+                'width': w,
+                'height': h,
+                'confidence': button['confidence'],
+                'method': button['method'],
+                'center_x': button['center'][0],
+                'center_y': button['center'][1]
+            }
+            if 'text' in button:
+                entry['text'] = button['text']
+            formatted.append(entry)
+        return formatted
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de preprocesamiento por frame
+Calcula una sola vez los planos derivados de una captura (gris, LAB, HSV, Sobel,
+Canny, umbrales) y los comparte entre todos los detectores
+"""
+
+import hashlib
+import threading
+
+import cv2
+import numpy as np
+
+
+def frame_hash(image):
+    """Hash rápido y exacto de los píxeles (incluye forma y tipo)"""
+    pixels = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{pixels.shape}{pixels.dtype}".encode())
+    digest.update(memoryview(pixels).cast('B'))
+    return digest.hexdigest()
+
+
+class FrameCache:
+    """Frame con planos derivados calculados bajo demanda y memorizados"""
+
+    def __init__(self, image, color_order='BGR'):
+        if color_order not in ('BGR', 'RGB'):
+            raise ValueError(f"Orden de color no soportado: {color_order}")
+        self.image = image
+        self.color_order = color_order
+        self._planes = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    @classmethod
+    def wrap(cls, image, color_order='BGR'):
+        """Devolver un FrameCache para la imagen (o el mismo si ya lo es)"""
+        if isinstance(image, cls):
+            return image
+        return cls(image, color_order)
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def digest(self):
+        """Hash de los píxeles del frame (memorizado)"""
+        return self.memo('digest', lambda: frame_hash(self.image))
+
+    def _conversion(self, bgr_code, rgb_code):
+        return bgr_code if self.color_order == 'BGR' else rgb_code
+
+    def memo(self, key, compute):
+        """Calcular un plano una sola vez por frame (seguro entre hilos)"""
+        try:
+            return self._planes[key]
+        except KeyError:
+            pass
+
+        with self._locks_guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        with lock:
+            if key not in self._planes:
+                self._planes[key] = compute()
+        return self._planes[key]
+
+    def gray(self):
+        """Escala de grises"""
+        if self.image.ndim == 2:
+            return self.image
+        code = self._conversion(cv2.COLOR_BGR2GRAY, cv2.COLOR_RGB2GRAY)
+        return self.memo('gray', lambda: cv2.cvtColor(self.image, code))
+
+    def lab(self):
+        """Espacio de color LAB"""
+        code = self._conversion(cv2.COLOR_BGR2LAB, cv2.COLOR_RGB2LAB)
+        return self.memo('lab', lambda: cv2.cvtColor(self.image, code))
+
+    def hsv(self):
+        """Espacio de color HSV"""
+        code = self._conversion(cv2.COLOR_BGR2HSV, cv2.COLOR_RGB2HSV)
+        return self.memo('hsv', lambda: cv2.cvtColor(self.image, code))
+
+    def bgr(self):
+        """Imagen en orden BGR (la usada por los detectores de color)"""
+        if self.color_order == 'BGR':
+            return self.image
+        return self.memo('bgr', lambda: cv2.cvtColor(self.image, cv2.COLOR_RGB2BGR))
+
+    def pyramid(self, level):
+        """Plano gris reducido 2^level veces con pyrDown (nivel 0 = original)"""
+        if level <= 0:
+            return self.gray()
+        return self.memo(('pyramid', level), lambda: cv2.pyrDown(self.pyramid(level - 1)))
+
+    def sobel(self, dx, dy, ksize=3):
+        """Derivada de Sobel del plano gris en CV_64F"""
+        return self.memo(('sobel', dx, dy, ksize),
+                         lambda: cv2.Sobel(self.gray(), cv2.CV_64F, dx, dy, ksize=ksize))
+
+    def gradient_magnitude(self, ksize=3):
+        """Magnitud del gradiente normalizada a uint8"""
+        def compute():
+            grad_x = self.sobel(1, 0, ksize)
+            grad_y = self.sobel(0, 1, ksize)
+            magnitude = np.sqrt(grad_x**2 + grad_y**2)
+            max_value = np.max(magnitude)
+            if max_value == 0:
+                return np.zeros(magnitude.shape, dtype=np.uint8)
+            return np.uint8(255 * magnitude / max_value)
+
+        return self.memo(('gradient_magnitude', ksize), compute)
+
+    def blurred(self, ksize=3):
+        """Gris suavizado con blur gaussiano"""
+        return self.memo(('blurred', ksize),
+                         lambda: cv2.GaussianBlur(self.gray(), (ksize, ksize), 0))
+
+    def canny(self, threshold1, threshold2, blur=None):
+        """Mapa de bordes Canny para unos umbrales dados"""
+        def compute():
+            source = self.blurred(blur) if blur else self.gray()
+            return cv2.Canny(source, threshold1, threshold2)
+
+        return self.memo(('canny', threshold1, threshold2, blur), compute)
+
+    def threshold(self, thresh, maxval=255):
+        """Umbral binario fijo"""
+        return self.memo(('threshold', thresh, maxval),
+                         lambda: cv2.threshold(self.gray(), thresh, maxval, cv2.THRESH_BINARY)[1])
+
+    def otsu(self):
+        """Umbral binario de Otsu"""
+        return self.memo('otsu',
+                         lambda: cv2.threshold(self.gray(), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1])
+
+    def adaptive_threshold(self, block_size=11, c=2):
+        """Umbral adaptativo gaussiano"""
+        return self.memo(('adaptive', block_size, c),
+                         lambda: cv2.adaptiveThreshold(self.gray(), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                                       cv2.THRESH_BINARY, block_size, c))
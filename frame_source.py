@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Fuentes de frames intercambiables
+Todas las capturas pasan por una FrameSource: la pantalla real, un directorio
+de PNGs, un archivo .npz o de video, o un generador en memoria. Así el pipeline
+se puede reproducir y medir sin escritorio (p. ej. en Linux)
+
+Todas las fuentes devuelven arrays RGB uint8 (alto, ancho, 3), igual que
+np.array(ImageGrab.grab()). La variable de entorno BOT_FRAME_SOURCE cambia la
+fuente por defecto ('screen', un directorio, un .npz o un video)
+"""
+
+import glob
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from instrumentation import span, count
+
+
+def crop_region(image, region):
+    """Vista (sin copia) de la región (x, y, ancho, alto), recortada a la imagen"""
+    if image is None or region is None:
+        return image
+    x, y, w, h = region
+    height, width = image.shape[:2]
+    x0, y0 = max(int(x), 0), max(int(y), 0)
+    x1, y1 = min(int(x + w), width), min(int(y + h), height)
+    return image[y0:max(y1, y0), x0:max(x1, x0)]
+
+
+def to_rgb(image):
+    """Normalizar un frame BGR/gris/BGRA leído con OpenCV a RGB"""
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class FrameSource:
+    """Interfaz común: grab(region) devuelve un frame RGB o None si no hay más"""
+
+    name = 'source'
+
+    def grab(self, region=None):
+        """Capturar un frame (opcionalmente solo la región (x, y, ancho, alto))"""
+        with span(f'capture.{self.name}'):
+            frame = self._grab(region)
+        if frame is not None:
+            count('captures')
+        return frame
+
+    def _grab(self, region):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class ScreenSource(FrameSource):
+    """Pantalla en vivo (ImageGrab)"""
+
+    name = 'screen'
+
+    def _grab(self, region):
+        from PIL import ImageGrab
+
+        bbox = None
+        if region is not None:
+            x, y, w, h = region
+            bbox = (x, y, x + w, y + h)
+
+        image = ImageGrab.grab(bbox=bbox)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.array(image)
+
+
+class ReplaySource(FrameSource):
+    """
+    Base de las fuentes grabadas. Con advance_on_grab=True cada captura devuelve
+    el siguiente frame; con False el frame actual se repite hasta llamar a advance().
+    Con loop=True vuelve al principio al terminar; si no, devuelve None
+    """
+
+    name = 'replay'
+
+    def __init__(self, loop=False, advance_on_grab=True):
+        self.loop = loop
+        self.advance_on_grab = advance_on_grab
+        self.position = 0
+        self._current = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def _read(self, index):
+        """Frame RGB número index"""
+        raise NotImplementedError
+
+    def seek(self, index):
+        """Colocarse en el frame index"""
+        with self._lock:
+            self.position = index
+            self._current = None
+
+    def advance(self):
+        """Pasar al siguiente frame (modo advance_on_grab=False)"""
+        with self._lock:
+            self.position += 1
+            self._current = None
+
+    def _grab(self, region):
+        with self._lock:
+            if self.position >= len(self):
+                if not self.loop or len(self) == 0:
+                    return None
+                self.position = 0
+                self._current = None
+
+            if self._current is None:
+                self._current = self._read(self.position)
+            frame = self._current
+
+            if self.advance_on_grab:
+                self.position += 1
+                self._current = None
+
+        return crop_region(frame, region)
+
+
+class DirectorySource(ReplaySource):
+    """Directorio de imágenes, en orden alfabético"""
+
+    name = 'directory'
+
+    def __init__(self, path, pattern='*.png', **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.files = sorted(glob.glob(os.path.join(path, pattern)))
+
+    def __len__(self):
+        return len(self.files)
+
+    def _read(self, index):
+        image = cv2.imread(self.files[index], cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise IOError(f"No se pudo leer el frame: {self.files[index]}")
+        return to_rgb(image)
+
+
+class NpzSource(ReplaySource):
+    """
+    Archivo .npz con un array 'frames' (n, alto, ancho, 3) en RGB, o con un
+    array RGB por frame (se leen en el orden de las claves)
+    """
+
+    name = 'npz'
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._archive = np.load(path)
+        self._frames = self._archive['frames'] if 'frames' in self._archive.files else None
+        self._keys = sorted(self._archive.files) if self._frames is None else None
+
+    def __len__(self):
+        return len(self._frames) if self._frames is not None else len(self._keys)
+
+    def _read(self, index):
+        if self._frames is not None:
+            return self._frames[index]
+        return self._archive[self._keys[index]]
+
+    def close(self):
+        self._archive.close()
+
+
+class VideoSource(ReplaySource):
+    """Archivo de video leído con OpenCV (frames en orden, sin saltos)"""
+
+    name = 'video'
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._capture = cv2.VideoCapture(path)
+        if not self._capture.isOpened():
+            raise IOError(f"No se pudo abrir el video: {path}")
+        self._length = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self._next_index = 0
+
+    def __len__(self):
+        return self._length
+
+    def _read(self, index):
+        # Leer en secuencia es mucho más barato que posicionar el decodificador
+        if index != self._next_index:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ok, image = self._capture.read()
+        if not ok:
+            raise IOError(f"No se pudo leer el frame {index} de {self.path}")
+        self._next_index = index + 1
+        return to_rgb(image)
+
+    def close(self):
+        self._capture.release()
+
+    def __getstate__(self):
+        raise TypeError("VideoSource no se puede serializar")
+
+
+class GeneratorSource(FrameSource):
+    """Frames RGB producidos por un iterable en memoria (o una función que lo devuelve)"""
+
+    name = 'generator'
+
+    def __init__(self, frames):
+        self._iterator = iter(frames() if callable(frames) else frames)
+        self._lock = threading.Lock()
+
+    def _grab(self, region):
+        with self._lock:
+            frame = next(self._iterator, None)
+        if frame is None:
+            return None
+        return crop_region(np.asarray(frame), region)
+
+
+def open_frame_source(spec=None, **kwargs):
+    """
+    Crear una fuente a partir de una especificación:
+    None/'screen', una FrameSource, un directorio, un .npz, un video o un iterable
+    """
+    if spec is None or spec == 'screen':
+        return ScreenSource()
+    if isinstance(spec, FrameSource):
+        return spec
+    if isinstance(spec, (str, os.PathLike)):
+        path = os.fspath(spec)
+        if os.path.isdir(path):
+            return DirectorySource(path, **kwargs)
+        if path.lower().endswith('.npz'):
+            return NpzSource(path, **kwargs)
+        return VideoSource(path, **kwargs)
+    return GeneratorSource(spec)
+
+
+_default_source = None
+_default_lock = threading.Lock()
+
+
+def default_frame_source():
+    """Fuente compartida por defecto (BOT_FRAME_SOURCE o la pantalla)"""
+    global _default_source
+    with _default_lock:
+        if _default_source is None:
+            _default_source = open_frame_source(os.environ.get('BOT_FRAME_SOURCE') or None)
+        return _default_source
+
+
+def set_default_frame_source(source):
+    """Cambiar la fuente por defecto de los componentes creados a partir de ahora"""
+    global _default_source
+    with _default_lock:
+        _default_source = open_frame_source(source) if source is not None else None
+
+
+def resolve_frame_source(source=None):
+    """Fuente indicada o, si es None, la fuente por defecto"""
+    if source is None:
+        return default_frame_source()
+    return open_frame_source(source)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Detector incremental basado en diferencias entre frames
+Entre pasos del instalador normalmente solo cambia parte de la ventana: se
+re-detecta únicamente en los tiles modificados y se reutiliza el resto
+"""
+
+import cv2
+import numpy as np
+
+from ai_button_detector import AIButtonDetector
+from frame_cache import FrameCache
+
+
+# Mayor kernel de los métodos (umbral adaptativo de 11x11; Canny y Sobel usan 3x3)
+KERNEL_CONTEXT = 11
+
+
+def _touches(box, region):
+    x, y, w, h = region
+    bx, by, bw, bh = box
+    return bx < x + w and bx + bw > x and by < y + h and by + bh > y
+
+
+class IncrementalButtonDetector(AIButtonDetector):
+    """
+    AIButtonDetector que recuerda el frame anterior y solo re-analiza lo que cambió.
+    Guarda las detecciones sin fusionar de cada método: las de zonas sin cambios
+    se combinan con las nuevas de las regiones sucias y se fusiona una sola vez,
+    como en la detección completa. context: píxeles de contexto alrededor de
+    cada región sucia (None = el mayor template o kernel de los métodos).
+    No siempre es idéntico a la detección completa: los contornos externos
+    dependen de estructuras fuera del recorte (p. ej. el marco de la ventana);
+    benchmark_detection compara ambos sobre la misma secuencia de frames
+    """
+
+    def __init__(self, debug=True, tile_size=64, margin=32, diff_threshold=12,
+                 max_dirty_ratio=0.5, context=None, **kwargs):
+        super().__init__(debug=debug, **kwargs)
+        self.tile_size = tile_size
+        self.margin = margin
+        self.diff_threshold = diff_threshold
+        self.max_dirty_ratio = max_dirty_ratio
+        self.context = context
+
+        # Por captura: (gris anterior, detecciones sin fusionar por método, botones)
+        self._previous = {}
+
+    def reset(self):
+        """Olvidar los frames anteriores (la próxima detección será completa)"""
+        self._previous.clear()
+
+    def context_padding(self):
+        """
+        Contexto alrededor de cada región sucia, para que los templates y kernels
+        que cruzan su borde vean los mismos píxeles que en el frame completo
+        """
+        if self.context is not None:
+            return self.context
+        sizes = [max(pyramid[0].shape[:2]) for _, pyramid in self._get_button_templates()]
+        return max(sizes + [KERNEL_CONTEXT])
+
+    def dirty_tiles(self, previous_gray, current_gray):
+        """Máscara booleana de tiles donde algún píxel cambió más que el umbral"""
+        diff = cv2.absdiff(previous_gray, current_gray)
+
+        # Rellenar hasta múltiplo del tile y reducir cada bloque a su máximo
+        tile = self.tile_size
+        height, width = diff.shape[:2]
+        rows, cols = -(-height // tile), -(-width // tile)
+        padded = np.zeros((rows * tile, cols * tile), dtype=diff.dtype)
+        padded[:height, :width] = diff
+        block_max = padded.reshape(rows, tile, cols, tile).max(axis=(1, 3))
+
+        return block_max > self.diff_threshold
+
+    def dirty_regions(self, mask, shape):
+        """Rectángulos (x, y, w, h) en píxeles que cubren los tiles sucios más el margen"""
+        tile = self.tile_size
+        margin_tiles = -(-self.margin // tile)
+        dirty = mask.astype(np.uint8)
+        if margin_tiles:
+            size = 2 * margin_tiles + 1
+            dirty = cv2.dilate(dirty, np.ones((size, size), dtype=np.uint8))
+
+        height, width = shape[:2]
+        count, _, stats, _ = cv2.connectedComponentsWithStats(dirty, connectivity=8)
+
+        regions = []
+        for label in range(1, count):
+            tx, ty, tw, th = stats[label, :4]
+            x, y = int(tx * tile), int(ty * tile)
+            w = min(int((tx + tw) * tile), width) - x
+            h = min(int((ty + th) * tile), height) - y
+            regions.append((x, y, w, h))
+        return regions
+
+    def _detect_capture(self, capture_name, frame):
+        """Detectar reutilizando las detecciones de los tiles sin cambios"""
+        frame = FrameCache.wrap(frame)
+        gray = frame.gray()
+        previous = self._previous.get(capture_name)
+
+        if previous is None or previous[0].shape != gray.shape:
+            candidates = self.detect_candidates(frame)
+            buttons = self.merge_candidates(candidates)
+        else:
+            previous_gray, previous_candidates, previous_buttons = previous
+            mask = self.dirty_tiles(previous_gray, gray)
+
+            if not mask.any():
+                if self.debug:
+                    print("   ♻️ Sin cambios, reutilizando detecciones")
+                candidates = previous_candidates
+                buttons = [dict(b) for b in previous_buttons]
+            else:
+                if mask.mean() > self.max_dirty_ratio:
+                    candidates = self.detect_candidates(frame)
+                else:
+                    candidates = self._detect_dirty_regions(frame, mask, previous_candidates)
+                buttons = self.merge_candidates(candidates)
+
+        self._previous[capture_name] = (gray.copy(), candidates, [dict(b) for b in buttons])
+        return buttons
+
+    def _detect_dirty_regions(self, frame, mask, previous_candidates):
+        """
+        Detecciones sin fusionar por método: las anteriores que no tocan ninguna
+        región sucia más las nuevas de cada región, detectadas con contexto
+        """
+        regions = self.dirty_regions(mask, frame.shape)
+        if self.debug:
+            print(f"   🧩 Re-analizando {len(regions)} regiones modificadas")
+
+        candidates = {
+            detection_method: [dict(b) for b in previous_candidates.get(detection_method, [])
+                               if not any(_touches(b['bbox'], region) for region in regions)]
+            for detection_method in self.detection_methods
+        }
+
+        pad = self.context_padding()
+        # Origen múltiplo de 2^niveles: la pirámide del recorte coincide con la del frame
+        align = 2 ** self.template_pyramid_levels
+        height, width = frame.shape[:2]
+        for index, region in enumerate(regions):
+            x, y, w, h = region
+            x0, y0 = max(x - pad, 0) // align * align, max(y - pad, 0) // align * align
+            x1, y1 = min(x + w + pad, width), min(y + h + pad, height)
+            crop = FrameCache(frame.image[y0:y1, x0:x1], frame.color_order)
+            self._share_global_planes(frame, crop, (y0, y1, x0, x1))
+
+            for detection_method, found in self.detect_candidates(crop).items():
+                for button in found:
+                    bx, by, bw, bh = button['bbox']
+                    box = (bx + x0, by + y0, bw, bh)
+                    # Solo las que tocan la región (el contexto ya está en las conservadas),
+                    # y una sola vez aunque los contextos de dos regiones se solapen
+                    owner = next((i for i, r in enumerate(regions) if _touches(box, r)), None)
+                    if owner != index:
+                        continue
+                    cx, cy = button['center']
+                    candidates[detection_method].append(
+                        dict(button, bbox=box, center=(cx + x0, cy + y0)))
+
+        return candidates
+
+    @staticmethod
+    def _share_global_planes(frame, crop, bounds):
+        """
+        Los planos que dependen de toda la imagen (umbral de Otsu, gradiente
+        normalizado por su máximo) se recortan del frame completo: calculados
+        sobre el recorte darían otros umbrales que la detección completa
+        """
+        y0, y1, x0, x1 = bounds
+        crop.memo('otsu', lambda: np.ascontiguousarray(frame.otsu()[y0:y1, x0:x1]))
+        crop.memo(('gradient_magnitude', 3),
+                  lambda: np.ascontiguousarray(frame.gradient_magnitude(3)[y0:y1, x0:x1]))
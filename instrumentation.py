@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentación opcional por etapas
+Spans anidados (captura, cada _detect_*, fusión, OCR, esperas, clicks) y
+contadores (píxeles procesados, invocaciones de OCR, capturas, candidatos).
+Exporta a JSON de Chrome trace (chrome://tracing, Perfetto) y a texto de
+Prometheus. Desactivada por defecto: cada punto de medida cuesta una comprobación
+
+Activar con enable() o con la variable de entorno BOT_TRACE=<prefijo>, que al
+salir escribe <prefijo>.trace.json y <prefijo>.prom
+"""
+
+import atexit
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+
+class _NullSpan:
+    """Span vacío que se devuelve cuando la instrumentación está desactivada"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """Intervalo medido; al cerrarse se registra en el tracer"""
+
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer._record_span(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+    def set(self, key, value):
+        """Añadir un argumento al span (visible en el trace)"""
+        self.args[key] = value
+
+
+class Tracer:
+    """Colector de spans y contadores (seguro entre hilos)"""
+
+    def __init__(self, max_events=1000000):
+        self.enabled = False
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Descartar todos los eventos, estadísticas y contadores"""
+        with self._lock:
+            self._origin = time.perf_counter_ns()
+            self._events = []
+            self._stages = {}
+            self._counters = {}
+            self.dropped_events = 0
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, args)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        with self._lock:
+            total = self._counters.get(name, 0) + value
+            self._counters[name] = total
+            self._append_event({'name': name, 'ph': 'C', 'ts': (now - self._origin) / 1000,
+                                'pid': os.getpid(), 'tid': threading.get_ident(),
+                                'args': {'value': total}})
+
+    def _record_span(self, name, start, end, args):
+        duration = end - start
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {'calls': 0, 'total_ns': 0, 'max_ns': 0}
+            stage['calls'] += 1
+            stage['total_ns'] += duration
+            stage['max_ns'] = max(stage['max_ns'], duration)
+
+            event = {'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X',
+                     'ts': (start - self._origin) / 1000, 'dur': duration / 1000,
+                     'pid': os.getpid(), 'tid': threading.get_ident()}
+            if args:
+                event['args'] = args
+            self._append_event(event)
+
+    def _append_event(self, event):
+        # Las estadísticas agregadas siguen completas aunque se descarten eventos
+        if len(self._events) < self.max_events:
+            self._events.append(event)
+        else:
+            self.dropped_events += 1
+
+    def summary(self):
+        """Tiempo por etapa (ms) y valor de cada contador"""
+        with self._lock:
+            stages = {
+                name: {
+                    'calls': stage['calls'],
+                    'total_ms': stage['total_ns'] / 1e6,
+                    'mean_ms': stage['total_ns'] / stage['calls'] / 1e6,
+                    'max_ms': stage['max_ns'] / 1e6
+                }
+                for name, stage in self._stages.items()
+            }
+            return {'stages': stages, 'counters': dict(self._counters)}
+
+    def export_chrome_trace(self, path):
+        """Escribir los eventos en formato Chrome trace-event JSON"""
+        with self._lock:
+            events = list(self._events)
+            dropped = self.dropped_events
+        trace = {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'dropped_events': dropped}
+        }
+        _write_atomic(path, json.dumps(trace, default=_json_default))
+        return path
+
+    def export_prometheus(self, path, prefix='bot_instalador'):
+        """Escribir etapas y contadores en formato de texto de Prometheus"""
+        summary = self.summary()
+        lines = [
+            f'# HELP {prefix}_stage_seconds Tiempo acumulado por etapa',
+            f'# TYPE {prefix}_stage_seconds summary'
+        ]
+        for name, stage in sorted(summary['stages'].items()):
+            label = _label_value(name)
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{label}"}} {stage["total_ms"] / 1000:.9f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{label}"}} {stage["calls"]}')
+
+        lines.append(f'# HELP {prefix}_stage_max_seconds Duración máxima por etapa')
+        lines.append(f'# TYPE {prefix}_stage_max_seconds gauge')
+        for name, stage in sorted(summary['stages'].items()):
+            lines.append(f'{prefix}_stage_max_seconds{{stage="{_label_value(name)}"}} '
+                         f'{stage["max_ms"] / 1000:.9f}')
+
+        for name, value in sorted(summary['counters'].items()):
+            metric = f'{prefix}_{_metric_name(name)}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+
+        _write_atomic(path, '\n'.join(lines) + '\n')
+        return path
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _json_default(value):
+    # Escalares de NumPy en los argumentos de los spans
+    try:
+        return value.item()
+    except AttributeError:
+        return str(value)
+
+
+def _write_atomic(path, content):
+    # El colector de textfile de Prometheus no debe leer un archivo a medio escribir
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+# Tracer global del proceso
+TRACER = Tracer()
+
+
+def enable():
+    TRACER.enabled = True
+
+
+def disable():
+    TRACER.enabled = False
+
+
+def is_enabled():
+    return TRACER.enabled
+
+
+def reset():
+    TRACER.reset()
+
+
+def span(name, **args):
+    """Context manager que mide una etapa (no hace nada si está desactivada)"""
+    if not TRACER.enabled:
+        return _NULL_SPAN
+    return Span(TRACER, name, args)
+
+
+def count(name, value=1):
+    """Incrementar un contador (no hace nada si está desactivada)"""
+    if TRACER.enabled:
+        TRACER.count(name, value)
+
+
+def traced(name):
+    """Decorador que mide cada llamada a la función como un span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            with Span(TRACER, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_sleep(seconds):
+    """time.sleep medido como etapa 'sleep' (para ver cuánto se espera por paso)"""
+    with span('sleep', seconds=seconds):
+        time.sleep(seconds)
+    count('sleep_seconds', seconds)
+
+
+def summary():
+    return TRACER.summary()
+
+
+def export_chrome_trace(path):
+    return TRACER.export_chrome_trace(path)
+
+
+def export_prometheus(path, prefix='bot_instalador'):
+    return TRACER.export_prometheus(path, prefix)
+
+
+def _export_at_exit(prefix):
+    try:
+        export_chrome_trace(f"{prefix}.trace.json")
+        export_prometheus(f"{prefix}.prom")
+        print(f"📈 Trazas guardadas en: {prefix}.trace.json / {prefix}.prom")
+    except Exception as e:
+        print(f"❌ Error guardando trazas: {e}")
+
+
+_env_prefix = os.environ.get('BOT_TRACE')
+if _env_prefix:
+    enable()
+    atexit.register(_export_at_exit, _env_prefix)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de resultados de OCR por contenido
+La clave es el hash de los píxeles que recibe Tesseract (ya preprocesados) más
+el método, la configuración (psm), el idioma, el motor y su versión (un
+Tesseract actualizado no reutiliza resultados del anterior). Tiene un nivel en
+memoria (LRU acotado en bytes) y uno opcional en disco (SQLite) que se
+conserva entre ejecuciones, así las mismas etiquetas de botones y textos de
+página no se vuelven a reconocer ni en la misma instalación ni en la siguiente
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from frame_cache import frame_hash
+
+
+def _json_default(value):
+    # Escalares de NumPy en los resultados de algunos motores
+    try:
+        return value.item()
+    except AttributeError:
+        return str(value)
+
+
+class OCRCache:
+    """
+    Caché de dos niveles acotada en bytes.
+    max_bytes: tamaño máximo del nivel en memoria
+    path: archivo SQLite del nivel en disco (None = solo memoria)
+    max_disk_bytes: tamaño máximo de los resultados guardados en disco
+    disk_refresh_every: escrituras entre recálculos del tamaño en disco (varios
+    procesos pueden compartir el archivo, así que el total local se desvía)
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, path=None, max_disk_bytes=256 * 1024 * 1024,
+                 disk_refresh_every=256):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_refresh_every = disk_refresh_every
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        self._db = None
+        self._disk_bytes = 0
+        self._disk_writes = 0
+        if path:
+            self._open_disk(path)
+
+    @staticmethod
+    def key(image, method, config, lang, backend, version=None):
+        """Clave por contenido: hash de los píxeles, opciones del OCR y versión del motor"""
+        engine = f"{backend}-{version}" if version else backend
+        return f"{frame_hash(image)}:{method}:{engine}:{lang}:{' '.join((config or '').split())}"
+
+    def _open_disk(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS ocr '
+                         '(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+                         'used REAL NOT NULL)')
+        # Índice que cubre la expulsión (por uso) y la suma de tamaños
+        self._db.execute('DROP INDEX IF EXISTS ocr_used')
+        self._db.execute('CREATE INDEX IF NOT EXISTS ocr_used_size ON ocr (used, size)')
+        self._db.commit()
+        self._disk_bytes = self._disk_total()
+
+    def _disk_total(self):
+        """Tamaño real de los resultados en disco (incluye los de otros procesos)"""
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM ocr').fetchone()[0]
+
+    def get(self, key):
+        """Resultado guardado (copia nueva) o None"""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(payload)
+
+            if self._db is not None:
+                row = self._db.execute('SELECT value FROM ocr WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE ocr SET used = ? WHERE key = ?', (time.time(), key))
+                    self._db.commit()
+                    self.disk_hits += 1
+                    self._remember(key, bytes(row[0]))
+                    return json.loads(row[0])
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Guardar un resultado (texto o dict de image_to_data) en ambos niveles"""
+        payload = json.dumps(value, ensure_ascii=False, default=_json_default).encode('utf-8')
+        with self._lock:
+            self._remember(key, payload)
+            if self._db is not None:
+                self._store(key, payload)
+
+    def _remember(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = payload
+        self._bytes += len(payload)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _store(self, key, payload):
+        row = self._db.execute('SELECT size FROM ocr WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            self._disk_bytes -= row[0]
+        self._db.execute('INSERT OR REPLACE INTO ocr (key, value, size, used) VALUES (?, ?, ?, ?)',
+                         (key, payload, len(payload), time.time()))
+        self._disk_bytes += len(payload)
+
+        # El total local no ve lo que escriben otros procesos: recalcularlo cada
+        # disk_refresh_every escrituras y antes de expulsar
+        self._disk_writes += 1
+        if self._disk_writes % self.disk_refresh_every == 0 or self._disk_bytes > self.max_disk_bytes:
+            self._disk_bytes = self._disk_total()
+
+        # Expulsar los resultados usados hace más tiempo hasta volver al límite
+        while self._disk_bytes > self.max_disk_bytes:
+            oldest = self._db.execute('SELECT key, size FROM ocr ORDER BY used LIMIT 64').fetchall()
+            if not oldest:
+                break
+            for old_key, size in oldest:
+                self._db.execute('DELETE FROM ocr WHERE key = ?', (old_key,))
+                self._disk_bytes -= size
+                self.disk_evictions += 1
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+        self._db.commit()
+
+    def clear(self, disk=False):
+        """Vaciar la memoria (y el disco si disk=True); los contadores se conservan"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if disk and self._db is not None:
+                self._db.execute('DELETE FROM ocr')
+                self._db.commit()
+                self._disk_bytes = 0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        """Contadores de uso y tamaño de la caché"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': hits / total if total else 0.0
+            }
+            if self._db is not None:
+                stats['disk_entries'] = self._db.execute('SELECT COUNT(*) FROM ocr').fetchone()[0]
+                stats['disk_bytes'] = self._disk_bytes
+                stats['disk_evictions'] = self.disk_evictions
+            return stats
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Motores de OCR reutilizables
+Con tesserocr (API de Tesseract dentro del proceso) cada motor carga los datos
+de idioma una sola vez y recibe los píxeles directamente, sin archivos
+temporales ni un proceso `tesseract` por llamada. Si tesserocr no está
+instalado (o no se puede inicializar) se usa pytesseract como antes.
+
+OCRPool mantiene varios motores de larga vida (uno por hilo en uso) y reparte
+el trabajo entre núcleos: tesserocr libera el GIL mientras reconoce. La
+variable de entorno BOT_OCR_BACKEND fuerza 'tesserocr' o 'pytesseract'.
+Con BOT_OCR_CACHE (archivo SQLite) el pool por defecto guarda los resultados
+en una OCRCache por contenido que se conserva entre ejecuciones; sin ella no
+hay caché
+"""
+
+import os
+import queue
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+import pytesseract
+
+from instrumentation import count
+from ocr_cache import OCRCache
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+
+# Columnas de la salida TSV de Tesseract (igual que pytesseract.Output.DICT)
+TSV_COLUMNS = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text']
+
+
+def tsv_to_dict(tsv, header=True):
+    """Convertir la salida TSV de Tesseract al dict de columnas de pytesseract"""
+    rows = [row.split('\t') for row in tsv.strip('\n').split('\n') if row]
+    if header and rows:
+        rows.pop(0)
+    result = {column: [] for column in TSV_COLUMNS}
+    for row in rows:
+        # La última celda de texto puede faltar si está vacía
+        row = row + [''] * (len(TSV_COLUMNS) - len(row))
+        for column, value in zip(TSV_COLUMNS, row):
+            if column == 'text':
+                result[column].append(value)
+            else:
+                try:
+                    result[column].append(int(float(value)))
+                except ValueError:
+                    result[column].append(value)
+    return result
+
+
+def parse_psm(config):
+    """
+    Modo de segmentación de una configuración de pytesseract. La API en proceso
+    solo admite '--psm N'; devuelve None si hay alguna otra opción
+    """
+    tokens = (config or '').split()
+    if not tokens:
+        return tesserocr.PSM.AUTO  # El mismo modo por defecto que el binario
+    if len(tokens) == 2 and tokens[0] == '--psm' and tokens[1].isdigit():
+        return int(tokens[1])
+    return None
+
+
+def engine_version(backend):
+    """Versión de Tesseract (y de tesserocr) de un backend; 'unknown' si no se puede leer"""
+    try:
+        if backend == 'tesserocr':
+            return f"{tesserocr.tesseract_version().split()[1]}+tesserocr{tesserocr.__version__}"
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return 'unknown'
+
+
+def as_array(image):
+    """Píxeles contiguos uint8 (gris, RGB o RGBA) de un array o una imagen PIL"""
+    if isinstance(image, Image.Image):
+        if image.mode not in ('L', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+        image = np.asarray(image)
+    return np.ascontiguousarray(image, dtype=np.uint8)
+
+
+class PytesseractEngine:
+    """Motor de respaldo: un proceso tesseract por llamada"""
+
+    name = 'pytesseract'
+
+    def image_to_string(self, image, config='', lang=None):
+        return pytesseract.image_to_string(image, config=config, lang=lang)
+
+    def image_to_data(self, image, config='', lang=None):
+        return pytesseract.image_to_data(image, config=config, lang=lang,
+                                         output_type=pytesseract.Output.DICT)
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """
+    Motor en proceso: una API de Tesseract por idioma, inicializada una vez.
+    Un motor no es seguro entre hilos; OCRPool le da cada motor a un solo hilo
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, default_lang='eng'):
+        if tesserocr is None:
+            raise RuntimeError("tesserocr no está instalado")
+        self.default_lang = default_lang
+        self._apis = {}
+        self._fallback = PytesseractEngine()
+        # Validar que Tesseract y los datos del idioma por defecto se cargan
+        self._api(default_lang)
+
+    def _api(self, lang):
+        lang = lang or self.default_lang
+        api = self._apis.get(lang)
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(lang=lang)
+            self._apis[lang] = api
+        return api
+
+    def _prepare(self, image, config, lang):
+        psm = parse_psm(config)
+        if psm is None:
+            return None
+
+        api = self._api(lang)
+        api.SetPageSegMode(psm)
+
+        pixels = as_array(image)
+        height, width = pixels.shape[:2]
+        channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+        api.SetImageBytes(pixels.tobytes(), width, height, channels, width * channels)
+        return api
+
+    def image_to_string(self, image, config='', lang=None):
+        api = self._prepare(image, config, lang)
+        if api is None:
+            # Opciones que la API en proceso no entiende: usar el binario
+            return self._fallback.image_to_string(image, config=config, lang=lang)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+    def image_to_data(self, image, config='', lang=None):
+        api = self._prepare(image, config, lang)
+        if api is None:
+            return self._fallback.image_to_data(image, config=config, lang=lang)
+        try:
+            api.Recognize()
+            return tsv_to_dict(api.GetTSVText(0), header=False)
+        finally:
+            api.Clear()
+
+    def close(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis.clear()
+
+
+class OCRPool:
+    """
+    Pool de motores de OCR de larga vida.
+    backend: 'auto' (tesserocr si está disponible, si no pytesseract),
+    'tesserocr' o 'pytesseract'. size: motores/hilos como máximo (por defecto, núcleos).
+    cache: OCRCache compartida por todas las llamadas (None = sin caché)
+    """
+
+    def __init__(self, size=None, backend=None, lang='eng', cache=None):
+        backend = backend or os.environ.get('BOT_OCR_BACKEND') or 'auto'
+        if backend not in ('auto', 'tesserocr', 'pytesseract'):
+            raise ValueError(f"Backend de OCR no soportado: {backend}")
+        if backend == 'auto':
+            backend = 'tesserocr' if tesserocr is not None else 'pytesseract'
+        self.backend = backend
+        self.lang = lang
+        self.size = size or os.cpu_count() or 1
+        self.cache = cache
+
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._closed = False
+        self._versions = {}
+        # Libera motores, hilos y caché al cerrar, al recolectar el pool o al salir,
+        # sin mantener vivo el pool hasta el final del proceso
+        self._finalizer = weakref.finalize(self, _release_pool, self._idle, None, cache)
+
+    def _create_engine(self):
+        if self.backend == 'tesserocr':
+            try:
+                return TesserocrEngine(self.lang)
+            except Exception as e:
+                # Sin tessdata o sin la librería: seguir con el binario
+                print(f"⚠️ tesserocr no disponible ({e}), usando pytesseract")
+                self.backend = 'pytesseract'
+        return PytesseractEngine()
+
+    def engine_version(self):
+        """Versión del motor en uso (forma parte de la clave de la caché)"""
+        backend = self.backend
+        version = self._versions.get(backend)
+        if version is None:
+            version = self._versions[backend] = engine_version(backend)
+        return version
+
+    @contextmanager
+    def engine(self):
+        """Tomar un motor libre (creándolo si hace falta) para un solo hilo"""
+        try:
+            engine = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            engine = self._create_engine() if create else self._idle.get()
+        try:
+            yield engine
+        finally:
+            self._idle.put(engine)
+
+    def _recognize(self, method, image, config, lang):
+        key = None
+        if self.cache is not None:
+            key = OCRCache.key(as_array(image), method, config, lang or self.lang, self.backend,
+                               self.engine_version())
+            result = self.cache.get(key)
+            if result is not None:
+                count('ocr_cache_hits')
+                return result
+
+        with self.engine() as engine:
+            result = getattr(engine, method)(image, config=config, lang=lang)
+        if key is not None:
+            self.cache.put(key, result)
+        return result
+
+    def image_to_string(self, image, config='', lang=None):
+        return self._recognize('image_to_string', image, config, lang)
+
+    def image_to_data(self, image, config='', lang=None):
+        """Palabras con cajas y confianza (mismo dict que pytesseract.Output.DICT)"""
+        return self._recognize('image_to_data', image, config, lang)
+
+    def submit(self, method, image, config='', lang=None):
+        """Lanzar 'image_to_string' o 'image_to_data' en otro hilo; devuelve un Future"""
+        if method not in ('image_to_string', 'image_to_data'):
+            raise ValueError(f"Método de OCR no soportado: {method}")
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size,
+                                                    thread_name_prefix='ocr')
+                self._finalizer.detach()
+                self._finalizer = weakref.finalize(self, _release_pool, self._idle,
+                                                   self._executor, self.cache)
+        return self._executor.submit(getattr(self, method), image, config, lang)
+
+    def stats(self):
+        """Motor, motores creados y estadísticas de la caché"""
+        stats = {'backend': self.backend, 'version': self._versions.get(self.backend),
+                 'engines': self._created}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._finalizer()
+
+
+def _release_pool(idle, executor, cache):
+    """Cerrar los recursos de un OCRPool (no recibe el pool para no mantenerlo vivo)"""
+    if executor is not None:
+        executor.shutdown(wait=True)
+    while True:
+        try:
+            idle.get_nowait().close()
+        except queue.Empty:
+            break
+    if cache is not None:
+        cache.close()
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+def cache_from_env():
+    """OCRCache en memoria y en el archivo de BOT_OCR_CACHE, o None si no está definida"""
+    path = os.environ.get('BOT_OCR_CACHE')
+    return OCRCache(path=path) if path else None
+
+
+def default_ocr_pool():
+    """
+    Pool compartido por defecto (BOT_OCR_BACKEND o el mejor disponible), con
+    caché solo si BOT_OCR_CACHE indica un archivo
+    """
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = OCRPool(cache=cache_from_env())
+        return _default_pool
+
+
+def resolve_ocr_pool(ocr=None):
+    """Pool indicado o, si es None, el pool por defecto"""
+    return ocr if ocr is not None else default_ocr_pool()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Mosaico de recortes para OCR por lotes
+Empaqueta muchas regiones pequeñas en una sola imagen para hacer una única
+llamada a Tesseract, y devuelve las palabras en coordenadas de la imagen original
+"""
+
+import numpy as np
+
+
+def clip_boxes(boxes, image_shape):
+    """Recortar regiones (x, y, w, h) a los límites de la imagen, descartando las vacías"""
+    img_h, img_w = image_shape[:2]
+    clipped = []
+    for x, y, w, h in boxes:
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1, y1 = min(int(x + w), img_w), min(int(y + h), img_h)
+        if x1 > x0 and y1 > y0:
+            clipped.append((x0, y0, x1 - x0, y1 - y0))
+    return clipped
+
+
+def layout_tiles(boxes, padding=12, max_width=2000):
+    """
+    Colocar regiones (x, y, w, h) en filas (estantes).
+    Devuelve (tiles, ancho, alto) con tiles = [(mx, my, x, y, w, h), ...]
+    """
+    placements = []
+    cursor_x = padding
+    cursor_y = padding
+    row_height = 0
+    mosaic_w = 0
+
+    for x0, y0, w, h in boxes:
+        # Nueva fila si el recorte no cabe en la actual
+        if cursor_x + w + padding > max_width and cursor_x > padding:
+            cursor_x = padding
+            cursor_y += row_height + padding
+            row_height = 0
+
+        placements.append((cursor_x, cursor_y, x0, y0, w, h))
+        cursor_x += w + padding
+        row_height = max(row_height, h)
+        mosaic_w = max(mosaic_w, cursor_x)
+
+    return placements, mosaic_w, cursor_y + row_height + padding
+
+
+def build_mosaic(image, boxes, padding=12, max_width=2000, background=255):
+    """
+    Empaquetar recortes (x, y, w, h) de image en filas (estantes).
+    Devuelve (mosaico, tiles) con tiles = [(mx, my, x, y, w, h), ...]: posición del
+    recorte en el mosaico y su región de origen. Las regiones vacías se descartan.
+    """
+    boxes = clip_boxes(boxes, image.shape)
+    crops = [image[y0:y0+h, x0:x0+w] for x0, y0, w, h in boxes]
+    return build_mosaic_from_crops(crops, boxes, padding, max_width, background)
+
+
+def build_mosaic_from_crops(crops, boxes, padding=12, max_width=2000, background=255):
+    """
+    Igual que build_mosaic pero con recortes ya extraídos (p. ej. preprocesados);
+    boxes son sus regiones de origen (x, y, w, h), del mismo tamaño que cada recorte
+    """
+    if not crops:
+        return None, []
+
+    placements, mosaic_w, mosaic_h = layout_tiles(boxes, padding, max_width)
+    shape = (mosaic_h, mosaic_w) + crops[0].shape[2:]
+    mosaic = np.full(shape, background, dtype=crops[0].dtype)
+    for (mx, my, _, _, w, h), crop in zip(placements, crops):
+        mosaic[my:my+h, mx:mx+w] = crop
+
+    return mosaic, placements
+
+
+def map_words_to_tiles(data, tiles):
+    """
+    Traducir la salida de image_to_data sobre el mosaico a coordenadas de origen.
+    Devuelve lista de dicts {tile, text, left, top, width, height, conf, line}.
+    Las palabras cuyo centro no cae en ningún recorte se ignoran.
+    """
+    if not tiles:
+        return []
+
+    tiles_arr = np.array(tiles, dtype=np.int64)
+    mx, my = tiles_arr[:, 0], tiles_arr[:, 1]
+    tw, th = tiles_arr[:, 4], tiles_arr[:, 5]
+
+    words = []
+    for i in range(len(data['text'])):
+        text = str(data['text'][i]).strip()
+        if not text:
+            continue
+
+        left, top = int(data['left'][i]), int(data['top'][i])
+        width, height = int(data['width'][i]), int(data['height'][i])
+        cx, cy = left + width // 2, top + height // 2
+
+        inside = np.flatnonzero((cx >= mx) & (cx < mx + tw) & (cy >= my) & (cy < my + th))
+        if len(inside) == 0:
+            continue
+
+        t = int(inside[0])
+        words.append({
+            'tile': t,
+            'text': text,
+            'left': left - int(mx[t]) + tiles[t][2],
+            'top': top - int(my[t]) + tiles[t][3],
+            'width': width,
+            'height': height,
+            'conf': float(data['conf'][i]),
+            'line': (data.get('block_num', [0] * len(data['text']))[i],
+                     data.get('line_num', [0] * len(data['text']))[i])
+        })
+
+    return words
+
+
+def words_to_text(words):
+    """
+    Unir las palabras de un recorte en texto: se agrupan en líneas por posición
+    vertical (sirve con cualquier modo --psm) y se ordenan de izquierda a derecha
+    """
+    lines = []
+    for word in sorted(words, key=lambda w: (w['top'], w['left'])):
+        center_y = word['top'] + word['height'] / 2
+        line = lines[-1] if lines else None
+        if line is not None and line['top'] <= center_y < line['bottom']:
+            line['words'].append(word)
+            line['bottom'] = max(line['bottom'], word['top'] + word['height'])
+        else:
+            lines.append({'top': word['top'], 'bottom': word['top'] + word['height'], 'words': [word]})
+
+    return '\n'.join(' '.join(w['text'] for w in sorted(line['words'], key=lambda w: w['left']))
+                     for line in lines)
@@ -1,22 +1,92 @@
 import cv2
 import numpy as np
-import pyautogui
+try:
+    import pyautogui
+except Exception:  # Sin escritorio (p. ej. Linux headless) pyautogui no se puede importar
+    pyautogui = None
 from PIL import Image, ImageDraw
 import time
-import win32gui
-import win32con
+# Solo disponibles en Windows; el análisis de imágenes offline funciona sin ellos
+try:
+    import win32gui
+    import win32con
+except ImportError:
+    win32gui = win32con = None
+from frame_cache import FrameCache
+from detection_set import DetectionSet
+from instrumentation import count, traced
+from frame_source import resolve_frame_source
+from spatial_index import suppress_duplicates
+from template_matcher import TemplateLibrary
+from debug_writer import default_debug_writer
+
+# Rangos HSV de los botones (mínimo, máximo, clase); las clases se solapan
+UI_COLOR_RANGES = [
+    # Azules (botones Windows típicos)
+    ([100, 100, 150], [130, 255, 255], 'blue'),
+    
+    # Grises claros (botones estándar)
+    ([0, 0, 200], [180, 30, 255], 'gray_light'),
+    
+    # Grises medios 
+    ([0, 0, 120], [180, 50, 200], 'gray_medium'),
+    
+    # Blancos/Plateados (Windows 11)
+    ([0, 0, 240], [180, 15, 255], 'white'),
+]
+
+def build_color_luts(color_ranges):
+    """
+    Tablas por canal H, S, V (256 entradas): bit i activo si el valor cae en el
+    rango de la clase i. El AND de las tres da todas las clases de un píxel
+    """
+    if len(color_ranges) > 8:
+        raise ValueError("Como máximo 8 clases de color (una por bit)")
+    values = np.arange(256)
+    luts = np.zeros((3, 256), dtype=np.uint8)
+    for bit, (min_range, max_range, _) in enumerate(color_ranges):
+        for channel in range(3):
+            inside = (values >= min_range[channel]) & (values <= max_range[channel])
+            luts[channel][inside] |= 1 << bit
+    return luts
+
+def classify_colors(hsv, luts):
+    """Máscara de bits de clase por píxel en una sola pasada (tablas de consulta)"""
+    h, s, v = cv2.split(hsv)
+    labels = cv2.LUT(h, luts[0])
+    cv2.bitwise_and(labels, cv2.LUT(s, luts[1]), dst=labels)
+    cv2.bitwise_and(labels, cv2.LUT(v, luts[2]), dst=labels)
+    return labels
+
+def external_boxes(mask):
+    """Cajas (x, y, ancho, alto) de los contornos exteriores de una máscara"""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return np.array([cv2.boundingRect(contour) for contour in contours]).reshape(-1, 4)
+
+_UI_COLOR_LUTS = build_color_luts(UI_COLOR_RANGES)
 
 class ScreenshotAnalyzer:
-    def __init__(self):
+    def __init__(self, frame_source=None, debug_writer=None, template_library=None):
         # Configurar pyautogui
-        pyautogui.FAILSAFE = True
-        pyautogui.PAUSE = 0.5
+        if pyautogui is not None:
+            pyautogui.FAILSAFE = True
+            pyautogui.PAUSE = 0.5
+        
+        # De dónde salen las capturas (pantalla, directorio, video, generador)
+        self.frame_source = resolve_frame_source(frame_source)
+        
+        # Última captura analizada (RGB) e imágenes de debug en segundo plano
+        self.last_screenshot = None
+        self.debug_writer = debug_writer
+        
+        # Templates de botones precalculados (escalas de DPI 100/125/150%)
+        self.template_library = template_library if template_library is not None else TemplateLibrary()
+        self._template_names = {}
     
     def take_screenshot(self, region=None):
         """Tomar captura de pantalla completa o de region especifica"""
         try:
-            screenshot = pyautogui.screenshot(region=region)
-            return np.array(screenshot)
+            return self.frame_source.grab(region)
         except Exception as e:
             print(f"Error tomando screenshot: {e}")
             return None
@@ -39,125 +109,120 @@ class ScreenshotAnalyzer:
             print(f"Error obteniendo ventana activa: {e}")
             return None
     
+    @traced('analyzer.find_buttons_by_color')
     def find_buttons_by_color(self, image, button_color_range):
         """Detectar botones por rango de color con filtros mejorados"""
-        hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+        hsv = FrameCache.wrap(image, 'RGB').hsv()
         mask = cv2.inRange(hsv, button_color_range[0], button_color_range[1])
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return self._filter_button_boxes(DetectionSet.from_arrays(external_boxes(mask), 0.0), image.shape)
+    
+    @traced('analyzer.find_buttons_by_color_classes')
+    def find_buttons_by_color_classes(self, image, color_ranges=UI_COLOR_RANGES):
+        """
+        Botones de todas las clases de color a la vez: cada píxel se etiqueta con
+        sus clases en una sola pasada (memorizada en el frame) y luego se extraen
+        las regiones de cada clase a partir de su bit
+        """
+        frame = FrameCache.wrap(image, 'RGB')
+        if color_ranges is UI_COLOR_RANGES:
+            luts = _UI_COLOR_LUTS
+        else:
+            luts = build_color_luts(color_ranges)
+        labels = frame.memo(('color_classes', luts.tobytes()),
+                            lambda: classify_colors(frame.hsv(), luts))
         
-        buttons = []
-        image_height, image_width = image.shape[:2]
+        detected = []
+        for bit, (_, _, color_name) in enumerate(color_ranges):
+            mask = cv2.compare(cv2.bitwise_and(labels, 1 << bit), 0, cv2.CMP_GT)
+            boxes = external_boxes(mask)
+            for btn in self._filter_button_boxes(DetectionSet.from_arrays(boxes, 0.0), image.shape):
+                btn['type'] = 'button'
+                btn['color'] = color_name
+                detected.append(btn)
+        return detected
+    
+    def _filter_button_boxes(self, candidates, image_shape):
+        """Aplicar los filtros de tamaño/posición de botón a un DetectionSet de candidatos"""
+        image_height, image_width = image_shape[:2]
+        r = candidates.records
+        x, y, w, h = r['x'], r['y'], r['width'], r['height']
+        aspect_ratio = w / np.maximum(h, 1)
         
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            
-            # Filtros más estrictos para botones reales
-            # Tamaño: botones típicos entre 60-300px ancho, 20-80px alto
-            if (60 <= w <= 300 and 20 <= h <= 80 and
+        # Filtros más estrictos para botones reales
+        # Tamaño: botones típicos entre 60-300px ancho, 20-80px alto
+        keep = ((60 <= w) & (w <= 300) & (20 <= h) & (h <= 80) &
                 # No debe ser demasiado grande (evitar ventanas completas)
-                w < image_width * 0.4 and h < image_height * 0.3 and
+                (w < image_width * 0.4) & (h < image_height * 0.3) &
                 # Relación aspecto razonable para botones (no muy alargados)
-                2 <= w/h <= 8):
-                
-                # Verificar que no esté en los bordes (botones están dentro de ventanas)
-                margin = 10
-                if (x > margin and y > margin and 
-                    x + w < image_width - margin and 
-                    y + h < image_height - margin):
-                    
-                    buttons.append({
-                        'x': x, 
-                        'y': y, 
-                        'width': w, 
-                        'height': h,
-                        'area': w * h,
-                        'aspect_ratio': w / h
-                    })
+                (2 <= aspect_ratio) & (aspect_ratio <= 8))
+        
+        # Verificar que no esté en los bordes (botones están dentro de ventanas)
+        margin = 10
+        keep &= ((x > margin) & (y > margin) &
+                 (x + w < image_width - margin) & (y + h < image_height - margin))
         
         # Ordenar por tamaño (botones más pequeños primero, más probable que sean reales)
-        buttons.sort(key=lambda b: b['area'])
-        return buttons
+        selected = r[keep]
+        areas = selected['width'].astype(np.int64) * selected['height']
+        selected = selected[np.argsort(areas, kind='stable')]
+        
+        return [{
+            'x': x,
+            'y': y,
+            'width': w,
+            'height': h,
+            'area': w * h,
+            'aspect_ratio': w / h
+        } for x, y, w, h in zip(selected['x'].tolist(), selected['y'].tolist(),
+                                selected['width'].tolist(), selected['height'].tolist())]
+    
+    @traced('analyzer.find_template')
+    def find_template(self, template_path, threshold=0.8, screenshot=None):
+        """
+        Buscar template de imagen en pantalla (captura RGB opcional), en todas las
+        escalas de DPI de la librería. El template se carga solo la primera vez
+        """
+        name = self._template_names.get(template_path)
+        if name is None:
+            name = self.template_library.add_file(template_path, name=template_path)
+            if name is None:
+                return None
+            self._template_names[template_path] = name
+        
+        return self.find_templates(screenshot, threshold=threshold, names=[name])
     
-    def find_template(self, template_path, threshold=0.8):
-        """Buscar template de imagen en pantalla"""
-        screenshot = self.take_screenshot()
+    @traced('analyzer.find_templates')
+    def find_templates(self, screenshot=None, threshold=0.8, names=None):
+        """Buscar todos los templates de la librería (o solo names) en una misma captura"""
+        if screenshot is None:
+            screenshot = self.take_screenshot()
         if screenshot is None:
             return None
-            
-        template = cv2.imread(template_path)
-        if template is None:
-            print(f"No se pudo cargar template: {template_path}")
-            return None
-        
-        # Convertir a escala de grises
-        gray_screenshot = cv2.cvtColor(screenshot, cv2.COLOR_RGB2GRAY)
-        gray_template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
-        
-        # Buscar template
-        result = cv2.matchTemplate(gray_screenshot, gray_template, cv2.TM_CCOEFF_NORMED)
-        locations = np.where(result >= threshold)
         
-        matches = []
-        for pt in zip(*locations[::-1]):
-            matches.append({
-                'x': pt[0],
-                'y': pt[1],
-                'width': gray_template.shape[1],
-                'height': gray_template.shape[0],
-                'confidence': result[pt[1], pt[0]]
-            })
-        
-        return matches
+        # Pirámide gris de la captura compartida por todos los templates y escalas
+        frame = FrameCache.wrap(screenshot, 'RGB')
+        gray_pyramid = [frame.pyramid(level) for level in range(self.template_library.levels + 1)]
+        return self.template_library.match(gray_pyramid, threshold=threshold, names=names)
     
-    def detect_ui_elements(self):
-        """Detectar elementos basicos de UI con filtros mejorados"""
-        screenshot = self.take_screenshot()
+    @traced('analyzer.detect_ui_elements')
+    def detect_ui_elements(self, screenshot=None):
+        """Detectar elementos basicos de UI con filtros mejorados (captura RGB opcional)"""
+        if screenshot is None:
+            screenshot = self.take_screenshot()
         if screenshot is None:
             return []
+        self.last_screenshot = screenshot
         
-        elements = []
-        
-        # Rangos de color más específicos para botones reales
-        color_ranges = [
-            # Azules (botones Windows típicos)
-            ([100, 100, 150], [130, 255, 255], 'blue'),
-            
-            # Grises claros (botones estándar)
-            ([0, 0, 200], [180, 30, 255], 'gray_light'),
-            
-            # Grises medios 
-            ([0, 0, 120], [180, 50, 200], 'gray_medium'),
-            
-            # Blancos/Plateados (Windows 11)
-            ([0, 0, 240], [180, 15, 255], 'white'),
-        ]
+        # Compartir HSV/gris/bordes entre todas las pasadas sobre la captura
+        screenshot = FrameCache(screenshot, 'RGB')
+        count('pixels_processed', screenshot.shape[0] * screenshot.shape[1])
         
-        all_detected = []
+        # Rangos de color más específicos para botones reales (UI_COLOR_RANGES),
+        # clasificados todos en una sola pasada
+        all_detected = self.find_buttons_by_color_classes(screenshot)
         
-        for min_range, max_range, color_name in color_ranges:
-            buttons = self.find_buttons_by_color(screenshot, (np.array(min_range), np.array(max_range)))
-            for btn in buttons:
-                btn['type'] = 'button'
-                btn['color'] = color_name
-                all_detected.append(btn)
-        
-        # Eliminar duplicados (botones muy cercanos entre sí)
-        filtered_elements = []
-        for btn in all_detected:
-            is_duplicate = False
-            for existing in filtered_elements:
-                # Si están muy cerca, considerar como duplicado
-                distance = ((btn['x'] - existing['x'])**2 + (btn['y'] - existing['y'])**2)**0.5
-                overlap_x = max(0, min(btn['x'] + btn['width'], existing['x'] + existing['width']) - max(btn['x'], existing['x']))
-                overlap_y = max(0, min(btn['y'] + btn['height'], existing['y'] + existing['height']) - max(btn['y'], existing['y']))
-                overlap_area = overlap_x * overlap_y
-                
-                if distance < 30 or overlap_area > 0:
-                    is_duplicate = True
-                    break
-            
-            if not is_duplicate:
-                filtered_elements.append(btn)
+        # Eliminar duplicados (botones a menos de 30px o solapados con uno ya aceptado)
+        filtered_elements = suppress_duplicates(all_detected, 30, overlap=True)
         
         # Ordenar por posición (izq-derecha, arriba-abajo) para mejor orden de click
         filtered_elements.sort(key=lambda e: (e['y'], e['x']))
@@ -167,33 +232,22 @@ class ScreenshotAnalyzer:
         
         # Combinar ambos métodos y eliminar duplicados finales
         all_buttons = filtered_elements + edge_buttons
-        final_elements = []
-        
-        for btn in all_buttons:
-            is_duplicate = False
-            for existing in final_elements:
-                distance = ((btn['x'] - existing['x'])**2 + (btn['y'] - existing['y'])**2)**0.5
-                if distance < 50:  # Si están muy cerca, es duplicado
-                    is_duplicate = True
-                    break
-            if not is_duplicate:
-                final_elements.append(btn)
+        final_elements = suppress_duplicates(all_buttons, 50)  # Si están muy cerca, es duplicado
         
         # Ordenar y limitar
         final_elements.sort(key=lambda e: (e['y'], e['x']))
+        count('ui_candidates_before_dedup', len(all_detected) + len(edge_buttons))
+        count('ui_candidates_after_dedup', len(final_elements))
         return final_elements[:8]  # Máximo 8 elementos
     
+    @traced('analyzer.detect_buttons_by_edges')
     def detect_buttons_by_edges(self, screenshot):
         """Detectar botones usando detección de bordes"""
         try:
-            # Convertir a escala de grises
-            gray = cv2.cvtColor(screenshot, cv2.COLOR_RGB2GRAY)
+            frame = FrameCache.wrap(screenshot, 'RGB')
             
-            # Aplicar blur para suavizar
-            blurred = cv2.GaussianBlur(gray, (3, 3), 0)
-            
-            # Detección de bordes
-            edges = cv2.Canny(blurred, 50, 150)
+            # Detección de bordes sobre el gris suavizado (blur 3x3)
+            edges = frame.canny(50, 150, blur=3)
             
             # Encontrar contornos
             contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -232,12 +286,34 @@ class ScreenshotAnalyzer:
             print(f"Error en detección por bordes: {e}")
             return []
     
-    def save_screenshot_with_annotations(self, elements, filename="annotated_screenshot.png"):
-        """Guardar screenshot con elementos detectados marcados con mejor info"""
-        screenshot = self.take_screenshot()
+    @traced('debug.save_annotations')
+    def save_screenshot_with_annotations(self, elements, filename="annotated_screenshot.png",
+                                         screenshot=None):
+        """
+        Guardar screenshot con elementos detectados marcados con mejor info.
+        Dibuja sobre la captura analizada (screenshot RGB o la última de
+        detect_ui_elements) y escribe en segundo plano
+        """
+        if screenshot is None:
+            screenshot = self.last_screenshot
+        if screenshot is None:
+            screenshot = self.take_screenshot()
         if screenshot is None:
             return False
         
+        elements = [dict(element) for element in elements]
+        writer = self.debug_writer or default_debug_writer()
+        path = writer.submit(screenshot, lambda canvas: self._annotate(canvas, elements),
+                             filename, color_order='RGB')
+        if path is None:
+            print("Cola de debug llena, screenshot anotado descartado")
+            return False
+        
+        print(f"Screenshot anotado en cola: {path}")
+        return True
+    
+    def _annotate(self, screenshot, elements):
+        """Dibujar los elementos sobre una captura RGB y devolver la imagen anotada"""
         img = Image.fromarray(screenshot)
         draw = ImageDraw.Draw(img)
         
@@ -289,9 +365,7 @@ class ScreenshotAnalyzer:
                 draw.text((x, label_y), v_label, fill=outline_color)
                 draw.text((x, label_y + 15), info_label, fill=outline_color)
         
-        img.save(filename)
-        print(f"Screenshot anotado guardado como: {filename}")
-        return True
+        return np.array(img)
 
 # Ejemplo de uso
 if __name__ == "__main__":
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+Grabación compacta de sesiones de instalación
+Un solo archivo por sesión con frames (comprimidos, en delta contra el último
+keyframe), detecciones, estados y clicks con marca de tiempo, más un índice al
+final para acceder a cualquier paso directamente. La escritura ocurre en un
+hilo de fondo para no frenar el bucle de clicks
+
+Formato:
+    MAGIC
+    chunks: [tipo (4 bytes)][longitud (uint32)][payload]
+        FRAM: FRAME_HEADER + píxeles comprimidos con zlib (keyframe o delta)
+        EVNT: JSON (kind, step, time, data)
+        INDX: JSON comprimido con la posición de cada frame y evento
+    TRAILER: [posición del chunk INDX (uint64)][INDEX_MAGIC]
+
+Si la sesión no se cerró bien (sin índice), el lector reconstruye el índice
+recorriendo los chunks
+"""
+
+import json
+import mmap
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from instrumentation import span, count
+
+
+MAGIC = b'BOTSESS\x01'
+INDEX_MAGIC = b'BOTINDEX'
+CHUNK_HEADER = struct.Struct('<4sI')
+# índice, paso (-1 = ninguno), tiempo, alto, ancho, canales, es keyframe, posición del keyframe
+FRAME_HEADER = struct.Struct('<IidIIBBQ')
+TRAILER = struct.Struct('<Q8s')
+
+
+def _json_default(value):
+    # Escalares y arrays de NumPy dentro de las detecciones
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    try:
+        return value.item()
+    except AttributeError:
+        return str(value)
+
+
+class SessionRecorder:
+    """Grabador de sesiones con escritura en segundo plano"""
+
+    def __init__(self, path, keyframe_interval=30, compression_level=3, max_queue=64):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.compression_level = compression_level
+        self.current_step = None
+
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._offset = len(MAGIC)
+
+        # Estado del hilo de escritura
+        self._key_image = None
+        self._key_offset = None
+        self._since_key = 0
+        self._frames = []
+        self._events = []
+
+        self.dropped_frames = 0
+        self.dropped_events = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._writer_loop, name='session_recorder',
+                                        daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def set_step(self, step):
+        """Paso actual; se asigna a todo lo que se grabe a partir de ahora"""
+        self.current_step = step
+
+    def record_frame(self, image, color_order='RGB', step=None):
+        """
+        Encolar un frame (no se copia: no modificarlo después). Si la cola está
+        llena el frame se descarta en lugar de bloquear al llamador
+        """
+        if image is None or self._closed:
+            return False
+        item = ('frame', self._step(step), time.time(), image, color_order)
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped_frames += 1
+            count('recorder_dropped_frames')
+            return False
+
+    def record_event(self, kind, data, step=None):
+        """
+        Encolar un evento (detecciones, estado, click, nota...). Como los frames,
+        se descarta si la cola está llena para no bloquear el bucle de clicks
+        """
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(('event', self._step(step), time.time(), kind, data))
+            return True
+        except queue.Full:
+            self.dropped_events += 1
+            count('recorder_dropped_events')
+            return False
+
+    def record_detections(self, buttons, step=None):
+        return self.record_event('detections', [dict(button) for button in buttons or []], step)
+
+    def record_state(self, state, step=None):
+        return self.record_event('state', state, step)
+
+    def record_click(self, x, y, button='left', step=None, **info):
+        return self.record_event('click', dict(info, x=x, y=y, button=button), step)
+
+    def _step(self, step):
+        return self.current_step if step is None else step
+
+    def close(self):
+        """Vaciar la cola, escribir el índice y cerrar el archivo"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+        index = {'frames': self._frames, 'events': self._events}
+        payload = zlib.compress(json.dumps(index).encode('utf-8'))
+        index_offset = self._write_chunk(b'INDX', payload)
+        self._file.write(TRAILER.pack(index_offset, INDEX_MAGIC))
+        self._file.close()
+
+    def stats(self):
+        return {
+            'frames': len(self._frames),
+            'events': len(self._events),
+            'dropped_frames': self.dropped_frames,
+            'dropped_events': self.dropped_events,
+            'bytes': self._offset
+        }
+
+    def _writer_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                if item[0] == 'frame':
+                    self._write_frame(*item[1:])
+                else:
+                    self._write_event(*item[1:])
+            except Exception as e:
+                print(f"❌ Error grabando sesión: {e}")
+
+    def _write_chunk(self, kind, *parts):
+        offset = self._offset
+        length = sum(len(part) for part in parts)
+        self._file.write(CHUNK_HEADER.pack(kind, length))
+        for part in parts:
+            self._file.write(part)
+        self._offset += CHUNK_HEADER.size + length
+        return offset
+
+    def _write_frame(self, step, timestamp, image, color_order):
+        with span('recorder.encode_frame'):
+            image = np.ascontiguousarray(image)
+            if image.ndim == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+            elif color_order == 'BGR':
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+            # Keyframe al principio, al cambiar el tamaño y cada keyframe_interval
+            # frames; el resto es la diferencia (mod 256) contra el último keyframe,
+            # así cualquier frame se decodifica con dos lecturas
+            is_key = (self._key_image is None or self._key_image.shape != image.shape or
+                      self._since_key >= self.keyframe_interval)
+            if is_key:
+                pixels = image
+            else:
+                pixels = np.subtract(image, self._key_image, dtype=np.uint8)
+            data = zlib.compress(memoryview(pixels).cast('B'), self.compression_level)
+
+            height, width, channels = image.shape
+            offset = self._offset
+            key_offset = offset if is_key else self._key_offset
+            header = FRAME_HEADER.pack(len(self._frames), -1 if step is None else step,
+                                       timestamp, height, width, channels, is_key, key_offset)
+            self._write_chunk(b'FRAM', header, data)
+            self._file.flush()
+
+            if is_key:
+                self._key_image = image
+                self._key_offset = offset
+                self._since_key = 0
+            self._since_key += 1
+            self._frames.append([offset, step, timestamp])
+
+    def _write_event(self, step, timestamp, kind, data):
+        event = {'kind': kind, 'step': step, 'time': timestamp, 'data': data}
+        payload = json.dumps(event, default=_json_default).encode('utf-8')
+        offset = self._write_chunk(b'EVNT', payload)
+        self._file.flush()
+        self._events.append([offset, step, kind, timestamp])
+
+
+class SessionReader:
+    """Lector de sesiones grabadas (archivo mapeado en memoria)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"No es una sesión grabada: {path}")
+
+        index = self._read_index() or self._scan_index()
+        self.frames = index['frames']
+        self.events = index['events']
+
+        # Paso -> posiciones de sus frames y eventos
+        self._steps = {}
+        for i, (_, step, _) in enumerate(self.frames):
+            self._steps.setdefault(step, {'frames': [], 'events': []})['frames'].append(i)
+        for i, (_, step, _, _) in enumerate(self.events):
+            self._steps.setdefault(step, {'frames': [], 'events': []})['events'].append(i)
+
+        self._key_cache = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self.frames)
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def _chunk(self, offset):
+        kind, length = CHUNK_HEADER.unpack_from(self._mm, offset)
+        start = offset + CHUNK_HEADER.size
+        return kind, memoryview(self._mm)[start:start + length]
+
+    def _read_index(self):
+        if len(self._mm) < len(MAGIC) + TRAILER.size:
+            return None
+        index_offset, magic = TRAILER.unpack_from(self._mm, len(self._mm) - TRAILER.size)
+        if magic != INDEX_MAGIC:
+            return None
+        kind, payload = self._chunk(index_offset)
+        if kind != b'INDX':
+            return None
+        return json.loads(zlib.decompress(payload))
+
+    def _scan_index(self):
+        """Reconstruir el índice recorriendo los chunks (sesión sin cerrar)"""
+        frames, events = [], []
+        offset, end = len(MAGIC), len(self._mm)
+        while offset + CHUNK_HEADER.size <= end:
+            kind, length = CHUNK_HEADER.unpack_from(self._mm, offset)
+            if offset + CHUNK_HEADER.size + length > end:
+                break  # Chunk truncado
+            _, payload = self._chunk(offset)
+            if kind == b'FRAM':
+                _, step, timestamp = FRAME_HEADER.unpack_from(payload)[:3]
+                frames.append([offset, None if step < 0 else step, timestamp])
+            elif kind == b'EVNT':
+                event = json.loads(bytes(payload))
+                events.append([offset, event['step'], event['kind'], event['time']])
+            offset += CHUNK_HEADER.size + length
+        return {'frames': frames, 'events': events}
+
+    def _decode_pixels(self, offset):
+        _, payload = self._chunk(offset)
+        _, _, _, height, width, channels, is_key, key_offset = FRAME_HEADER.unpack_from(payload)
+        pixels = np.frombuffer(zlib.decompress(payload[FRAME_HEADER.size:]), dtype=np.uint8)
+        return pixels.reshape(height, width, channels), bool(is_key), key_offset
+
+    def frame(self, index):
+        """Frame RGB número index (keyframe + delta: como máximo dos lecturas)"""
+        with span('recorder.decode_frame'):
+            pixels, is_key, key_offset = self._decode_pixels(self.frames[index][0])
+            if is_key:
+                return pixels
+
+            # El último keyframe decodificado se reutiliza al leer en secuencia
+            cached_offset, key_image = self._key_cache
+            if cached_offset != key_offset:
+                key_image, _, _ = self._decode_pixels(key_offset)
+                self._key_cache = (key_offset, key_image)
+            return np.add(key_image, pixels, dtype=np.uint8)
+
+    def event(self, index):
+        """Evento número index como dict (kind, step, time, data)"""
+        _, payload = self._chunk(self.events[index][0])
+        return json.loads(bytes(payload))
+
+    def steps(self):
+        """Pasos grabados, en orden"""
+        return sorted(step for step in self._steps if step is not None)
+
+    def step(self, step):
+        """Último frame, detecciones, estado, clicks y demás eventos de un paso"""
+        entry = self._steps.get(step, {'frames': [], 'events': []})
+        events = [self.event(i) for i in entry['events']]
+
+        result = {
+            'step': step,
+            'frame_indices': entry['frames'],
+            'frame': self.frame(entry['frames'][-1]) if entry['frames'] else None,
+            'detections': None,
+            'state': None,
+            'clicks': [],
+            'events': events
+        }
+        for event in events:
+            if event['kind'] == 'detections':
+                result['detections'] = event['data']
+            elif event['kind'] == 'state':
+                result['state'] = event['data']
+            elif event['kind'] == 'click':
+                result['clicks'].append(event['data'])
+        return result
+
+    def iter_events(self, kind=None):
+        """Recorrer los eventos (opcionalmente solo los de un tipo)"""
+        for i, (_, _, event_kind, _) in enumerate(self.events):
+            if kind is None or event_kind == kind:
+                yield self.event(i)
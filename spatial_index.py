@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Índice espacial de rejilla uniforme para cajas (x, y, ancho, alto)
+Las consultas de vecinos (distancia entre esquinas superiores izquierdas) y de
+solapamiento solo miran las celdas que tocan, así que la eliminación de
+duplicados deja de comparar cada caja con todas las ya aceptadas
+"""
+
+import math
+
+
+class GridIndex:
+    """
+    Rejilla con celdas de cell_size píxeles. Cada caja se registra en las celdas
+    que cubre (consultas de solapamiento) y su esquina en una sola celda
+    (consultas de vecinos). Los elementos se identifican por orden de inserción
+    """
+
+    def __init__(self, cell_size=64):
+        if cell_size <= 0:
+            raise ValueError("cell_size debe ser positivo")
+        self.cell_size = cell_size
+        self.boxes = []
+        self.items = []
+        self._box_cells = {}
+        self._point_cells = {}
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _cell(self, value):
+        return int(value // self.cell_size)
+
+    def insert(self, box, item=None):
+        """Añadir una caja (x, y, ancho, alto); devuelve su identificador"""
+        x, y, w, h = box
+        index = len(self.boxes)
+        self.boxes.append((x, y, w, h))
+        self.items.append(item)
+
+        self._point_cells.setdefault((self._cell(x), self._cell(y)), []).append(index)
+        # Las cajas vacías no solapan con nada: solo se indexa su esquina
+        if w > 0 and h > 0:
+            for cy in range(self._cell(y), self._cell(y + h - 1) + 1):
+                for cx in range(self._cell(x), self._cell(x + w - 1) + 1):
+                    self._box_cells.setdefault((cx, cy), []).append(index)
+        return index
+
+    def neighbors(self, x, y, radius):
+        """Elementos cuya esquina superior izquierda está a distancia < radius de (x, y)"""
+        found = []
+        radius_sq = radius * radius
+        for cy in range(self._cell(y - radius), self._cell(y + radius) + 1):
+            for cx in range(self._cell(x - radius), self._cell(x + radius) + 1):
+                for index in self._point_cells.get((cx, cy), ()):
+                    bx, by = self.boxes[index][:2]
+                    if (bx - x) ** 2 + (by - y) ** 2 < radius_sq:
+                        found.append(index)
+        return found
+
+    def overlapping(self, box):
+        """Elementos cuya caja se solapa con área positiva con box"""
+        x, y, w, h = box
+        if w <= 0 or h <= 0:
+            return []
+        found = set()
+        for cy in range(self._cell(y), self._cell(y + h - 1) + 1):
+            for cx in range(self._cell(x), self._cell(x + w - 1) + 1):
+                for index in self._box_cells.get((cx, cy), ()):
+                    if index in found:
+                        continue
+                    bx, by, bw, bh = self.boxes[index]
+                    if min(x + w, bx + bw) > max(x, bx) and min(y + h, by + bh) > max(y, by):
+                        found.add(index)
+        return sorted(found)
+
+    def has_neighbor(self, box, radius, overlap=False):
+        """¿Hay algún elemento cerca de la esquina de box (o solapado, si overlap)?"""
+        if self.neighbors(box[0], box[1], radius):
+            return True
+        return overlap and bool(self.overlapping(box))
+
+
+def box_of(element):
+    """Caja (x, y, ancho, alto) de un elemento en formato dict"""
+    if 'bbox' in element:
+        return tuple(element['bbox'])
+    return element['x'], element['y'], element['width'], element['height']
+
+
+def suppress_duplicates(elements, radius, overlap=False, key=box_of, cell_size=None):
+    """
+    Eliminación voraz de duplicados en orden de entrada: un elemento se descarta
+    si alguno ya aceptado tiene la esquina a distancia < radius o (con overlap)
+    se solapa con él. Devuelve los elementos aceptados
+    """
+    index = GridIndex(cell_size or max(int(math.ceil(radius)), 1))
+    kept = []
+    for element in elements:
+        box = key(element)
+        if not index.has_neighbor(box, radius, overlap):
+            index.insert(box, element)
+            kept.append(element)
+    return kept
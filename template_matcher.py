@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Matching de templates con extracción de picos y búsqueda piramidal
+Busca en un frame reducido y refina a resolución completa solo alrededor de los
+picos gruesos, devolviendo un resultado por máximo local en vez de uno por píxel.
+TemplateLibrary precalcula las pirámides de una carpeta de templates en varias
+escalas de DPI y las busca todas contra una misma captura
+"""
+
+import glob
+import json
+import os
+
+import cv2
+import numpy as np
+
+from box_fusion import group_overlapping
+
+
+def build_pyramid(image, levels):
+    """Lista [nivel 0, nivel 1, ...] reduciendo con pyrDown"""
+    pyramid = [image]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def extract_peaks(response, threshold, min_distance=5):
+    """
+    Máximos locales del mapa de respuesta por encima del umbral.
+    Devuelve lista de (x, y, score) ordenada por score, separados al menos min_distance.
+    """
+    size = 2 * min_distance + 1
+    kernel = np.ones((size, size), dtype=np.uint8)
+    local_max = cv2.dilate(response, kernel)
+
+    ys, xs = np.nonzero((response >= threshold) & (response >= local_max))
+    if len(xs) == 0:
+        return []
+
+    scores = response[ys, xs]
+    order = np.argsort(-scores, kind='stable')
+    xs, ys, scores = xs[order], ys[order], scores[order]
+
+    # Las mesetas producen varios máximos iguales: quedarse con uno por vecindario
+    peaks = []
+    taken = np.zeros(len(xs), dtype=bool)
+    for i in range(len(xs)):
+        if taken[i]:
+            continue
+        peaks.append((int(xs[i]), int(ys[i]), float(scores[i])))
+        near = (np.abs(xs - xs[i]) <= min_distance) & (np.abs(ys - ys[i]) <= min_distance)
+        taken |= near
+
+    return peaks
+
+
+def match_template_pyramid(gray_pyramid, template_pyramid, threshold=0.6, levels=1,
+                           coarse_margin=0.1, min_distance=5):
+    """
+    Buscar un template de forma gruesa a fina.
+    gray_pyramid y template_pyramid son listas de niveles (ver build_pyramid).
+    Devuelve lista de (x, y, score) en coordenadas del nivel 0.
+    """
+    gray = gray_pyramid[0]
+    template = template_pyramid[0]
+    t_h, t_w = template.shape[:2]
+
+    # Bajar de nivel mientras el template siga siendo útil a esa escala
+    level = min(levels, len(gray_pyramid) - 1, len(template_pyramid) - 1)
+    while level > 0 and min(template_pyramid[level].shape[:2]) < 8:
+        level -= 1
+
+    if level == 0:
+        result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+        return extract_peaks(result, threshold, min_distance)
+
+    # Paso grueso: umbral relajado porque la reducción suaviza la respuesta
+    coarse = cv2.matchTemplate(gray_pyramid[level], template_pyramid[level], cv2.TM_CCOEFF_NORMED)
+    scale = 2 ** level
+    coarse_peaks = extract_peaks(coarse, threshold - coarse_margin, max(1, min_distance // scale))
+
+    # Paso fino: matching a resolución completa solo en una ventana alrededor de cada pico
+    radius = scale + 2
+    height, width = gray.shape[:2]
+    matches = []
+    for cx, cy, _ in coarse_peaks:
+        x0 = max(cx * scale - radius, 0)
+        y0 = max(cy * scale - radius, 0)
+        x1 = min(cx * scale + radius + t_w, width)
+        y1 = min(cy * scale + radius + t_h, height)
+        if x1 - x0 < t_w or y1 - y0 < t_h:
+            continue
+
+        roi_result = cv2.matchTemplate(gray[y0:y1, x0:x1], template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (px, py) = cv2.minMaxLoc(roi_result)
+        if score >= threshold:
+            matches.append((x0 + px, y0 + py, float(score)))
+
+    # Ventanas vecinas pueden refinar al mismo punto
+    matches.sort(key=lambda m: m[2], reverse=True)
+    unique = []
+    for match in matches:
+        if all(abs(match[0] - u[0]) > min_distance or abs(match[1] - u[1]) > min_distance
+               for u in unique):
+            unique.append(match)
+    return unique
+
+
+# Escalas de DPI de Windows en las que se buscan los templates (100%, 125%, 150%)
+DPI_SCALES = (1.0, 1.25, 1.5)
+LIBRARY_VERSION = 1
+
+
+def scale_template(template, scale):
+    """Redimensionar un template capturado al 100% a otra escala de DPI"""
+    if scale == 1.0:
+        return template
+    h, w = template.shape[:2]
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+    return cv2.resize(template, size, interpolation=interpolation)
+
+
+class TemplateLibrary:
+    """
+    Templates de botones cargados una sola vez, con su pirámide gris
+    precalculada en cada escala de DPI. match() busca todos (o algunos) contra
+    una misma captura y devuelve un resultado por botón encontrado, con su
+    escala y confianza. save()/load() guardan las pirámides en un .npz
+    """
+
+    def __init__(self, scales=DPI_SCALES, levels=1):
+        self.scales = tuple(float(scale) for scale in scales)
+        self.levels = levels
+        # nombre -> [(escala, pirámide), ...]
+        self.templates = {}
+        self.sources = {}
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __contains__(self, name):
+        return name in self.templates
+
+    def add(self, name, template):
+        """Añadir un template (gris o BGR) capturado al 100% de escala"""
+        if template.ndim == 3:
+            template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+        self.templates[name] = [(scale, build_pyramid(scale_template(template, scale), self.levels))
+                                for scale in self.scales]
+
+    def add_file(self, path, name=None):
+        """Cargar un template desde una imagen; devuelve su nombre o None"""
+        template = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if template is None:
+            print(f"No se pudo cargar template: {path}")
+            return None
+        name = name or os.path.splitext(os.path.basename(path))[0]
+        self.add(name, template)
+        stat = os.stat(path)
+        self.sources[name] = [os.path.abspath(path), stat.st_mtime, stat.st_size]
+        return name
+
+    def load_directory(self, path, pattern='*.png'):
+        """Cargar todas las imágenes del directorio (nombre = archivo sin extensión)"""
+        for file_path in sorted(glob.glob(os.path.join(path, pattern))):
+            self.add_file(file_path)
+        return self
+
+    @classmethod
+    def from_directory(cls, path, pattern='*.png', cache_path=None, scales=DPI_SCALES, levels=1):
+        """
+        Librería de un directorio. Con cache_path se reutiliza la librería
+        precalculada si sigue al día (mismos archivos, escalas y niveles) y si no,
+        se reconstruye y se guarda
+        """
+        if cache_path and os.path.exists(cache_path):
+            try:
+                library = cls.load(cache_path)
+                if library.scales == tuple(float(s) for s in scales) and library.levels == levels:
+                    current = {}
+                    for file_path in sorted(glob.glob(os.path.join(path, pattern))):
+                        stat = os.stat(file_path)
+                        name = os.path.splitext(os.path.basename(file_path))[0]
+                        current[name] = [os.path.abspath(file_path), stat.st_mtime, stat.st_size]
+                    if current == library.sources:
+                        return library
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Librería de templates inválida, reconstruyendo: {e}")
+
+        library = cls(scales=scales, levels=levels).load_directory(path, pattern)
+        if cache_path:
+            library.save(cache_path)
+        return library
+
+    def save(self, path):
+        """Guardar las pirámides precalculadas (arranque rápido con load)"""
+        meta = {'version': LIBRARY_VERSION, 'scales': self.scales, 'levels': self.levels,
+                'names': list(self.templates), 'sources': self.sources}
+        arrays = {'meta': np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)}
+        for i, name in enumerate(self.templates):
+            for j, (_, pyramid) in enumerate(self.templates[name]):
+                for level, plane in enumerate(pyramid):
+                    arrays[f't{i}_s{j}_l{level}'] = plane
+
+        temp_path = f"{path}.tmp.npz"
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as archive:
+            meta = json.loads(archive['meta'].tobytes().decode('utf-8'))
+            if meta.get('version') != LIBRARY_VERSION:
+                raise ValueError(f"Versión de librería no soportada: {meta.get('version')}")
+            library = cls(scales=meta['scales'], levels=meta['levels'])
+            library.sources = meta['sources']
+            for i, name in enumerate(meta['names']):
+                library.templates[name] = [
+                    (scale, [archive[f't{i}_s{j}_l{level}'] for level in range(library.levels + 1)])
+                    for j, scale in enumerate(library.scales)
+                ]
+        return library
+
+    def match(self, gray_pyramid, threshold=0.8, names=None, min_distance=5, overlap=0.5):
+        """
+        Buscar los templates en una captura (pirámide gris de la captura, niveles
+        0..levels). Entre escalas de un mismo template se queda con la coincidencia
+        más fuerte de cada zona. Devuelve dicts con name, x, y, width, height,
+        scale y confidence, ordenados por confianza
+        """
+        matches = []
+        for name in (names if names is not None else self.templates):
+            boxes, scores, scales = [], [], []
+            for scale, pyramid in self.templates[name]:
+                h, w = pyramid[0].shape[:2]
+                if h > gray_pyramid[0].shape[0] or w > gray_pyramid[0].shape[1]:
+                    continue
+                for x, y, score in match_template_pyramid(gray_pyramid, pyramid, threshold=threshold,
+                                                          levels=self.levels, min_distance=min_distance):
+                    boxes.append((x, y, w, h))
+                    scores.append(score)
+                    scales.append(scale)
+            if not boxes:
+                continue
+
+            # Supresión entre escalas: el primero (más fuerte) de cada grupo solapado
+            order = np.argsort(-np.asarray(scores), kind='stable')
+            labels = group_overlapping(np.asarray(boxes)[order], overlap)
+            _, first = np.unique(labels, return_index=True)
+            for i in order[first].tolist():
+                x, y, w, h = boxes[i]
+                matches.append({'name': name, 'x': x, 'y': y, 'width': w, 'height': h,
+                                'scale': scales[i], 'confidence': scores[i]})
+
+        matches.sort(key=lambda m: m['confidence'], reverse=True)
+        return matches
@@ -2,60 +2,350 @@
 import cv2
 import numpy as np
 import pytesseract
-import pyautogui
-from PIL import Image, ImageEnhance, ImageFilter
+try:
+    import pyautogui
+except Exception:  # Sin escritorio (p. ej. Linux headless) pyautogui no se puede importar
+    pyautogui = None
+from PIL import Image
 import re
-import win32gui
-import win32con
+import threading
+import time
+# Solo disponibles en Windows; el análisis de imágenes offline funciona sin ellos
+try:
+    import win32gui
+    import win32con
+except ImportError:
+    win32gui = win32con = None
+from instrumentation import span, count, traced
+from frame_source import resolve_frame_source
+from ocr_engine import resolve_ocr_pool
+from ocr_mosaic import build_mosaic_from_crops, clip_boxes, map_words_to_tiles, words_to_text
+from frame_cache import frame_hash
+from collections import deque
+
+# Pesos de PIL convert('L') en punto fijo de 16 bits, con el término de redondeo
+_PIL_GRAY_WEIGHTS = np.array([[19595, 38470, 7471, 0x8000]], dtype=np.float32)
+
+def pil_gray(image):
+    """Escala de grises idéntica a PIL convert('L') (ITU-R 601-2, mismo redondeo)"""
+    if isinstance(image, Image.Image):
+        return np.asarray(image if image.mode == 'L' else image.convert('L'))
+    if image.ndim == 2:
+        return image
+    # En float32 las sumas (< 2^24) son exactas: floor(suma / 65536) igual que PIL
+    weighted = cv2.transform(image[..., :3].astype(np.float32), _PIL_GRAY_WEIGHTS)
+    return cv2.multiply(weighted, 1 / 65536).astype(np.uint8)
+
+def enhance_lut(mean, contrast=2.0, brightness=1.2):
+    """
+    Tabla de 256 entradas equivalente a ImageEnhance.Contrast(contrast) seguido de
+    ImageEnhance.Brightness(brightness) para una imagen de media `mean`
+    (mismos cálculos en float32 con truncado que Image.blend)
+    """
+    values = np.arange(256, dtype=np.float32)
+    contrasted = np.float32(mean) + np.float32(contrast) * (values - np.float32(mean))
+    contrasted = np.clip(contrasted, 0, 255).astype(np.uint8)
+    brightened = np.float32(brightness) * contrasted.astype(np.float32)
+    return np.clip(brightened, 0, 255).astype(np.uint8)
+
+class OCRPreprocessor:
+    """
+    Preprocesado para OCR en una sola etapa: gris, contraste y brillo con una
+    tabla de 256 entradas (precalculada para cada media posible) y mediana 3x3,
+    sobre buffers de NumPy. Mismo resultado que la cadena de PIL (convert('L'),
+    Contrast, Brightness, MedianFilter). Acumula su propio tiempo de proceso
+    """
+    
+    def __init__(self, contrast=2.0, brightness=1.2, median_size=3):
+        self.median_size = median_size
+        # tables[media] = tabla de contraste+brillo para una imagen de esa media
+        self.tables = np.stack([enhance_lut(mean, contrast, brightness) for mean in range(256)])
+        
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.images = 0
+        self.pixels = 0
+        self.seconds = 0.0
+    
+    def _enhance(self, gray, out, scratch):
+        # El contraste de PIL se calcula sobre la media de cada imagen
+        mean = int(cv2.mean(gray)[0] + 0.5)
+        cv2.LUT(gray, self.tables[mean], dst=scratch)
+        cv2.medianBlur(scratch, self.median_size, dst=out)
+        return out
+    
+    def _record(self, start, images, pixels):
+        with self._lock:
+            self.calls += 1
+            self.images += images
+            self.pixels += pixels
+            self.seconds += time.perf_counter() - start
+    
+    def process(self, image, out=None):
+        """Preprocesar una imagen (RGB, gris o PIL); out: buffer de salida opcional"""
+        start = time.perf_counter()
+        gray = pil_gray(image)
+        if out is None:
+            out = np.empty(gray.shape[:2], dtype=np.uint8)
+        self._enhance(gray, out, np.empty_like(out))
+        self._record(start, 1, out.size)
+        return out
+    
+    def process_batch(self, images):
+        """
+        Preprocesar muchos recortes de una vez: todas las salidas son vistas de un
+        único buffer y la tabla intermedia reutiliza un solo búfer auxiliar
+        """
+        start = time.perf_counter()
+        grays = [pil_gray(image) for image in images]
+        sizes = [gray.shape[0] * gray.shape[1] for gray in grays]
+        buffer = np.empty(sum(sizes), dtype=np.uint8)
+        scratch = np.empty(max(sizes, default=0), dtype=np.uint8)
+        
+        results = []
+        offset = 0
+        for gray, size in zip(grays, sizes):
+            shape = gray.shape[:2]
+            out = buffer[offset:offset + size].reshape(shape)
+            results.append(self._enhance(gray, out, scratch[:size].reshape(shape)))
+            offset += size
+        
+        self._record(start, len(results), offset)
+        return results
+    
+    def timing(self):
+        """Tiempo acumulado: llamadas, imágenes, píxeles, ms por imagen y Mpx/s"""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'images': self.images,
+                'pixels': self.pixels,
+                'seconds': self.seconds,
+                'ms_per_image': self.seconds / self.images * 1000 if self.images else 0.0,
+                'megapixels_per_second': self.pixels / self.seconds / 1e6 if self.seconds else 0.0
+            }
+
+# Patrones de progreso precompilados
+PERCENT_PATTERN = re.compile(r'(\d+)%')
+INSTALLING_PATTERN = re.compile(r'installing|instalando', re.IGNORECASE)
+# Estados concretos; si hay varios gana el último de la lista (como antes)
+STATUS_PATTERNS = [
+    re.compile(r'copying|copiando', re.IGNORECASE),  # Copiando archivos
+    re.compile(r'extracting|extrayendo', re.IGNORECASE),  # Extrayendo
+    re.compile(r'configuring|configurando', re.IGNORECASE)  # Configurando
+]
+# Palabras que marcan la etiqueta de progreso al buscar su región
+PROGRESS_WORD_PATTERN = re.compile(r'\d+%|installing|instalando|copying|copiando|extracting|'
+                                   r'extrayendo|configuring|configurando', re.IGNORECASE)
+
+def parse_progress_text(text):
+    """Porcentaje y estado de instalación a partir del texto reconocido"""
+    progress_info = {
+        'percentage': None,
+        'status': 'unknown',
+        'is_installing': False
+    }
+    
+    match = PERCENT_PATTERN.search(text)
+    if match:
+        progress_info['percentage'] = int(match.group(1))
+    
+    if INSTALLING_PATTERN.search(text):
+        progress_info['is_installing'] = True
+        progress_info['status'] = 'installing'
+    
+    for pattern in STATUS_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            progress_info['is_installing'] = True
+            progress_info['status'] = match.group(0)
+    
+    return progress_info
+
+class ProgressTracker:
+    """
+    Seguimiento del progreso de instalación por región.
+    La primera vez busca la etiqueta de porcentaje/estado con un OCR de toda la
+    ventana (psm 6, como get_installation_progress); después solo captura y
+    reconoce esa región (relativa a la ventana, también con psm 6 porque puede
+    abarcar la línea de estado y la del porcentaje),
+    y ni siquiera hace OCR si sus píxeles no cambiaron. Guarda una serie
+    temporal de porcentajes para estimar velocidad y tiempo restante
+    """
+    
+    def __init__(self, extractor, history=240, rate_window=30.0, margin=6):
+        self.extractor = extractor
+        self.rate_window = rate_window
+        self.margin = margin
+        self.samples = deque(maxlen=history)
+        self.roi = None  # (x, y, ancho, alto) relativa a la ventana
+        self._last_digest = None
+        self._last_info = None
+        self.locates = 0
+        self.ocr_polls = 0
+        self.skipped_polls = 0
+    
+    def reset(self):
+        """
+        Olvidar la región (se vuelve a buscar en el próximo poll) y la serie de
+        porcentajes: la próxima etiqueta puede ser de otra barra de progreso
+        """
+        self.roi = None
+        self._last_digest = None
+        self._last_info = None
+        self.samples.clear()
+    
+    def locate(self, window):
+        """
+        Buscar la región de la etiqueta de progreso en una captura de la ventana.
+        Devuelve la información de progreso del texto completo
+        """
+        self.locates += 1
+        processed = self.extractor.preprocess_image_for_ocr(window)
+        count('ocr_invocations')
+        with span('ocr.image_to_data', config='--psm 6'):
+            data = self.extractor.ocr.image_to_data(processed, config='--psm 6', lang='eng+spa')
+        
+        words = [i for i, text in enumerate(data['text']) if str(text).strip()]
+        info = parse_progress_text(' '.join(str(data['text'][i]) for i in words))
+        
+        hits = [i for i in words if PROGRESS_WORD_PATTERN.search(str(data['text'][i]))]
+        if hits:
+            x0 = min(data['left'][i] for i in hits)
+            y0 = min(data['top'][i] for i in hits)
+            x1 = max(data['left'][i] + data['width'][i] for i in hits)
+            y1 = max(data['top'][i] + data['height'][i] for i in hits)
+            # Margen extra a lo ancho: el porcentaje crece ("9%" -> "100%")
+            pad_x = self.margin + (y1 - y0) * 2
+            height, width = window.shape[:2]
+            x0, y0 = max(x0 - pad_x, 0), max(y0 - self.margin, 0)
+            x1, y1 = min(x1 + pad_x, width), min(y1 + self.margin, height)
+            self.roi = (x0, y0, x1 - x0, y1 - y0)
+        return info
+    
+    def poll(self):
+        """
+        Progreso actual: mismo dict que get_installation_progress más rate
+        (% por segundo), eta (segundos), region y changed. Si falla la captura
+        o el OCR devuelve un resultado vacío, como get_installation_progress
+        """
+        try:
+            return self._poll()
+        except Exception as e:
+            print(f"Error detectando progreso: {e}")
+            return self._result(parse_progress_text(''), changed=False)
+    
+    def _poll(self):
+        window_region = self.extractor.window_region()
+        origin = window_region[:2] if window_region else (0, 0)
+        
+        if self.roi is None:
+            window = self.extractor.take_screenshot(window_region)
+            if window is None:
+                return self._result(parse_progress_text(''), changed=False)
+            info = self.locate(window)
+            self._last_digest = None
+        else:
+            x, y, w, h = self.roi
+            roi_image = self.extractor.take_screenshot((origin[0] + x, origin[1] + y, w, h))
+            if roi_image is None:
+                return self._result(parse_progress_text(''), changed=False)
+            
+            digest = frame_hash(roi_image)
+            if digest == self._last_digest and self._last_info is not None:
+                # Región idéntica: sin OCR
+                self.skipped_polls += 1
+                count('progress_polls_skipped')
+                return self._result(self._last_info, changed=False)
+            
+            self.ocr_polls += 1
+            info = parse_progress_text(self.extractor.extract_text_from_image(roi_image, config='--psm 6'))
+            if info['percentage'] is None and info['status'] == 'unknown':
+                # La etiqueta ya no está en la región (otra página): buscarla de nuevo
+                self.reset()
+            else:
+                self._last_digest = digest
+        
+        self._last_info = info
+        if info['percentage'] is not None:
+            self.samples.append((time.monotonic(), info['percentage']))
+        return self._result(info, changed=True)
+    
+    def rate(self):
+        """Velocidad en % por segundo (mínimos cuadrados sobre la ventana reciente)"""
+        if len(self.samples) < 2:
+            return None
+        newest = self.samples[-1][0]
+        recent = [(t, p) for t, p in self.samples if newest - t <= self.rate_window]
+        if len(recent) < 2:
+            return None
+        times = np.array([t for t, _ in recent]) - recent[0][0]
+        values = np.array([p for _, p in recent], dtype=np.float64)
+        spread = times - times.mean()
+        denominator = (spread ** 2).sum()
+        if denominator == 0:
+            return None
+        return float((spread * (values - values.mean())).sum() / denominator)
+    
+    def eta(self):
+        """Segundos estimados hasta el 100% (None si no avanza)"""
+        rate = self.rate()
+        if not rate or rate <= 0 or not self.samples:
+            return None
+        return max(0.0, (100 - self.samples[-1][1]) / rate)
+    
+    def _result(self, info, changed):
+        result = dict(info)
+        result.update(rate=self.rate(), eta=self.eta(), region=self.roi, changed=changed)
+        return result
 
 class TextExtractor:
-    def __init__(self, tesseract_path=None):
-        # Configurar ruta de Tesseract si es necesario
+    def __init__(self, tesseract_path=None, frame_source=None, ocr=None):
+        # Configurar ruta de Tesseract si es necesario (motor pytesseract)
         if tesseract_path:
             pytesseract.pytesseract.tesseract_cmd = tesseract_path
         
         # Configurar pyautogui
-        pyautogui.FAILSAFE = True
-        pyautogui.PAUSE = 0.5
+        if pyautogui is not None:
+            pyautogui.FAILSAFE = True
+            pyautogui.PAUSE = 0.5
+        
+        # De dónde salen las capturas (pantalla, directorio, video, generador)
+        self.frame_source = resolve_frame_source(frame_source)
+        
+        # Motores de OCR de larga vida (tesserocr en proceso o pytesseract)
+        self.ocr = resolve_ocr_pool(ocr)
+        
+        # Preprocesado fusionado (tabla de contraste/brillo + mediana)
+        self.preprocessor = OCRPreprocessor()
+        
+        # Seguimiento del progreso solo en la región de la etiqueta
+        self.progress_tracker = ProgressTracker(self)
     
     def take_screenshot(self, region=None):
         """Tomar captura de pantalla"""
         try:
-            screenshot = pyautogui.screenshot(region=region)
-            return np.array(screenshot)
+            return self.frame_source.grab(region)
         except Exception as e:
             print(f"Error tomando screenshot: {e}")
             return None
     
+    @traced('ocr.preprocess')
     def preprocess_image_for_ocr(self, image):
-        """Preprocesar imagen para mejorar OCR"""
-        # Convertir a PIL Image si es numpy array
-        if isinstance(image, np.ndarray):
-            pil_image = Image.fromarray(image)
-        else:
-            pil_image = image
-        
-        # Convertir a escala de grises
-        gray_image = pil_image.convert('L')
-        
-        # Mejorar contraste
-        enhancer = ImageEnhance.Contrast(gray_image)
-        contrast_image = enhancer.enhance(2.0)
-        
-        # Aumentar brillo
-        enhancer = ImageEnhance.Brightness(contrast_image)
-        bright_image = enhancer.enhance(1.2)
-        
-        # Aplicar filtro de suavizado
-        smooth_image = bright_image.filter(ImageFilter.MedianFilter())
-        
-        return smooth_image
+        """
+        Preprocesar imagen para mejorar OCR (gris, contraste x2, brillo x1.2 y
+        mediana 3x3 en una sola etapa). Devuelve un array gris uint8
+        """
+        return self.preprocessor.process(image)
     
     def extract_text_from_image(self, image, config='--psm 6'):
         """Extraer texto de imagen usando OCR"""
         try:
             processed_image = self.preprocess_image_for_ocr(image)
-            text = pytesseract.image_to_string(processed_image, config=config, lang='eng+spa')
+            count('ocr_invocations')
+            count('ocr_pixels', processed_image.size)
+            with span('ocr.image_to_string', config=config):
+                text = self.ocr.image_to_string(processed_image, config=config, lang='eng+spa')
             return text.strip()
         except Exception as e:
             print(f"Error en OCR: {e}")
@@ -69,8 +359,53 @@ class TextExtractor:
         
         return self.extract_text_from_image(screenshot)
     
-    def find_text_regions(self, image):
-        """Encontrar regiones que contienen texto"""
+    @traced('ocr.preprocess_regions')
+    def preprocess_regions(self, image, boxes):
+        """
+        Preprocesar varias regiones (x, y, w, h) de una misma imagen con el mismo
+        resultado que preprocess_image_for_ocr en cada recorte: gris una sola vez
+        para toda la imagen y los recortes en un solo lote
+        """
+        gray = pil_gray(image)
+        return self.preprocessor.process_batch([gray[y:y+h, x:x+w] for x, y, w, h in boxes])
+    
+    def extract_text_from_regions(self, image, boxes, config='--psm 11'):
+        """
+        OCR de muchas regiones con una sola llamada a Tesseract: los recortes
+        preprocesados se empaquetan en un mosaico y las palabras se devuelven a su
+        región. Devuelve el texto de cada región (en el orden de boxes)
+        """
+        boxes = list(boxes)
+        texts = [''] * len(boxes)
+        valid = [i for i, box in enumerate(boxes) if clip_boxes([box], image.shape)]
+        if not valid:
+            return texts
+        
+        try:
+            clipped = clip_boxes([boxes[i] for i in valid], image.shape)
+            crops = self.preprocess_regions(image, clipped)
+            mosaic, tiles = build_mosaic_from_crops(crops, clipped)
+            
+            count('ocr_invocations')
+            count('ocr_pixels', mosaic.shape[0] * mosaic.shape[1])
+            with span('ocr.image_to_data', config=config, crops=len(tiles)):
+                data = self.ocr.image_to_data(mosaic, config=config, lang='eng+spa')
+        except Exception as e:
+            print(f"Error en OCR por lotes: {e}")
+            return texts
+        
+        words_by_tile = {}
+        for word in map_words_to_tiles(data, tiles):
+            words_by_tile.setdefault(word['tile'], []).append(word)
+        for tile, words in words_by_tile.items():
+            texts[valid[tile]] = words_to_text(words)
+        return texts
+    
+    @traced('text.find_text_regions')
+    def find_text_regions(self, image, batch=True):
+        """Encontrar regiones que contienen texto (batch=False: una llamada OCR por región)"""
+        count('pixels_processed', image.shape[0] * image.shape[1])
+        
         # Convertir a escala de grises
         gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         
@@ -80,21 +415,26 @@ class TextExtractor:
         # Encontrar contornos
         contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
-        text_regions = []
+        # Filtrar por tamaño (probable texto)
+        boxes = []
         for contour in contours:
             x, y, w, h = cv2.boundingRect(contour)
-            
-            # Filtrar por tamaño (probable texto)
             if w > 30 and h > 10 and w < 800 and h < 100:
-                # Extraer región de texto
-                text_region = image[y:y+h, x:x+w]
-                text = self.extract_text_from_image(text_region)
-                
-                if text.strip():  # Solo si hay texto
-                    text_regions.append({
-                        'x': x, 'y': y, 'width': w, 'height': h,
-                        'text': text.strip()
-                    })
+                boxes.append((x, y, w, h))
+        
+        if batch:
+            # Todas las regiones en un solo mosaico y una sola llamada a Tesseract
+            texts = self.extract_text_from_regions(image, boxes)
+        else:
+            texts = [self.extract_text_from_image(image[y:y+h, x:x+w]) for x, y, w, h in boxes]
+        
+        text_regions = []
+        for (x, y, w, h), text in zip(boxes, texts):
+            if text.strip():  # Solo si hay texto
+                text_regions.append({
+                    'x': x, 'y': y, 'width': w, 'height': h,
+                    'text': text.strip()
+                })
         
         return text_regions
     
@@ -122,16 +462,25 @@ class TextExtractor:
         
         return matching_buttons
     
-    def extract_window_text(self):
-        """Extraer todo el texto de la ventana activa"""
+    def window_region(self):
+        """Región (x, y, ancho, alto) de la ventana activa, o None (toda la pantalla)"""
+        if win32gui is None:
+            return None
         try:
             hwnd = win32gui.GetForegroundWindow()
             window_rect = win32gui.GetWindowRect(hwnd)
-            
+        except Exception as e:
+            print(f"Error obteniendo ventana activa: {e}")
+            return None
+        return (window_rect[0], window_rect[1], 
+                window_rect[2] - window_rect[0], 
+                window_rect[3] - window_rect[1])
+    
+    def extract_window_text(self):
+        """Extraer todo el texto de la ventana activa"""
+        try:
             # Tomar screenshot solo de la ventana
-            region = (window_rect[0], window_rect[1], 
-                     window_rect[2] - window_rect[0], 
-                     window_rect[3] - window_rect[1])
+            region = self.window_region()
             
             text = self.extract_text_from_screen(region)
             return text
@@ -153,39 +502,16 @@ class TextExtractor:
         
         return self.find_buttons_with_text(common_texts)
     
-    def get_installation_progress(self):
-        """Detectar progreso de instalación"""
-        text = self.extract_window_text()
-        
-        # Patrones para detectar progreso
-        progress_patterns = [
-            r'(\d+)%',  # Porcentajes
-            r'(\d+)/(\d+)',  # Progreso tipo "5/10"
-            r'installing|instalando',  # Palabras de instalación
-            r'copying|copiando',  # Copiando archivos
-            r'extracting|extrayendo',  # Extrayendo
-            r'configuring|configurando'  # Configurando
-        ]
-        
-        progress_info = {
-            'percentage': None,
-            'status': 'unknown',
-            'is_installing': False
-        }
-        
-        for pattern in progress_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            if matches:
-                if pattern == r'(\d+)%':
-                    progress_info['percentage'] = int(matches[0])
-                elif 'install' in pattern.lower():
-                    progress_info['is_installing'] = True
-                    progress_info['status'] = 'installing'
-                elif any(word in pattern.lower() for word in ['copy', 'extract', 'config']):
-                    progress_info['is_installing'] = True
-                    progress_info['status'] = matches[0] if matches else 'processing'
-        
-        return progress_info
+    @traced('text.installation_progress')
+    def get_installation_progress(self, tracked=False):
+        """
+        Detectar progreso de instalación (todo el texto de la ventana en cada
+        llamada). Con tracked=True solo se reconoce la región de la etiqueta de
+        progreso y el dict incluye además rate, eta, region y changed
+        """
+        if tracked:
+            return self.progress_tracker.poll()
+        return parse_progress_text(self.extract_window_text())
 
 # Ejemplo de uso
 if __name__ == "__main__":
@@ -1,16 +1,28 @@
 # -*- coding: utf-8 -*-
 import cv2
-import numpy as np
-import pyautogui
+try:
+    import pyautogui
+except Exception:  # Sin escritorio (p. ej. Linux headless) pyautogui no se puede importar
+    pyautogui = None
 from PIL import Image, ImageDraw
-import win32gui
-import win32con
+# Solo disponibles en Windows; el análisis de imágenes offline funciona sin ellos
+try:
+    import win32gui
+    import win32con
+except ImportError:
+    win32gui = win32con = None
 import re
+from instrumentation import count, traced
+from frame_source import resolve_frame_source
 
 class SimpleTextExtractor:
-    def __init__(self):
-        pyautogui.FAILSAFE = True
-        pyautogui.PAUSE = 0.5
+    def __init__(self, frame_source=None):
+        if pyautogui is not None:
+            pyautogui.FAILSAFE = True
+            pyautogui.PAUSE = 0.5
+        
+        # De dónde salen las capturas (pantalla, directorio, video, generador)
+        self.frame_source = resolve_frame_source(frame_source)
         
         # Plantillas comunes de texto en botones (sin OCR)
         self.button_templates = {
@@ -27,8 +39,7 @@ class SimpleTextExtractor:
     def take_screenshot(self, region=None):
         """Tomar captura de pantalla"""
         try:
-            screenshot = pyautogui.screenshot(region=region)
-            return np.array(screenshot)
+            return self.frame_source.grab(region)
         except Exception as e:
             print(f"Error tomando screenshot: {e}")
             return None
@@ -101,12 +112,12 @@ class SimpleTextExtractor:
                 print("Región inválida, usando screenshot completo")
                 return self.take_screenshot()
             
-            screenshot = pyautogui.screenshot(region=region)
-            return np.array(screenshot)
+            return self.frame_source.grab(region)
         except Exception as e:
             print(f"Error tomando screenshot de ventana: {e}")
             return self.take_screenshot()  # Fallback a screenshot completo
     
+    @traced('text.window_text_win32')
     def get_window_text_win32(self):
         """Extraer texto usando Win32 API (más confiable que OCR)"""
         try:
@@ -233,12 +244,16 @@ class SimpleTextExtractor:
         print(f"Controles visualizados: {detected_count} de {len(controls)}")
         return True
     
-    def detect_button_regions(self):
-        """Detectar regiones de botones por forma y ubicación"""
-        screenshot = self.take_window_screenshot()  # Usar screenshot de ventana
+    @traced('text.detect_button_regions')
+    def detect_button_regions(self, screenshot=None):
+        """Detectar regiones de botones por forma y ubicación (captura RGB opcional)"""
+        if screenshot is None:
+            screenshot = self.take_window_screenshot()  # Usar screenshot de ventana
         if screenshot is None:
             return []
         
+        count('pixels_processed', screenshot.shape[0] * screenshot.shape[1])
+        
         # Convertir a escala de grises
         gray = cv2.cvtColor(screenshot, cv2.COLOR_RGB2GRAY)
         
@@ -266,14 +281,18 @@ class SimpleTextExtractor:
         
         return button_regions
     
-    def classify_buttons_by_position(self, button_regions):
-        """Clasificar botones según su posición en la ventana"""
+    @traced('text.classify_buttons_by_position')
+    def classify_buttons_by_position(self, button_regions, screen_size=None):
+        """Clasificar botones según su posición en la ventana (screen_size = (ancho, alto) opcional)"""
         if not button_regions:
             return []
         
         # Obtener dimensiones de pantalla
-        screenshot = self.take_screenshot()
-        screen_height, screen_width = screenshot.shape[:2]
+        if screen_size is None:
+            screenshot = self.take_screenshot()
+            screen_height, screen_width = screenshot.shape[:2]
+        else:
+            screen_width, screen_height = screen_size
         
         classified_buttons = []
         
@@ -305,12 +324,17 @@ class SimpleTextExtractor:
         
         return classified_buttons
     
+    @traced('text.find_installation_elements')
     def find_installation_elements(self):
         """Buscar elementos típicos de instaladores sin OCR"""
         # Combinar detección Win32 y análisis de posición
         controls = self.get_window_text_win32()
-        button_regions = self.detect_button_regions()
-        classified_buttons = self.classify_buttons_by_position(button_regions)
+        screenshot = self.take_window_screenshot()
+        if screenshot is None:
+            return {}
+        button_regions = self.detect_button_regions(screenshot)
+        height, width = screenshot.shape[:2]
+        classified_buttons = self.classify_buttons_by_position(button_regions, screen_size=(width, height))
         
         # Crear texto combinado para búsqueda
         all_text = ' '.join([control['text'] for control in controls if control.get('text')])
@@ -1,28 +1,56 @@
 # -*- coding: utf-8 -*-
-import pyautogui
-import win32gui
-import win32con
-import win32api
+try:
+    import pyautogui
+except Exception:  # Sin escritorio (p. ej. Linux headless) pyautogui no se puede importar
+    pyautogui = None
+# Solo disponibles en Windows; el análisis de imágenes offline funciona sin ellos
+try:
+    import win32gui
+    import win32con
+    import win32api
+except ImportError:
+    win32gui = win32con = win32api = None
 import time
 import ctypes
 import sys
 import os
 import cv2
 import numpy as np
-from PIL import Image, ImageGrab
-import pytesseract
+from PIL import Image
 from text_extractor_simple import SimpleTextExtractor
 from screenshot_analyzer import ScreenshotAnalyzer
-from ai_button_detector import AIButtonDetector
+from ai_button_detector import AIButtonDetector, CancelToken
+from frame_cache import FrameCache
+from instrumentation import span, count, traced, timed_sleep
+from frame_source import resolve_frame_source
+from session_recorder import SessionRecorder
+from contextlib import contextmanager
+import asyncio
+from async_installer import AsyncInstaller
+from ocr_engine import resolve_ocr_pool
 
 class UIClicker:
-    def __init__(self):
-        pyautogui.FAILSAFE = True
-        pyautogui.PAUSE = 1.0
+    def __init__(self, frame_source=None, recorder=None, debug_writer=None, ocr=None):
+        if pyautogui is not None:
+            pyautogui.FAILSAFE = True
+            pyautogui.PAUSE = 1.0
         
-        self.text_extractor = SimpleTextExtractor()
-        self.screenshot_analyzer = ScreenshotAnalyzer()
-        self.ai_detector = AIButtonDetector()
+        # Una sola fuente de frames compartida por todos los componentes
+        self.frame_source = resolve_frame_source(frame_source)
+        
+        self.text_extractor = SimpleTextExtractor(frame_source=self.frame_source)
+        self.screenshot_analyzer = ScreenshotAnalyzer(frame_source=self.frame_source,
+                                                      debug_writer=debug_writer)
+        # Motores de OCR compartidos por el detector y el análisis de texto
+        self.ocr = resolve_ocr_pool(ocr)
+        self.ai_detector = AIButtonDetector(frame_source=self.frame_source,
+                                            debug_writer=debug_writer, ocr=self.ocr)
+        
+        # Grabador de sesión opcional (frames, detecciones, estados y clicks)
+        self.recorder = recorder
+        
+        # Confianza con la que una coincidencia de texto detiene la detección en streaming
+        self.visual_match_confidence = 0.5
         
         self.setup_dpi_awareness()
     
@@ -60,17 +88,22 @@ class UIClicker:
             print(f"Error al reiniciar como admin: {e}")
             return False
     
-    def click_at_coordinates(self, x, y, button='left', clicks=1):
-        """Click en coordenadas específicas"""
+    def click_at_coordinates(self, x, y, button='left', clicks=1, pause=0.5):
+        """Click en coordenadas específicas (pause: espera posterior en segundos)"""
         try:
-            if button == 'left':
-                pyautogui.click(x, y, clicks=clicks, button='left')
-            elif button == 'right':
-                pyautogui.click(x, y, clicks=clicks, button='right')
-            else:
-                pyautogui.click(x, y, clicks=clicks)
+            with span('click', x=x, y=y, button=button):
+                if button == 'left':
+                    pyautogui.click(x, y, clicks=clicks, button='left')
+                elif button == 'right':
+                    pyautogui.click(x, y, clicks=clicks, button='right')
+                else:
+                    pyautogui.click(x, y, clicks=clicks)
+            count('clicks')
+            if self.recorder is not None:
+                self.recorder.record_click(x, y, button, clicks=clicks)
             
-            time.sleep(0.5)
+            if pause:
+                timed_sleep(pause)
             return True
         except Exception as e:
             print(f"Error en click: {e}")
@@ -114,39 +147,77 @@ class UIClicker:
     def send_button_message(self, hwnd):
         """Enviar mensaje BN_CLICKED al botón"""
         try:
-            win32api.SendMessage(hwnd, win32con.BM_CLICK, 0, 0)
-            time.sleep(0.5)
+            with span('click.bm_click'):
+                win32api.SendMessage(hwnd, win32con.BM_CLICK, 0, 0)
+            count('clicks')
+            if self.recorder is not None:
+                self.recorder.record_event('click', {'hwnd': hwnd, 'message': 'BM_CLICK'})
+            timed_sleep(0.5)
             return True
         except Exception:
             return False
     
+    @traced('install.visual_analysis')
     def find_button_by_visual_analysis(self, button_texts, save_screenshot=False):
-        """Encontrar botón usando análisis visual con opción de screenshot"""
+        """
+        Encontrar botón usando análisis visual con opción de screenshot.
+        Los métodos se consumen en streaming (OCR primero): en cuanto aparece un
+        botón con el texto buscado y confianza suficiente se cancela el resto
+        """
         try:
-            # Usar el nuevo método detect_buttons que incluye screenshot automático
-            ai_buttons = self.ai_detector.detect_buttons(save_screenshot=save_screenshot)
-            if not ai_buttons:
+            captures = self.ai_detector.capture_window_smart()
+            if not captures:
                 return None
-            
-            # Buscar botón que coincida con el texto
-            for button in ai_buttons:
-                for text in button_texts:
-                    if text.lower() in str(button.get('text', '')).lower():
-                        return {'x': button['center_x'], 'y': button['center_y']}
+            image = captures[0][1]
+            
+            # El texto de los botones solo lo aporta el OCR: que sea el primero
+            methods = sorted(self.ai_detector.detection_methods,
+                             key=lambda m: m != 'text_based_detection')
+            texts = [text.lower() for text in button_texts]
+            cancel = CancelToken()
+            
+            buttons = []
+            match = None
+            stream = self.ai_detector.iter_detections(image, cancel=cancel, methods=methods)
+            for detection_method, buttons in stream:
+                for button in buttons:
+                    button_text = str(button.get('text', '')).lower()
+                    if (button['confidence'] >= self.visual_match_confidence and
+                            any(text in button_text for text in texts)):
+                        match = button
+                        break
+                if match is not None:
+                    print(f"⚡ Coincidencia '{match.get('text')}' tras {detection_method}, "
+                          f"se cancelan los métodos restantes")
+                    cancel.cancel()
+                    break
+            stream.close()
+            
+            buttons = [b for b in buttons if b['confidence'] >= 0.3]
+            if save_screenshot and buttons:
+                self.ai_detector.save_detection_debug(buttons, "button_detection.png", image=image)
             
             # Si no hay coincidencia por texto, usar el primer botón detectado
-            if ai_buttons:
-                return {'x': ai_buttons[0]['center_x'], 'y': ai_buttons[0]['center_y']}
+            if match is None and buttons:
+                # Sin texto OCR los botones se llaman Button_N, como en detect_buttons
+                for i, button in enumerate(buttons):
+                    button_text = str(button.get('text', f'Button_{i+1}')).lower()
+                    if any(text in button_text for text in texts):
+                        match = button
+                        break
+                else:
+                    match = buttons[0]
             
-            return None
+            if match is None:
+                return None
+            return {'x': match['center'][0], 'y': match['center'][1]}
             
         except Exception as e:
             print(f"Error en análisis visual: {e}")
             return None
     
-    def click_button_by_text(self, button_text, save_screenshot=False):
-        """Click en botón por texto priorizando análisis visual con opción de screenshot"""
-        # Método 1: Análisis visual (prioritario para Windows 11)
+    def button_variations(self, button_text):
+        """Textos alternativos con los que puede aparecer un botón"""
         button_variations = [button_text]
         if button_text == 'next':
             button_variations.extend(['continue', 'continuar', 'siguiente'])
@@ -156,6 +227,12 @@ class UIClicker:
             button_variations.extend(['aceptar', 'ok', 'yes'])
         elif button_text == 'finish':
             button_variations.extend(['finalizar', 'close', 'cerrar'])
+        return button_variations
+    
+    def click_button_by_text(self, button_text, save_screenshot=False):
+        """Click en botón por texto priorizando análisis visual con opción de screenshot"""
+        # Método 1: Análisis visual (prioritario para Windows 11)
+        button_variations = self.button_variations(button_text)
         
         visual_button = self.find_button_by_visual_analysis(button_variations, save_screenshot)
         if visual_button:
@@ -203,17 +280,22 @@ class UIClicker:
                 return True
         return False
     
-    def detect_progress_bar(self):
-        """Detectar barras de progreso en pantalla"""
+    @traced('install.progress_bar')
+    def detect_progress_bar(self, screenshot=None):
+        """Detectar barras de progreso en pantalla (captura RGB opcional)"""
         try:
-            screenshot = np.array(ImageGrab.grab())
-            gray = cv2.cvtColor(screenshot, cv2.COLOR_RGB2GRAY)
+            if screenshot is None:
+                screenshot = self.frame_source.grab()
+            if screenshot is None:
+                return {'found': False, 'is_active': False, 'progress': 0}
+            frame = FrameCache(screenshot, 'RGB')
+            gray = frame.gray()
             
             # Buscar patrones típicos de barras de progreso
             progress_bars = []
             
             # Método 1: Detectar rectángulos largos y estrechos
-            edges = cv2.Canny(gray, 50, 150)
+            edges = frame.canny(50, 150)
             contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             
             for contour in contours:
@@ -299,7 +381,7 @@ class UIClicker:
                 
                 # Si el progreso llegó al 100%, esperar un poco más y verificar
                 if current_progress >= 99:
-                    time.sleep(3)
+                    timed_sleep(3)
                     # Verificar si cambió el estado de la ventana
                     new_state = self.detect_installation_state()
                     if new_state in ['finished', 'waiting']:
@@ -322,7 +404,7 @@ class UIClicker:
                     print("✅ Proceso completado (sin barra visible)")
                     return True
             
-            time.sleep(check_interval)
+            timed_sleep(check_interval)
         
         print("⚠️ Timeout esperando progreso")
         return False
@@ -359,21 +441,36 @@ class UIClicker:
             print(f"❌ Error generando diagnóstico: {e}")
             return False
 
+    @traced('install.detect_state')
     def detect_installation_state(self):
         """Detectar el estado actual de la instalación con análisis avanzado"""
         try:
+            # Una sola captura para los tres análisis (y un solo frame por paso en replay)
+            screenshot = self.frame_source.grab()
+            if screenshot is None:
+                return 'unknown'
+            
             # Método 1: Análisis de botones disponibles (más confiable en Win11)
-            ai_buttons = self.ai_detector.detect_buttons(save_screenshot=False)
+            ai_buttons = self.ai_detector.detect_buttons(save_screenshot=False, screenshot=screenshot)
             button_analysis = self._analyze_available_buttons(ai_buttons)
             
             # Método 2: Detección de barras de progreso
-            progress_info = self.detect_progress_bar()
+            progress_info = self.detect_progress_bar(screenshot)
             
             # Método 3: Análisis de texto en pantalla
-            screen_text = self._analyze_screen_text()
+            screen_text = self._analyze_screen_text(screenshot)
             
             # Combinar toda la información para determinar el estado
-            return self._determine_state_from_analysis(button_analysis, progress_info, screen_text)
+            state = self._determine_state_from_analysis(button_analysis, progress_info, screen_text)
+            
+            if self.recorder is not None:
+                self.recorder.record_frame(screenshot)
+                self.recorder.record_detections(ai_buttons)
+                self.recorder.record_event('analysis', {'progress': progress_info,
+                                                        'screen_text': screen_text})
+                self.recorder.record_state(state)
+            
+            return state
             
         except Exception as e:
             print(f"Error detectando estado: {e}")
@@ -406,14 +503,21 @@ class UIClicker:
         
         return button_info
     
-    def _analyze_screen_text(self):
-        """Analizar texto en pantalla usando OCR avanzado"""
+    @traced('install.screen_text')
+    def _analyze_screen_text(self, screenshot=None):
+        """Analizar texto en pantalla usando OCR avanzado (captura RGB opcional)"""
         try:
-            screenshot = np.array(ImageGrab.grab())
+            if screenshot is None:
+                screenshot = self.frame_source.grab()
+            if screenshot is None:
+                return {}
             gray = cv2.cvtColor(screenshot, cv2.COLOR_RGB2GRAY)
             
             # OCR para detectar texto relevante
-            text_data = pytesseract.image_to_string(gray, config='--psm 6').lower()
+            count('ocr_invocations')
+            count('ocr_pixels', gray.shape[0] * gray.shape[1])
+            with span('ocr.image_to_string', config='--psm 6'):
+                text_data = self.ocr.image_to_string(gray, config='--psm 6').lower()
             
             analysis = {
                 'installing': any(word in text_data for word in ['installing', 'instalando', 'copying', 'copiando', 'extracting']),
@@ -459,104 +563,158 @@ class UIClicker:
         
         return 'waiting'
     
-    def auto_install(self, max_steps=20):
+    @contextmanager
+    def recording(self, path, **kwargs):
+        """Grabar la sesión en un archivo mientras dure el bloque"""
+        previous = self.recorder
+        recorder = SessionRecorder(path, **kwargs)
+        self.recorder = recorder
+        try:
+            yield recorder
+        finally:
+            self.recorder = previous
+            recorder.close()
+            stats = recorder.stats()
+            print(f"🎞️ Sesión grabada en {path}: {stats['frames']} frames, "
+                  f"{stats['events']} eventos ({stats['bytes'] / 1e6:.1f} MB)")
+    
+    def auto_install(self, max_steps=20, record_path=None):
         """Instalación automática inteligente con análisis avanzado"""
+        if record_path:
+            with self.recording(record_path):
+                return self.auto_install(max_steps)
+        
         print("🚀 Iniciando instalación automática inteligente...")
         
         for step in range(max_steps):
-            print(f"\n--- Paso {step + 1}/{max_steps} ---")
-            
-            state = self.detect_installation_state()
-            print(f"🔍 Estado detectado: {state}")
-            
-            # Manejo inteligente de estados
-            if state == 'installing':
-                print("⏳ Instalación en progreso, esperando con monitoreo...")
-                if self.wait_for_progress_completion():
-                    print("✅ Progreso completado, continuando...")
-                    continue
-                else:
-                    print("⚠️ Progreso tomó demasiado tiempo, verificando estado...")
-                    time.sleep(3)
-                    continue
-                    
-            elif state == 'finished':
-                print("🎉 Instalación completada")
-                if self.click_finish_button():
-                    print("✅ Instalación finalizada exitosamente")
-                    return True
-                else:
-                    print("⚠️ No se pudo hacer click en Finish, intentando cerrar...")
-                    if self.click_button_by_text('close', save_screenshot=True):
-                        return True
-                break
-                
-            elif state == 'error':
-                print("❌ Error detectado en la instalación")
-                self.generate_button_diagnostic(f"error_step_{step+1}_diagnostic.png")
-                break
-                
-            elif state == 'ready_to_install':
-                print("📦 Listo para instalar")
-                if self.click_install_button():
-                    print("🔨 Botón Install clickeado, esperando inicio...")
-                    time.sleep(3)
-                    continue
-            
-            # Intentar avanzar según prioridades
-            actions_tried = []
-            
-            # Prioridad 1: Aceptar términos si es necesario
-            if self.click_button_by_text('accept', save_screenshot=True):
-                print("📝 Términos aceptados")
-                actions_tried.append('accept')
-                time.sleep(2)
-                continue
-            
-            # Prioridad 2: Continuar/Next
-            if self.click_button_by_text('next', save_screenshot=True):
-                print("▶️ Avanzando al siguiente paso")
-                actions_tried.append('next')
-                time.sleep(2)
-                continue
-            
-            # Prioridad 3: Instalar
-            if self.click_button_by_text('install', save_screenshot=True):
-                print("🔨 Iniciando instalación")
-                actions_tried.append('install')
-                time.sleep(3)
-                continue
-            
-            # Prioridad 4: Intentar con variaciones de continue
-            if self.click_button_by_text('continue', save_screenshot=True):
-                print("▶️ Continuando proceso")
-                actions_tried.append('continue')
-                time.sleep(2)
-                continue
-            
-            # Si no se pudo hacer nada, generar diagnóstico
-            print("⚠️ No se encontraron acciones válidas")
-            print(f"🔍 Acciones intentadas: {actions_tried}")
-            print("📸 Generando diagnóstico avanzado...")
-            
-            self.generate_button_diagnostic(f"install_step_{step+1}_diagnostic.png")
-            
-            # Dar una oportunidad más esperando un poco
-            print("⏳ Esperando 5 segundos por si hay cambios...")
-            time.sleep(5)
-            
-            # Verificar si cambió el estado
-            new_state = self.detect_installation_state()
-            if new_state != state:
-                print(f"🔄 Estado cambió de {state} a {new_state}, continuando...")
-                continue
-            else:
-                print("❌ Sin cambios detectados, finalizando...")
+            if self.recorder is not None:
+                self.recorder.set_step(step + 1)
+            with span('install.step', step=step + 1) as step_span:
+                outcome = self._install_step(step, max_steps, step_span)
+            if outcome is True:
+                return True
+            if outcome is False:
                 break
         
         print("🏁 Instalación automática finalizada")
         return False
     
+    def _install_step(self, step, max_steps, step_span):
+        """
+        Un paso de auto_install: True si la instalación terminó, False para
+        detenerse y None para seguir con el paso siguiente
+        """
+        print(f"\n--- Paso {step + 1}/{max_steps} ---")
+        
+        state = self.detect_installation_state()
+        step_span.set('state', state)
+        print(f"🔍 Estado detectado: {state}")
+        
+        # Manejo inteligente de estados
+        if state == 'installing':
+            print("⏳ Instalación en progreso, esperando con monitoreo...")
+            if self.wait_for_progress_completion():
+                print("✅ Progreso completado, continuando...")
+                return None
+            else:
+                print("⚠️ Progreso tomó demasiado tiempo, verificando estado...")
+                timed_sleep(3)
+                return None
+                
+        elif state == 'finished':
+            print("🎉 Instalación completada")
+            if self.click_finish_button():
+                print("✅ Instalación finalizada exitosamente")
+                return True
+            else:
+                print("⚠️ No se pudo hacer click en Finish, intentando cerrar...")
+                if self.click_button_by_text('close', save_screenshot=True):
+                    return True
+            return False
+            
+        elif state == 'error':
+            print("❌ Error detectado en la instalación")
+            self.generate_button_diagnostic(f"error_step_{step+1}_diagnostic.png")
+            return False
+            
+        elif state == 'ready_to_install':
+            print("📦 Listo para instalar")
+            if self.click_install_button():
+                print("🔨 Botón Install clickeado, esperando inicio...")
+                timed_sleep(3)
+                return None
+        
+        # Intentar avanzar según prioridades
+        actions_tried = []
+        
+        # Prioridad 1: Aceptar términos si es necesario
+        if self.click_button_by_text('accept', save_screenshot=True):
+            print("📝 Términos aceptados")
+            actions_tried.append('accept')
+            timed_sleep(2)
+            return None
+        
+        # Prioridad 2: Continuar/Next
+        if self.click_button_by_text('next', save_screenshot=True):
+            print("▶️ Avanzando al siguiente paso")
+            actions_tried.append('next')
+            timed_sleep(2)
+            return None
+        
+        # Prioridad 3: Instalar
+        if self.click_button_by_text('install', save_screenshot=True):
+            print("🔨 Iniciando instalación")
+            actions_tried.append('install')
+            timed_sleep(3)
+            return None
+        
+        # Prioridad 4: Intentar con variaciones de continue
+        if self.click_button_by_text('continue', save_screenshot=True):
+            print("▶️ Continuando proceso")
+            actions_tried.append('continue')
+            timed_sleep(2)
+            return None
+        
+        # Si no se pudo hacer nada, generar diagnóstico
+        print("⚠️ No se encontraron acciones válidas")
+        print(f"🔍 Acciones intentadas: {actions_tried}")
+        print("📸 Generando diagnóstico avanzado...")
+        
+        self.generate_button_diagnostic(f"install_step_{step+1}_diagnostic.png")
+        
+        # Dar una oportunidad más esperando un poco
+        print("⏳ Esperando 5 segundos por si hay cambios...")
+        timed_sleep(5)
+        
+        # Verificar si cambió el estado
+        new_state = self.detect_installation_state()
+        if new_state != state:
+            print(f"🔄 Estado cambió de {state} a {new_state}, continuando...")
+            return None
+        else:
+            print("❌ Sin cambios detectados, finalizando...")
+            return False
+    
+    def auto_install_async(self, max_steps=20, timeout=None, record_path=None, **options):
+        """
+        Instalación automática con el orquestador asyncio (sin esperas fijas).
+        timeout limita la duración total; options se pasan a AsyncInstaller
+        """
+        if record_path:
+            with self.recording(record_path):
+                return self.auto_install_async(max_steps, timeout, **options)
+        
+        installer = AsyncInstaller(self, **options)
+        coroutine = installer.run(max_steps)
+        if timeout:
+            coroutine = asyncio.wait_for(coroutine, timeout)
+        try:
+            return asyncio.run(coroutine)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Instalación automática cancelada tras {timeout} s")
+            return False
+    
+    @traced('install.completion_check')
     def is_installation_complete(self):
         """Verificar si la instalación está completamente terminada"""
         try:
@@ -648,7 +806,7 @@ class UIClicker:
                     return True  # Considerar exitoso de cualquier manera
             else:
                 print("⏳ Instalación aún no completa, esperando...")
-                time.sleep(3)
+                timed_sleep(3)
         
         print("⚠️ No se pudo confirmar finalización completa")
         return False
@@ -683,6 +841,7 @@ if __name__ == "__main__":
     print("8 - Detectar barra de progreso")
     print("9 - Esperar finalización de progreso")
     print("A - Manejo inteligente de finalización")
+    print("B - Instalación automática (asyncio)")
     print("0 - Salir")
     
     while True:
@@ -720,6 +879,8 @@ if __name__ == "__main__":
                     print("✅ Progreso completado exitosamente")
                 else:
                     print("⚠️ Progreso no completado o timeout")
+            elif command.lower() == 'b':
+                clicker.auto_install_async()
             elif command.lower() == 'a':
                 success = clicker.smart_completion_handler()
                 if success: